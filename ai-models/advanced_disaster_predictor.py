@@ -1,19 +1,113 @@
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
-from sklearn.model_selection import train_test_split, cross_val_score
+from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
+from threadpoolctl import threadpool_limits
 import xgboost as xgb
 import lightgbm as lgb
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
 import joblib
+import hashlib
 import requests
 import json
 from datetime import datetime, timedelta
 import os
+import threading
+import time
+
+RISK_LEVELS = ['low', 'medium', 'high', 'critical']
+RISK_THRESHOLDS = [0.2, 0.5, 0.8]
+
+# Hyperparameters used when no tuned configuration is available; tuned values
+# from hyperparameter_search.py are merged over these per disaster type
+DEFAULT_HYPERPARAMETERS = {
+    'rf': {
+        'n_estimators': 200,
+        'max_depth': 20,
+        'min_samples_split': 5,
+        'min_samples_leaf': 2
+    },
+    'xgb': {
+        'n_estimators': 200,
+        'max_depth': 10,
+        'learning_rate': 0.1,
+        'subsample': 0.8,
+        'colsample_bytree': 0.8
+    },
+    'lgb': {
+        'n_estimators': 200,
+        'max_depth': 10,
+        'learning_rate': 0.1,
+        'num_leaves': 31
+    },
+    'nn': {
+        'epochs': 50,
+        'batch_size': 128,
+        'learning_rate': 0.001
+    }
+}
+
+# Neural network training throughput. Batches are NN_BATCH_SCALE times the
+# tuned batch_size with the learning rate scaled by the square root of that
+# factor (Adam). NN_JIT_COMPILE enables XLA for the training step; it is off by
+# default because XLA's dropout RNG is slow on CPU (see benchmark_nn_training.py).
+NN_BATCH_SCALE = int(os.getenv('NN_BATCH_SCALE', '4'))
+NN_JIT_COMPILE = os.getenv('NN_JIT_COMPILE', 'false').lower() in ('1', 'true', 'yes', 'on')
+
+def configure_tf_threads(intra_op=None, inter_op=None):
+    """Set TensorFlow's thread pools; must run before TensorFlow executes any op
+    
+    A small dense network has few independent ops to run concurrently, so
+    every core goes to intra-op (matrix multiply) parallelism and inter-op
+    defaults to 2, enough to overlap the prefetched input pipeline with the
+    training step. Returns False if TensorFlow had already initialized its pools.
+    """
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op or os.cpu_count() or 1)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op or 2)
+        return True
+    except RuntimeError:
+        return False
+
+def configure_worker_threads(threads):
+    """Cap a pool worker process at `threads` native threads
+    
+    Meant for process pool initializers. Thread environment variables set
+    there come too late: a spawned worker has already re-imported the parent's
+    main module, and with it BLAS, OpenMP and possibly TensorFlow. threadpoolctl
+    resizes the loaded BLAS/OpenMP pools instead (tasks run on the worker's
+    main thread), and TensorFlow's pools are set before the worker runs an op.
+    """
+    threadpool_limits(threads)
+    return configure_tf_threads(threads, min(threads, 2))
+
+def build_model(family, params, n_jobs=-1):
+    """Instantiate an unfitted tree model for a family ('rf', 'xgb', 'lgb')"""
+    if family == 'rf':
+        return RandomForestClassifier(random_state=42, n_jobs=n_jobs, **params)
+    if family == 'xgb':
+        return xgb.XGBClassifier(
+            random_state=42,
+            use_label_encoder=False,
+            eval_metric='logloss',
+            n_jobs=n_jobs,
+            **params
+        )
+    if family == 'lgb':
+        return lgb.LGBMClassifier(random_state=42, verbose=-1, n_jobs=n_jobs, **params)
+    raise ValueError(f"Unknown model family: {family}")
+
+# Short model keys used in self.models mapped to the names used in API responses
+MODEL_NAMES = {
+    'rf': 'random_forest',
+    'xgb': 'xgboost',
+    'lgb': 'lightgbm',
+    'nn': 'neural_network'
+}
 
 class AdvancedDisasterPredictor:
     def __init__(self):
@@ -87,8 +181,38 @@ class AdvancedDisasterPredictor:
         ]
         
         self.model_accuracies = {}
+        
+        # Per disaster type overrides of DEFAULT_HYPERPARAMETERS
+        self.hyperparameters = {}
+        
+        # Scaled held-out split per disaster type, kept for drift checks
+        self.validation_sets = {}
+        
+        # Cascade (early-exit) configuration and live counters per disaster type
+        self.cascade = {}
+        self.cascade_stats = {}
+        self._cascade_lock = threading.Lock()
+        self._calibration_lock = threading.Lock()
+        
+        # (ensemble identities, digests) cached by model_fingerprints
+        self._fingerprints = None
+    
+    def get_hyperparameters(self, disaster_type, family):
+        """Hyperparameters for one model family, tuned values over the defaults"""
+        params = dict(DEFAULT_HYPERPARAMETERS[family])
+        params.update(self.hyperparameters.get(disaster_type, {}).get(family, {}))
+        return params
+    
+    def load_hyperparameters(self, path):
+        """Load tuned hyperparameters written by hyperparameter_search.py"""
+        if not os.path.exists(path):
+            return False
+        with open(path) as f:
+            self.hyperparameters = json.load(f)
+        print(f"✅ Loaded tuned hyperparameters from {path}")
+        return True
     
-    def create_neural_network(self, input_dim, disaster_type):
+    def create_neural_network(self, input_dim, disaster_type, learning_rate=0.001, jit_compile=False):
         """Create a deep neural network for disaster prediction"""
         model = keras.Sequential([
             layers.Input(shape=(input_dim,)),
@@ -111,79 +235,118 @@ class AdvancedDisasterPredictor:
         ])
         
         model.compile(
-            optimizer=keras.optimizers.Adam(learning_rate=0.001),
+            optimizer=keras.optimizers.Adam(learning_rate=learning_rate),
             loss='binary_crossentropy',
-            metrics=['accuracy', 'precision', 'recall']
+            metrics=['accuracy', 'precision', 'recall'],
+            jit_compile=jit_compile
         )
         
         return model
     
-    def generate_synthetic_training_data(self, disaster_type, n_samples=10000):
+    def fit_neural_network(self, X_train, y_train, params, disaster_type=None, batch_scale=None,
+                           jit_compile=None, validation_split=0.2, callbacks=None, verbose=0):
+        """Build and train the network from a prefetched float32 tf.data pipeline
+        
+        Like model.fit(validation_split=...), the last validation_split of the
+        rows is held out for early stopping. Returns (model, history).
+        """
+        batch_scale = NN_BATCH_SCALE if batch_scale is None else batch_scale
+        jit_compile = NN_JIT_COMPILE if jit_compile is None else jit_compile
+        batch_size = params['batch_size'] * batch_scale
+        learning_rate = params['learning_rate'] * np.sqrt(batch_scale)
+        
+        X_train = np.ascontiguousarray(X_train, dtype=np.float32)
+        y_train = np.asarray(y_train, dtype=np.float32)
+        n_fit = int(len(X_train) * (1 - validation_split))
+        train = (tf.data.Dataset.from_tensor_slices((X_train[:n_fit], y_train[:n_fit]))
+                 .cache()
+                 .shuffle(n_fit, seed=42, reshuffle_each_iteration=True)
+                 .batch(batch_size)
+                 .prefetch(tf.data.AUTOTUNE))
+        validation = (tf.data.Dataset.from_tensor_slices((X_train[n_fit:], y_train[n_fit:]))
+                      .batch(batch_size * 4)
+                      .cache()
+                      .prefetch(tf.data.AUTOTUNE))
+        
+        model = self.create_neural_network(X_train.shape[1], disaster_type,
+                                           learning_rate=learning_rate, jit_compile=jit_compile)
+        history = model.fit(
+            train,
+            validation_data=validation,
+            epochs=params['epochs'],
+            shuffle=False,
+            callbacks=[keras.callbacks.EarlyStopping(monitor='val_loss', patience=10,
+                                                     restore_best_weights=True)] + (callbacks or []),
+            verbose=verbose
+        )
+        return model, history
+    
+    def generate_synthetic_training_data(self, disaster_type, n_samples=10000, seed=42):
         """Generate synthetic training data for model training"""
-        np.random.seed(42)
+        rng = np.random.default_rng(seed)
         
         # Generate base features
         data = {}
         
         # Weather features
-        data['temperature'] = np.random.normal(25, 10, n_samples)
-        data['humidity'] = np.random.uniform(30, 100, n_samples)
-        data['pressure'] = np.random.normal(1013, 20, n_samples)
-        data['wind_speed'] = np.random.exponential(15, n_samples)
-        data['wind_direction'] = np.random.uniform(0, 360, n_samples)
+        data['temperature'] = rng.normal(25, 10, n_samples)
+        data['humidity'] = rng.uniform(30, 100, n_samples)
+        data['pressure'] = rng.normal(1013, 20, n_samples)
+        data['wind_speed'] = rng.exponential(15, n_samples)
+        data['wind_direction'] = rng.uniform(0, 360, n_samples)
         
         # Rainfall features
-        data['rainfall_1h'] = np.random.exponential(5, n_samples)
-        data['rainfall_24h'] = data['rainfall_1h'] * np.random.uniform(10, 30, n_samples)
-        data['rainfall_7d'] = data['rainfall_24h'] * np.random.uniform(3, 10, n_samples)
-        data['rainfall_30d'] = data['rainfall_7d'] * np.random.uniform(2, 6, n_samples)
+        data['rainfall_1h'] = rng.exponential(5, n_samples)
+        data['rainfall_24h'] = data['rainfall_1h'] * rng.uniform(10, 30, n_samples)
+        data['rainfall_7d'] = data['rainfall_24h'] * rng.uniform(3, 10, n_samples)
+        data['rainfall_30d'] = data['rainfall_7d'] * rng.uniform(2, 6, n_samples)
         
         # Changes
-        data['temperature_change_24h'] = np.random.normal(0, 5, n_samples)
-        data['pressure_change_24h'] = np.random.normal(0, 10, n_samples)
+        data['temperature_change_24h'] = rng.normal(0, 5, n_samples)
+        data['pressure_change_24h'] = rng.normal(0, 10, n_samples)
         
         # Geographical features
-        data['elevation'] = np.random.uniform(0, 3000, n_samples)
-        data['slope'] = np.random.exponential(10, n_samples)
-        data['aspect'] = np.random.uniform(0, 360, n_samples)
-        data['distance_to_water'] = np.random.exponential(50, n_samples)
-        data['distance_to_coast'] = np.random.exponential(200, n_samples)
-        data['soil_type'] = np.random.randint(1, 10, n_samples)
-        data['soil_moisture'] = np.random.uniform(10, 80, n_samples)
-        data['vegetation_index'] = np.random.uniform(0, 1, n_samples)
+        data['elevation'] = rng.uniform(0, 3000, n_samples)
+        data['slope'] = rng.exponential(10, n_samples)
+        data['aspect'] = rng.uniform(0, 360, n_samples)
+        data['distance_to_water'] = rng.exponential(50, n_samples)
+        data['distance_to_coast'] = rng.exponential(200, n_samples)
+        data['soil_type'] = rng.integers(1, 10, n_samples)
+        data['soil_moisture'] = rng.uniform(10, 80, n_samples)
+        data['vegetation_index'] = rng.uniform(0, 1, n_samples)
         
         # Seismic features
-        data['seismic_activity_7d'] = np.random.exponential(2, n_samples)
-        data['seismic_activity_30d'] = np.random.exponential(8, n_samples)
-        data['fault_distance'] = np.random.exponential(100, n_samples)
-        data['tectonic_stress'] = np.random.uniform(0, 100, n_samples)
-        data['historical_earthquake_count'] = np.random.poisson(5, n_samples)
+        data['seismic_activity_7d'] = rng.exponential(2, n_samples)
+        data['seismic_activity_30d'] = rng.exponential(8, n_samples)
+        data['fault_distance'] = rng.exponential(100, n_samples)
+        data['tectonic_stress'] = rng.uniform(0, 100, n_samples)
+        data['historical_earthquake_count'] = rng.poisson(5, n_samples)
         
         # Hydrological features
-        data['river_level'] = np.random.uniform(1, 15, n_samples)
-        data['river_flow_rate'] = np.random.exponential(500, n_samples)
-        data['groundwater_level'] = np.random.uniform(5, 50, n_samples)
-        data['dam_capacity'] = np.random.uniform(50, 100, n_samples)
-        data['upstream_rainfall'] = np.random.exponential(10, n_samples)
+        data['river_level'] = rng.uniform(1, 15, n_samples)
+        data['river_flow_rate'] = rng.exponential(500, n_samples)
+        data['groundwater_level'] = rng.uniform(5, 50, n_samples)
+        data['dam_capacity'] = rng.uniform(50, 100, n_samples)
+        data['upstream_rainfall'] = rng.exponential(10, n_samples)
         
         # Atmospheric features
-        data['sea_surface_temp'] = np.random.normal(27, 3, n_samples)
-        data['atmospheric_pressure_gradient'] = np.random.normal(0, 5, n_samples)
-        data['wind_shear'] = np.random.uniform(0, 50, n_samples)
-        data['moisture_content'] = np.random.uniform(40, 100, n_samples)
-        data['coriolis_effect'] = np.random.uniform(0, 1, n_samples)
+        data['sea_surface_temp'] = rng.normal(27, 3, n_samples)
+        data['atmospheric_pressure_gradient'] = rng.normal(0, 5, n_samples)
+        data['wind_shear'] = rng.uniform(0, 50, n_samples)
+        data['moisture_content'] = rng.uniform(40, 100, n_samples)
+        data['coriolis_effect'] = rng.uniform(0, 1, n_samples)
         
         # Temporal features
-        data['month'] = np.random.randint(1, 13, n_samples)
+        data['month'] = rng.integers(1, 13, n_samples)
         data['season'] = (data['month'] % 12) // 3
-        data['day_of_year'] = np.random.randint(1, 366, n_samples)
+        data['day_of_year'] = rng.integers(1, 366, n_samples)
         data['is_monsoon_season'] = (data['month'] >= 6) & (data['month'] <= 9)
         
         # Historical features
-        data['historical_disaster_count_1y'] = np.random.poisson(3, n_samples)
-        data['historical_disaster_count_5y'] = np.random.poisson(15, n_samples)
-        data['days_since_last_disaster'] = np.random.exponential(180, n_samples)
-        data['avg_disaster_severity'] = np.random.uniform(0, 1, n_samples)
+        data['historical_disaster_count_1y'] = rng.poisson(3, n_samples)
+        data['historical_disaster_count_5y'] = rng.poisson(15, n_samples)
+        data['days_since_last_disaster'] = rng.exponential(180, n_samples)
+        data['avg_disaster_severity'] = rng.uniform(0, 1, n_samples)
         
         df = pd.DataFrame(data)
         
@@ -225,115 +388,100 @@ class AdvancedDisasterPredictor:
             ).astype(int)
         
         # Add some noise
-        noise = np.random.random(n_samples) < 0.1
+        noise = rng.random(n_samples) < 0.1
         target = np.logical_xor(target, noise).astype(int)
         
         return df, target
     
-    def train_models(self, disaster_type):
-        """Train all models for a specific disaster type"""
-        print(f"\n{'='*60}")
-        print(f"Training models for {disaster_type.upper()}")
-        print(f"{'='*60}")
-        
-        # Generate training data
-        X, y = self.generate_synthetic_training_data(disaster_type, n_samples=20000)
-        
-        # Split data
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=0.2, random_state=42, stratify=y
+    def training_split(self, disaster_type, n_samples=20000, extra_X=None, extra_y=None):
+        """Generate training data and split it 80/20 (unscaled X_train, X_test, y_train, y_test)
+        
+        extra_X/extra_y are appended to the synthetic data, e.g. labeled
+        observations collected by incremental_training.py. The test split is
+        the one train_models reports accuracy on; tuning and cross-validation
+        use the training portion only.
+        """
+        X, y = self.generate_synthetic_training_data(disaster_type, n_samples=n_samples)
+        if extra_X is not None and len(extra_X):
+            extra = pd.DataFrame(self.to_feature_matrix(extra_X), columns=self.feature_columns)
+            X = pd.concat([X, extra], ignore_index=True)
+            y = np.concatenate([np.asarray(y), np.asarray(extra_y, dtype=int)])
+        
+        return train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+    
+    def prepare_training_split(self, disaster_type, n_samples=20000, extra_X=None, extra_y=None):
+        """training_split with a scaler fitted on the train split"""
+        X_train, X_test, y_train, y_test = self.training_split(
+            disaster_type, n_samples=n_samples, extra_X=extra_X, extra_y=extra_y
         )
         
-        # Scale features
         scaler = StandardScaler()
         X_train_scaled = scaler.fit_transform(X_train)
         X_test_scaled = scaler.transform(X_test)
         
+        return X_train_scaled, X_test_scaled, np.asarray(y_train), np.asarray(y_test), scaler
+    
+    def train_models(self, disaster_type, extra_X=None, extra_y=None, ensemble_weights=None):
+        """Train all models for a specific disaster type
+        
+        ensemble_weights (rf, xgb, lgb, nn), e.g. averaged over the folds of
+        cross_validation.py, replace the weights derived from this split.
+        """
+        print(f"\n{'='*60}")
+        print(f"Training models for {disaster_type.upper()}")
+        print(f"{'='*60}")
+        
+        X_train_scaled, X_test_scaled, y_train, y_test, scaler = self.prepare_training_split(
+            disaster_type, extra_X=extra_X, extra_y=extra_y)
+        
         self.scalers[disaster_type] = scaler
+        self.validation_sets[disaster_type] = (X_test_scaled, y_test)
         
         # 1. Random Forest
         print("\n1. Training Random Forest...")
-        rf_model = RandomForestClassifier(
-            n_estimators=200,
-            max_depth=20,
-            min_samples_split=5,
-            min_samples_leaf=2,
-            random_state=42,
-            n_jobs=-1
-        )
+        rf_model = build_model('rf', self.get_hyperparameters(disaster_type, 'rf'))
         rf_model.fit(X_train_scaled, y_train)
-        rf_pred = rf_model.predict(X_test_scaled)
-        rf_accuracy = accuracy_score(y_test, rf_pred)
+        rf_prob = rf_model.predict_proba(X_test_scaled)[:, 1]
+        rf_accuracy = accuracy_score(y_test, (rf_prob > 0.5).astype(int))
         print(f"   Random Forest Accuracy: {rf_accuracy:.4f}")
         self.models[disaster_type]['rf'] = rf_model
         
         # 2. XGBoost
         print("\n2. Training XGBoost...")
-        xgb_model = xgb.XGBClassifier(
-            n_estimators=200,
-            max_depth=10,
-            learning_rate=0.1,
-            subsample=0.8,
-            colsample_bytree=0.8,
-            random_state=42,
-            use_label_encoder=False,
-            eval_metric='logloss'
-        )
+        xgb_model = build_model('xgb', self.get_hyperparameters(disaster_type, 'xgb'))
         xgb_model.fit(X_train_scaled, y_train)
-        xgb_pred = xgb_model.predict(X_test_scaled)
-        xgb_accuracy = accuracy_score(y_test, xgb_pred)
+        xgb_prob = xgb_model.predict_proba(X_test_scaled)[:, 1]
+        xgb_accuracy = accuracy_score(y_test, (xgb_prob > 0.5).astype(int))
         print(f"   XGBoost Accuracy: {xgb_accuracy:.4f}")
         self.models[disaster_type]['xgb'] = xgb_model
         
         # 3. LightGBM
         print("\n3. Training LightGBM...")
-        lgb_model = lgb.LGBMClassifier(
-            n_estimators=200,
-            max_depth=10,
-            learning_rate=0.1,
-            num_leaves=31,
-            random_state=42,
-            verbose=-1
-        )
+        lgb_model = build_model('lgb', self.get_hyperparameters(disaster_type, 'lgb'))
         lgb_model.fit(X_train_scaled, y_train)
-        lgb_pred = lgb_model.predict(X_test_scaled)
-        lgb_accuracy = accuracy_score(y_test, lgb_pred)
+        lgb_prob = lgb_model.predict_proba(X_test_scaled)[:, 1]
+        lgb_accuracy = accuracy_score(y_test, (lgb_prob > 0.5).astype(int))
         print(f"   LightGBM Accuracy: {lgb_accuracy:.4f}")
         self.models[disaster_type]['lgb'] = lgb_model
         
         # 4. Neural Network
         print("\n4. Training Neural Network...")
-        nn_model = self.create_neural_network(X_train_scaled.shape[1], disaster_type)
-        
-        early_stopping = keras.callbacks.EarlyStopping(
-            monitor='val_loss',
-            patience=10,
-            restore_best_weights=True
-        )
+        nn_params = self.get_hyperparameters(disaster_type, 'nn')
+        nn_model, history = self.fit_neural_network(X_train_scaled, y_train, nn_params, disaster_type)
         
-        history = nn_model.fit(
-            X_train_scaled, y_train,
-            validation_split=0.2,
-            epochs=50,
-            batch_size=128,
-            callbacks=[early_stopping],
-            verbose=0
-        )
-        
-        nn_pred = (nn_model.predict(X_test_scaled) > 0.5).astype(int)
-        nn_accuracy = accuracy_score(y_test, nn_pred)
+        nn_prob = self.nn_probabilities(nn_model, X_test_scaled)
+        nn_accuracy = accuracy_score(y_test, (nn_prob > 0.5).astype(int))
         print(f"   Neural Network Accuracy: {nn_accuracy:.4f}")
         self.models[disaster_type]['nn'] = nn_model
         
         # 5. Ensemble Model (Weighted Average)
         print("\n5. Creating Ensemble Model...")
-        rf_prob = rf_model.predict_proba(X_test_scaled)[:, 1]
-        xgb_prob = xgb_model.predict_proba(X_test_scaled)[:, 1]
-        lgb_prob = lgb_model.predict_proba(X_test_scaled)[:, 1]
-        nn_prob = nn_model.predict(X_test_scaled).flatten()
         
         # Weighted ensemble based on individual accuracies
-        weights = np.array([rf_accuracy, xgb_accuracy, lgb_accuracy, nn_accuracy])
+        if ensemble_weights is not None:
+            weights = np.asarray(ensemble_weights, dtype=np.float64)
+        else:
+            weights = np.array([rf_accuracy, xgb_accuracy, lgb_accuracy, nn_accuracy])
         weights = weights / weights.sum()
         
         ensemble_prob = (
@@ -353,6 +501,14 @@ class AdvancedDisasterPredictor:
             'accuracy': ensemble_accuracy
         }
         
+        # 6. Cascade calibration on the held-out split
+        cheap_model = self.select_cascade_model(disaster_type, X_test_scaled)
+        cheap_prob = {'rf': rf_prob, 'xgb': xgb_prob, 'lgb': lgb_prob}[cheap_model]
+        cascade = self.calibrate_cascade(disaster_type, cheap_prob, ensemble_prob, cheap_model)
+        print(f"   Cascade: {MODEL_NAMES[cheap_model]} first, margin={cascade['margin']:.3f}, "
+              f"early exits={cascade['calibrated_early_fraction']:.1%}, "
+              f"band agreement={cascade['calibrated_agreement']:.4f}")
+        
         # Store accuracies
         self.model_accuracies[disaster_type] = {
             'rf': rf_accuracy,
@@ -426,34 +582,342 @@ class AdvancedDisasterPredictor:
         else:
             return 'critical'
     
+    def get_risk_levels(self, probabilities):
+        """Vectorized get_risk_level for an array of probabilities"""
+        bands = np.searchsorted(RISK_THRESHOLDS, np.asarray(probabilities), side='right')
+        return np.array(RISK_LEVELS)[bands]
+    
+    def to_feature_matrix(self, features):
+        """Arrange feature rows as a 2-D float array in feature_columns order"""
+        if isinstance(features, pd.DataFrame):
+            return features[self.feature_columns].to_numpy(dtype=np.float64)
+        if isinstance(features, dict):
+            return np.column_stack([
+                np.atleast_1d(np.asarray(features[col], dtype=np.float64))
+                for col in self.feature_columns
+            ])
+        return np.asarray(features, dtype=np.float64).reshape(-1, len(self.feature_columns))
+    
+    def scale_features(self, feature_array, disaster_type):
+        """Apply the disaster type's scaler to a feature matrix"""
+        scaler = self.scalers[disaster_type]
+        if hasattr(scaler, 'feature_names_in_'):
+            # Scalers fitted on DataFrames warn on bare arrays
+            feature_array = pd.DataFrame(feature_array, columns=scaler.feature_names_in_)
+        return scaler.transform(feature_array)
+    
+    def nn_probabilities(self, model, feature_array, batch_size=4096):
+        """Neural network probabilities via direct calls on fixed-size slices
+        
+        model.predict retraces its graph for every new input length, which
+        dominates the cost of scoring many variable-sized chunks.
+        """
+        feature_array = np.asarray(feature_array, dtype=np.float32)
+        return np.concatenate([
+            np.asarray(model(feature_array[i:i + batch_size], training=False))[:, 0]
+            for i in range(0, len(feature_array), batch_size)
+        ]) if len(feature_array) else np.empty(0, dtype=np.float32)
+    
+    def _model_probabilities(self, feature_array, disaster_type, known=None, nn_batch_size=4096):
+        """Per-model and weighted ensemble probabilities for a scaled feature matrix
+        
+        known maps model keys to probabilities already computed for these rows
+        so that the cascade does not score its cheap model twice.
+        """
+        known = known or {}
+        models = self.models[disaster_type]
+        probs = {}
+        for key in ('rf', 'xgb', 'lgb'):
+            if key in known:
+                probs[key] = known[key]
+            else:
+                probs[key] = models[key].predict_proba(feature_array)[:, 1]
+        if 'nn' in known:
+            probs['nn'] = known['nn']
+        else:
+            probs['nn'] = self.nn_probabilities(models['nn'], feature_array, nn_batch_size)
+        
+        weights = models['ensemble']['weights']
+        ensemble_prob = (
+            weights[0] * probs['rf'] +
+            weights[1] * probs['xgb'] +
+            weights[2] * probs['lgb'] +
+            weights[3] * probs['nn']
+        )
+        return ensemble_prob, probs
+    
+    def predict_batch(self, features, disaster_type, nn_batch_size=4096):
+        """Vectorized ensemble prediction for many feature rows
+        
+        Returns arrays of ensemble and per-model probabilities aligned with
+        the input rows.
+        """
+        if disaster_type not in self.models:
+            raise ValueError(f"Unknown disaster type: {disaster_type}")
+        
+        feature_array = self.to_feature_matrix(features)
+        if disaster_type in self.scalers:
+            feature_array = self.scale_features(feature_array, disaster_type)
+        
+        ensemble_prob, probs = self._model_probabilities(
+            feature_array, disaster_type, nn_batch_size=nn_batch_size)
+        
+        result = {'probability': ensemble_prob}
+        for key, name in MODEL_NAMES.items():
+            result[name] = probs[key]
+        return result
+    
+    def model_fingerprints(self, probe_rows=16):
+        """Short digest per loaded disaster type of its scaler and its scores on a fixed probe
+        
+        Processes with equal digests score the same rows the same way. The
+        digest follows retraining and incremental updates, which install a
+        new ensemble.
+        """
+        key = tuple((dt, id(models.get('ensemble'))) for dt, models in self.models.items())
+        if self._fingerprints is not None and self._fingerprints[0] == key:
+            return self._fingerprints[1]
+        
+        digests = {}
+        for disaster_type, models in self.models.items():
+            if models.get('ensemble') is None:
+                continue
+            probe = np.random.default_rng(0).normal(size=(probe_rows, len(self.feature_columns)))
+            ensemble_prob, _ = self._model_probabilities(probe, disaster_type)
+            digest = hashlib.sha1(np.round(ensemble_prob, 4).tobytes())
+            scaler = self.scalers.get(disaster_type)
+            if scaler is not None:
+                digest.update(np.asarray(scaler.mean_, dtype=np.float64).tobytes())
+                digest.update(np.asarray(scaler.scale_, dtype=np.float64).tobytes())
+            digests[disaster_type] = digest.hexdigest()[:16]
+        self._fingerprints = (key, digests)
+        return digests
+    
+    def select_cascade_model(self, disaster_type, feature_array, candidates=('rf', 'xgb', 'lgb'), repeats=3):
+        """Pick the cheapest tree model by measured inference time on scaled rows"""
+        sample = feature_array[:1000]
+        costs = {}
+        for key in candidates:
+            model = self.models[disaster_type][key]
+            best = float('inf')
+            for _ in range(repeats):
+                start = time.perf_counter()
+                model.predict_proba(sample)
+                best = min(best, time.perf_counter() - start)
+            costs[key] = best
+        return min(costs, key=costs.get)
+    
+    def calibrate_cascade(self, disaster_type, cheap_prob, full_prob, cheap_model,
+                          target_agreement=0.995):
+        """Choose the smallest early-exit margin that keeps band agreement on target
+        
+        A request exits early when the cheap model's probability is further than
+        the margin from every risk threshold. Escalated requests get the full
+        ensemble, so only early exits can land in a different band.
+        """
+        cheap_prob = np.asarray(cheap_prob, dtype=np.float64)
+        full_prob = np.asarray(full_prob, dtype=np.float64)
+        
+        distance = np.min(np.abs(cheap_prob[:, None] - np.array(RISK_THRESHOLDS)[None, :]), axis=1)
+        disagree = self.get_risk_levels(cheap_prob) != self.get_risk_levels(full_prob)
+        
+        margin = 0.5
+        for candidate in np.linspace(0, 0.5, 201):
+            early = distance > candidate
+            if 1 - np.mean(early & disagree) >= target_agreement:
+                margin = float(candidate)
+                break
+        
+        early = distance > margin
+        self.cascade[disaster_type] = {
+            'model': cheap_model,
+            'margin': margin,
+            'target_agreement': target_agreement,
+            'calibrated_agreement': float(1 - np.mean(early & disagree)),
+            'calibrated_early_fraction': float(np.mean(early))
+        }
+        return self.cascade[disaster_type]
+    
+    def calibrate_cascade_synthetic(self, disaster_type, n_samples=5000, target_agreement=0.995):
+        """Calibrate the cascade of already-trained models on fresh synthetic data
+        
+        Runs once per disaster type under a lock; callers that lose the race
+        get the configuration the winner stored.
+        """
+        with self._calibration_lock:
+            if disaster_type in self.cascade:
+                return self.cascade[disaster_type]
+            X, _ = self.generate_synthetic_training_data(disaster_type, n_samples=n_samples, seed=1)
+            feature_array = self.scale_features(self.to_feature_matrix(X), disaster_type)
+            cheap_model = self.select_cascade_model(disaster_type, feature_array)
+            ensemble_prob, probs = self._model_probabilities(feature_array, disaster_type)
+            return self.calibrate_cascade(disaster_type, probs[cheap_model], ensemble_prob,
+                                          cheap_model, target_agreement)
+    
+    def get_cascade_config(self, disaster_type):
+        """Cascade configuration (calibrated at load for models saved without one)"""
+        if disaster_type not in self.cascade:
+            self.calibrate_cascade_synthetic(disaster_type)
+        return self.cascade[disaster_type]
+    
+    def _record_cascade(self, disaster_type, requests, early_exits, shadow_checks=0, shadow_agreements=0):
+        """Accumulate live cascade counters"""
+        with self._cascade_lock:
+            stats = self.cascade_stats.setdefault(disaster_type, {
+                'requests': 0,
+                'early_exits': 0,
+                'shadow_checks': 0,
+                'shadow_agreements': 0
+            })
+            stats['requests'] += requests
+            stats['early_exits'] += early_exits
+            stats['shadow_checks'] += shadow_checks
+            stats['shadow_agreements'] += shadow_agreements
+    
+    def predict_batch_cascade(self, features, disaster_type, shadow_rate=0.0, nn_batch_size=4096):
+        """Cascaded batch prediction that escalates only rows near a band boundary
+        
+        Rows resolved by the cheap model carry NaN for the models that were not
+        evaluated. A shadow_rate fraction of early exits is also scored with the
+        full ensemble to measure live band agreement.
+        """
+        if disaster_type not in self.models:
+            raise ValueError(f"Unknown disaster type: {disaster_type}")
+        
+        config = self.get_cascade_config(disaster_type)
+        cheap_model = config['model']
+        
+        feature_array = self.to_feature_matrix(features)
+        if disaster_type in self.scalers:
+            feature_array = self.scale_features(feature_array, disaster_type)
+        n_rows = len(feature_array)
+        
+        cheap_prob = self.models[disaster_type][cheap_model].predict_proba(feature_array)[:, 1]
+        distance = np.min(np.abs(cheap_prob[:, None] - np.array(RISK_THRESHOLDS)[None, :]), axis=1)
+        escalate = distance <= config['margin']
+        shadow = ~escalate & (np.random.random(n_rows) < shadow_rate)
+        full_rows = escalate | shadow
+        
+        result = {'probability': cheap_prob.copy(), 'early_exit': ~escalate}
+        for key, name in MODEL_NAMES.items():
+            result[name] = np.full(n_rows, np.nan)
+        result[MODEL_NAMES[cheap_model]] = cheap_prob
+        
+        shadow_agreements = 0
+        if full_rows.any():
+            ensemble_prob, probs = self._model_probabilities(
+                feature_array[full_rows], disaster_type,
+                known={cheap_model: cheap_prob[full_rows]},
+                nn_batch_size=nn_batch_size
+            )
+            escalated = escalate[full_rows]
+            result['probability'][escalate] = ensemble_prob[escalated]
+            for key, name in MODEL_NAMES.items():
+                result[name][escalate] = probs[key][escalated]
+            
+            shadowed = shadow[full_rows]
+            if shadowed.any():
+                shadow_agreements = int(np.sum(
+                    self.get_risk_levels(cheap_prob[shadow]) == self.get_risk_levels(ensemble_prob[shadowed])
+                ))
+        
+        self._record_cascade(
+            disaster_type,
+            requests=n_rows,
+            early_exits=int(np.sum(~escalate)),
+            shadow_checks=int(np.sum(shadow)),
+            shadow_agreements=shadow_agreements
+        )
+        return result
+    
+    def predict_disaster_cascade(self, features, disaster_type, shadow_rate=0.0):
+        """Cascaded counterpart of predict_disaster for a single feature row"""
+        probs = self.predict_batch_cascade(features, disaster_type, shadow_rate=shadow_rate)
+        probability = float(probs['probability'][0])
+        early_exit = bool(probs['early_exit'][0])
+        
+        if early_exit:
+            cheap_model = self.cascade[disaster_type]['model']
+            accuracies = self.model_accuracies.get(disaster_type, {})
+            confidence = accuracies.get(cheap_model, self.models[disaster_type]['ensemble']['accuracy'])
+        else:
+            confidence = self.models[disaster_type]['ensemble']['accuracy']
+        
+        return {
+            'probability': probability,
+            'risk_level': self.get_risk_level(probability),
+            'confidence': float(confidence),
+            'model_predictions': {
+                name: float(probs[name][0])
+                for name in MODEL_NAMES.values()
+                if not np.isnan(probs[name][0])
+            },
+            'cascade': 'early_exit' if early_exit else 'escalated'
+        }
+    
+    def get_cascade_stats(self):
+        """Early-exit fraction and band agreement per disaster type"""
+        with self._cascade_lock:
+            snapshot = {dt: dict(stats) for dt, stats in self.cascade_stats.items()}
+        
+        report = {}
+        for disaster_type, config in self.cascade.items():
+            stats = snapshot.get(disaster_type, {})
+            requests = stats.get('requests', 0)
+            shadow_checks = stats.get('shadow_checks', 0)
+            report[disaster_type] = {
+                'model': MODEL_NAMES[config['model']],
+                'margin': config['margin'],
+                'calibrated_early_fraction': config['calibrated_early_fraction'],
+                'calibrated_agreement': config['calibrated_agreement'],
+                'requests': requests,
+                'early_exit_fraction': stats.get('early_exits', 0) / requests if requests else None,
+                'shadow_checks': shadow_checks,
+                'band_agreement': stats.get('shadow_agreements', 0) / shadow_checks if shadow_checks else None
+            }
+        return report
+    
+    def save_disaster_models(self, disaster_type, disaster_dir):
+        """Save the trained models of one disaster type to a directory"""
+        os.makedirs(disaster_dir, exist_ok=True)
+        
+        # Save sklearn models
+        joblib.dump(self.models[disaster_type]['rf'], 
+                   os.path.join(disaster_dir, 'rf_model.pkl'))
+        joblib.dump(self.models[disaster_type]['xgb'], 
+                   os.path.join(disaster_dir, 'xgb_model.pkl'))
+        joblib.dump(self.models[disaster_type]['lgb'], 
+                   os.path.join(disaster_dir, 'lgb_model.pkl'))
+        
+        # Save neural network
+        self.models[disaster_type]['nn'].save(
+            os.path.join(disaster_dir, 'nn_model.h5')
+        )
+        
+        # Save ensemble weights
+        joblib.dump(self.models[disaster_type]['ensemble'], 
+                   os.path.join(disaster_dir, 'ensemble.pkl'))
+        
+        # Save scaler
+        joblib.dump(self.scalers[disaster_type], 
+                   os.path.join(disaster_dir, 'scaler.pkl'))
+        
+        # Save held-out split used for drift checks
+        if disaster_type in self.validation_sets:
+            X_val, y_val = self.validation_sets[disaster_type]
+            np.savez_compressed(os.path.join(disaster_dir, 'validation.npz'), X=X_val, y=y_val)
+        
+        # Save cascade calibration
+        if disaster_type in self.cascade:
+            joblib.dump(self.cascade[disaster_type], 
+                       os.path.join(disaster_dir, 'cascade.pkl'))
+    
     def save_models(self, model_dir='models'):
         """Save all trained models"""
         os.makedirs(model_dir, exist_ok=True)
         
         for disaster_type in self.models.keys():
-            disaster_dir = os.path.join(model_dir, disaster_type)
-            os.makedirs(disaster_dir, exist_ok=True)
-            
-            # Save sklearn models
-            joblib.dump(self.models[disaster_type]['rf'], 
-                       os.path.join(disaster_dir, 'rf_model.pkl'))
-            joblib.dump(self.models[disaster_type]['xgb'], 
-                       os.path.join(disaster_dir, 'xgb_model.pkl'))
-            joblib.dump(self.models[disaster_type]['lgb'], 
-                       os.path.join(disaster_dir, 'lgb_model.pkl'))
-            
-            # Save neural network
-            self.models[disaster_type]['nn'].save(
-                os.path.join(disaster_dir, 'nn_model.h5')
-            )
-            
-            # Save ensemble weights
-            joblib.dump(self.models[disaster_type]['ensemble'], 
-                       os.path.join(disaster_dir, 'ensemble.pkl'))
-            
-            # Save scaler
-            joblib.dump(self.scalers[disaster_type], 
-                       os.path.join(disaster_dir, 'scaler.pkl'))
+            self.save_disaster_models(disaster_type, os.path.join(model_dir, disaster_type))
         
         # Save accuracies
         joblib.dump(self.model_accuracies, 
@@ -461,25 +925,41 @@ class AdvancedDisasterPredictor:
         
         print(f"\n✅ All models saved to {model_dir}/")
     
+    def load_disaster_models(self, disaster_type, disaster_dir):
+        """Load the models of one disaster type from a directory (raises on missing files)"""
+        self.models.setdefault(disaster_type, {})
+        self.models[disaster_type]['rf'] = joblib.load(
+            os.path.join(disaster_dir, 'rf_model.pkl'))
+        self.models[disaster_type]['xgb'] = joblib.load(
+            os.path.join(disaster_dir, 'xgb_model.pkl'))
+        self.models[disaster_type]['lgb'] = joblib.load(
+            os.path.join(disaster_dir, 'lgb_model.pkl'))
+        self.models[disaster_type]['nn'] = keras.models.load_model(
+            os.path.join(disaster_dir, 'nn_model.h5'))
+        self.models[disaster_type]['ensemble'] = joblib.load(
+            os.path.join(disaster_dir, 'ensemble.pkl'))
+        self.scalers[disaster_type] = joblib.load(
+            os.path.join(disaster_dir, 'scaler.pkl'))
+        
+        validation_path = os.path.join(disaster_dir, 'validation.npz')
+        if os.path.exists(validation_path):
+            with np.load(validation_path) as validation:
+                self.validation_sets[disaster_type] = (validation['X'], validation['y'])
+        
+        # Models saved before cascade calibration are calibrated here, before
+        # any request can time the candidate models under load
+        cascade_path = os.path.join(disaster_dir, 'cascade.pkl')
+        if os.path.exists(cascade_path):
+            self.cascade[disaster_type] = joblib.load(cascade_path)
+        else:
+            self.cascade.pop(disaster_type, None)
+            self.calibrate_cascade_synthetic(disaster_type)
+    
     def load_models(self, model_dir='models'):
         """Load all trained models"""
         for disaster_type in self.models.keys():
-            disaster_dir = os.path.join(model_dir, disaster_type)
-            
             try:
-                self.models[disaster_type]['rf'] = joblib.load(
-                    os.path.join(disaster_dir, 'rf_model.pkl'))
-                self.models[disaster_type]['xgb'] = joblib.load(
-                    os.path.join(disaster_dir, 'xgb_model.pkl'))
-                self.models[disaster_type]['lgb'] = joblib.load(
-                    os.path.join(disaster_dir, 'lgb_model.pkl'))
-                self.models[disaster_type]['nn'] = keras.models.load_model(
-                    os.path.join(disaster_dir, 'nn_model.h5'))
-                self.models[disaster_type]['ensemble'] = joblib.load(
-                    os.path.join(disaster_dir, 'ensemble.pkl'))
-                self.scalers[disaster_type] = joblib.load(
-                    os.path.join(disaster_dir, 'scaler.pkl'))
-                
+                self.load_disaster_models(disaster_type, os.path.join(model_dir, disaster_type))
                 print(f"✅ Loaded models for {disaster_type}")
             except Exception as e:
                 print(f"❌ Error loading models for {disaster_type}: {e}")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark serialization time and payload size of /predict/batch responses
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime
+
+import numpy as np
+
+import response_formats
+from response_formats import (
+    JSON_MIMETYPE, MSGPACK_MIMETYPE, ARROW_MIMETYPE, NDJSON_MIMETYPE,
+    MODEL_COLUMNS, available_formats, compact_results, encode_payload
+)
+
+DISASTER_TYPES = ['flood', 'cyclone', 'earthquake', 'landslide', 'wildfire']
+RISK_LEVELS = ['low', 'medium', 'high', 'critical']
+
+
+def make_batch_payload(n_locations, seed=42):
+    """Build a synthetic payload shaped like the /predict/batch response"""
+    rng = np.random.default_rng(seed)
+    results = []
+    for _ in range(n_locations):
+        predictions = {}
+        for disaster_type in DISASTER_TYPES:
+            model_probs = rng.uniform(0, 1, len(MODEL_COLUMNS))
+            probability = float(model_probs.mean())
+            predictions[disaster_type] = {
+                'probability': probability,
+                'risk_level': RISK_LEVELS[int(np.searchsorted([0.2, 0.5, 0.8], probability, side='right'))],
+                'confidence': float(rng.uniform(0.8, 0.95)),
+                'model_predictions': dict(zip(MODEL_COLUMNS, model_probs.tolist()))
+            }
+        results.append({
+            'location': {
+                'latitude': float(rng.uniform(-90, 90)),
+                'longitude': float(rng.uniform(-180, 180))
+            },
+            'predictions': predictions,
+            'overall_risk': max([p['risk_level'] for p in predictions.values()],
+                                key=lambda x: RISK_LEVELS.index(x))
+        })
+    return {'timestamp': datetime.now().isoformat(), 'results': results}
+
+
+def encode_jsonify_baseline(payload):
+    """Mirror what flask.jsonify does in production mode"""
+    return json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def time_encoder(encoder, payload, repeats):
+    """Best-of-N wall time and output size of one encoder"""
+    best = float('inf')
+    body = b''
+    for _ in range(repeats):
+        start = time.perf_counter()
+        body = encoder(payload)
+        best = min(best, time.perf_counter() - start)
+    return best, len(body)
+
+
+def run(sizes, repeats):
+    labels = {
+        JSON_MIMETYPE: 'json (orjson)' if response_formats.orjson is not None else 'json (stdlib)',
+        MSGPACK_MIMETYPE: 'msgpack',
+        NDJSON_MIMETYPE: 'ndjson',
+        ARROW_MIMETYPE: 'arrow ipc'
+    }
+
+    # Warm up lazily initialized encoder state (pyarrow kernels, orjson)
+    warmup = make_batch_payload(10)
+    for mimetype in available_formats():
+        encode_payload(warmup, mimetype)
+
+    print(f"{'locations':>10} {'format':<16} {'compact':<8} {'time (ms)':>10} {'size (MB)':>10} {'speedup':>8}")
+    print("-" * 68)
+    for n_locations in sizes:
+        payload = make_batch_payload(n_locations)
+        baseline_time, baseline_size = time_encoder(encode_jsonify_baseline, payload, repeats)
+        print(f"{n_locations:>10} {'jsonify':<16} {'no':<8} {baseline_time*1000:>10.1f} "
+              f"{baseline_size/1e6:>10.2f} {1.0:>8.2f}")
+
+        for compact in (False, True):
+            data = payload
+            if compact:
+                data = {'timestamp': payload['timestamp'], 'results': json.loads(json.dumps(payload['results']))}
+                compact_results(data['results'])
+
+            for mimetype in available_formats():
+                encoder = lambda p, m=mimetype, c=compact: encode_payload(p, m, compact=c)
+                elapsed, size = time_encoder(encoder, data, repeats)
+                print(f"{n_locations:>10} {labels[mimetype]:<16} {'yes' if compact else 'no':<8} "
+                      f"{elapsed*1000:>10.1f} {size/1e6:>10.2f} {baseline_time/elapsed:>8.2f}")
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000],
+                        help='Batch sizes (number of locations) to benchmark')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Repetitions per encoder; the best time is reported')
+    args = parser.parse_args()
+
+    run(args.sizes, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Parallel stratified k-fold evaluation of the ensemble members
+
+Every (fold, model family) fit is an independent task in a process pool. The
+full dataset and the fold assignment are written once to memory-mapped .npy
+files (see shared_data.py); workers slice their fold from the shared copy and
+fit a fold-local scaler, so nothing larger than a handle is pickled to them.
+Per-fold accuracies give per-fold ensemble weights, and the weights averaged
+across folds replace the single-split weights when training with --cv.
+--measure-speedup repeats each evaluation on a single worker and reports the
+wall-time speedup of the pool.
+
+    python cross_validation.py --disaster-types flood cyclone --folds 5 --workers 8
+    python cross_validation.py --disaster-types flood --workers 4 --measure-speedup
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from shared_data import SharedDataset, open_shared
+
+DISASTER_TYPES = ['flood', 'cyclone', 'earthquake', 'landslide', 'wildfire']
+FAMILIES = ['rf', 'xgb', 'lgb', 'nn']
+METRICS = ['accuracy', 'precision', 'recall', 'f1', 'roc_auc']
+
+
+def _init_worker(threads):
+    """Cap the worker's BLAS, OpenMP and TensorFlow pools at `threads`"""
+    from advanced_disaster_predictor import configure_worker_threads
+
+    configure_worker_threads(threads)
+
+
+def start_pool(workers, threads):
+    """Spawn pool with every worker started, so timings exclude process startup"""
+    context = multiprocessing.get_context('spawn')
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                               initializer=_init_worker, initargs=(threads,))
+    # Overlapping sleeps keep each worker busy, so every one of them is spawned
+    list(pool.map(time.sleep, [1.0] * workers))
+    return pool
+
+
+def _metrics(y_true, prob):
+    from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score, roc_auc_score
+
+    pred = (prob > 0.5).astype(int)
+    return {
+        'accuracy': float(accuracy_score(y_true, pred)),
+        'precision': float(precision_score(y_true, pred, zero_division=0)),
+        'recall': float(recall_score(y_true, pred, zero_division=0)),
+        'f1': float(f1_score(y_true, pred, zero_division=0)),
+        'roc_auc': float(roc_auc_score(y_true, prob)) if len(np.unique(y_true)) > 1 else float('nan')
+    }
+
+
+def evaluate_fold(handle, family, params, fold, threads=1):
+    """Fit one model family on all folds but `fold` and score the held-out fold
+
+    Runs in a worker process. Returns held-out metrics, fit time and the
+    held-out probabilities so the parent can evaluate the fold's ensemble.
+    """
+    from sklearn.preprocessing import StandardScaler
+
+    from advanced_disaster_predictor import AdvancedDisasterPredictor, build_model
+
+    data = open_shared(handle)
+    test = data['fold_ids'] == fold
+    X_train, y_train = data['X'][~test], data['y'][~test]
+    X_test, y_test = data['X'][test], data['y'][test]
+
+    scaler = StandardScaler()
+    X_train = scaler.fit_transform(X_train)
+    X_test = scaler.transform(X_test)
+
+    start = time.process_time()
+    if family == 'nn':
+        from tensorflow import keras
+
+        keras.utils.set_random_seed(42 + fold)
+        predictor = AdvancedDisasterPredictor()
+        model, _ = predictor.fit_neural_network(X_train, y_train, params)
+        fit_seconds = time.process_time() - start
+        prob = predictor.nn_probabilities(model, X_test)
+    else:
+        model = build_model(family, params, n_jobs=threads)
+        model.fit(X_train, y_train)
+        fit_seconds = time.process_time() - start
+        prob = model.predict_proba(X_test)[:, 1]
+
+    return {
+        'family': family,
+        'fold': fold,
+        'fit_cpu_seconds': fit_seconds,
+        'metrics': _metrics(y_test, prob),
+        'probabilities': np.asarray(prob, dtype=np.float32)
+    }
+
+
+def summarize(results, y, fold_ids, families):
+    """Per-model fold metrics, per-fold ensembles and fold-averaged weights"""
+    folds = sorted({r['fold'] for r in results})
+    by_key = {(r['family'], r['fold']): r for r in results}
+
+    models = {}
+    for family in families:
+        per_fold = [by_key[(family, fold)]['metrics'] for fold in folds]
+        models[family] = {
+            'folds': per_fold,
+            'mean': {m: float(np.mean([f[m] for f in per_fold])) for m in METRICS},
+            'std': {m: float(np.std([f[m] for f in per_fold])) for m in METRICS}
+        }
+
+    fold_weights = []
+    ensemble_folds = []
+    for fold in folds:
+        accuracies = np.array([by_key[(family, fold)]['metrics']['accuracy'] for family in families])
+        weights = accuracies / accuracies.sum()
+        prob = sum(w * by_key[(family, fold)]['probabilities'] for w, family in zip(weights, families))
+        fold_weights.append(weights)
+        ensemble_folds.append(_metrics(y[fold_ids == fold], prob))
+
+    weights = np.mean(fold_weights, axis=0)
+    weights = weights / weights.sum()
+    models['ensemble'] = {
+        'folds': ensemble_folds,
+        'mean': {m: float(np.mean([f[m] for f in ensemble_folds])) for m in METRICS},
+        'std': {m: float(np.std([f[m] for f in ensemble_folds])) for m in METRICS}
+    }
+    return {
+        'folds': len(folds),
+        'families': list(families),
+        'weights': [float(w) for w in weights],
+        'fold_weights': [[float(w) for w in fw] for fw in fold_weights],
+        'models': models
+    }
+
+
+def cross_validate(predictor, disaster_type, folds=5, pool=None, workers=None, threads=1,
+                   n_samples=20000, extra_X=None, extra_y=None, seed=42):
+    """Parallel stratified k-fold evaluation of rf/xgb/lgb/nn for one disaster type
+
+    The folds cover only the training portion of predictor.training_split,
+    so the test split train_models reports accuracy on stays unseen. Pass an
+    existing pool to evaluate several disaster types without restarting
+    workers. Returns the summary dict with timing added.
+    """
+    from sklearn.model_selection import StratifiedKFold
+
+    X, _, y, _ = predictor.training_split(disaster_type, n_samples=n_samples, extra_X=extra_X, extra_y=extra_y)
+    X = predictor.to_feature_matrix(X)
+    y = np.asarray(y, dtype=np.int64)
+
+    fold_ids = np.empty(len(y), dtype=np.int64)
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    for fold, (_, test_index) in enumerate(splitter.split(X, y)):
+        fold_ids[test_index] = fold
+
+    own_pool = pool is None
+    if own_pool:
+        workers = workers or os.cpu_count() or 1
+        pool = start_pool(workers, threads)
+
+    try:
+        with SharedDataset({'X': X, 'y': y, 'fold_ids': fold_ids}) as dataset:
+            start = time.perf_counter()
+            futures = [
+                pool.submit(evaluate_fold, dataset.handle, family,
+                            predictor.get_hyperparameters(disaster_type, family), fold, threads)
+                for fold in range(folds)
+                # Slowest family first so the long fits start early
+                for family in ('nn', 'rf', 'xgb', 'lgb')
+            ]
+            results = [future.result() for future in as_completed(futures)]
+            wall_seconds = time.perf_counter() - start
+    finally:
+        if own_pool:
+            pool.shutdown()
+
+    summary = summarize(results, y, fold_ids, FAMILIES)
+    summary['timing'] = {
+        'wall_seconds': wall_seconds,
+        'total_fit_cpu_seconds': sum(r['fit_cpu_seconds'] for r in results),
+        'workers': workers,
+        'tasks': len(results)
+    }
+    return summary
+
+
+def print_summary(disaster_type, summary):
+    print(f"\n{disaster_type.upper()}: {summary['folds']}-fold cross-validation")
+    print(f"   {'model':10s} " + ' '.join(f'{m:>16s}' for m in METRICS))
+    for name, stats in summary['models'].items():
+        cells = ' '.join(f"{stats['mean'][m]:.4f} ± {stats['std'][m]:.4f}".rjust(16) for m in METRICS)
+        print(f"   {name:10s} {cells}")
+    weights = summary['weights']
+    print(f"   Fold-averaged weights: RF={weights[0]:.3f}, XGB={weights[1]:.3f}, "
+          f"LGB={weights[2]:.3f}, NN={weights[3]:.3f}")
+    timing = summary['timing']
+    line = f"   {timing['tasks']} fits on {timing['workers']} workers: {timing['wall_seconds']:.1f}s wall"
+    if 'single_worker_wall_seconds' in timing:
+        line += (f", {timing['single_worker_wall_seconds']:.1f}s on one worker "
+                 f"({timing['speedup']:.1f}x)")
+    print(line)
+
+
+def run(disaster_types, folds=5, workers=None, threads=1, n_samples=20000,
+        output_path=os.path.join('models', 'cv_report.json'), measure_speedup=False):
+    from advanced_disaster_predictor import AdvancedDisasterPredictor
+
+    predictor = AdvancedDisasterPredictor()
+    predictor.load_hyperparameters(os.path.join('models', 'hyperparameters.json'))
+    workers = workers or max(1, (os.cpu_count() or 1) // threads)
+
+    report = {}
+    pool = start_pool(workers, threads)
+    baseline_pool = start_pool(1, threads) if measure_speedup else None
+    try:
+        for disaster_type in disaster_types:
+            summary = cross_validate(predictor, disaster_type, folds=folds, pool=pool, workers=workers,
+                                     threads=threads, n_samples=n_samples)
+            if baseline_pool is not None:
+                # Same tasks on one worker with the same threads per fit
+                baseline = cross_validate(predictor, disaster_type, folds=folds, pool=baseline_pool,
+                                          workers=1, threads=threads, n_samples=n_samples)
+                single = baseline['timing']['wall_seconds']
+                summary['timing']['single_worker_wall_seconds'] = single
+                summary['timing']['speedup'] = single / summary['timing']['wall_seconds']
+            report[disaster_type] = summary
+            print_summary(disaster_type, summary)
+    finally:
+        pool.shutdown()
+        if baseline_pool is not None:
+            baseline_pool.shutdown()
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Cross-validation report saved to {output_path}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel k-fold evaluation of the disaster models')
+    parser.add_argument('--disaster-types', nargs='+', default=DISASTER_TYPES)
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: cores / threads)')
+    parser.add_argument('--threads', type=int, default=1, help='Threads per fit')
+    parser.add_argument('--n-samples', type=int, default=20000, help='Synthetic samples per disaster type')
+    parser.add_argument('--output', default=os.path.join('models', 'cv_report.json'))
+    parser.add_argument('--measure-speedup', action='store_true',
+                        help='Also run each evaluation on one worker and report the wall-time speedup')
+    args = parser.parse_args()
+
+    run(args.disaster_types, folds=args.folds, workers=args.workers, threads=args.threads,
+        n_samples=args.n_samples, output_path=args.output, measure_speedup=args.measure_speedup)
+
+
+if __name__ == "__main__":
+    main()
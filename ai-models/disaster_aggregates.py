@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Materialized historical-disaster aggregates per grid cell
+
+A local SQLite database stands in for the platform's disaster collection
+(server/models/Disaster.js). Events are rolled up into per-cell daily counts,
+and a cell_aggregates table materializes the 1-year and 5-year counts, mean
+severity and last event time as of one day. The aggregates are also held in
+memory, so feature lookups at request time are a dict lookup (or one
+vectorized search for batches) instead of a history query. New disasters
+update the rollup and the aggregates incrementally; the materialized view is
+recomputed only when the day rolls over.
+
+    python disaster_aggregates.py --import disasters.json --db data/disasters.sqlite
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+DAY_SECONDS = 86400
+
+# Statuses that describe a disaster that actually happened
+OBSERVED_STATUSES = ('active', 'resolved')
+
+SEVERITY_SCORES = {'low': 0.25, 'medium': 0.5, 'high': 0.75, 'critical': 1.0}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS disasters (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    status TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    occurred_at REAL NOT NULL,
+    cell INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cell_days (
+    cell INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    severity_sum REAL NOT NULL,
+    last_event REAL NOT NULL,
+    PRIMARY KEY (cell, day)
+);
+CREATE TABLE IF NOT EXISTS cell_aggregates (
+    cell INTEGER PRIMARY KEY,
+    count_1y INTEGER NOT NULL,
+    count_5y INTEGER NOT NULL,
+    severity_sum_5y REAL NOT NULL,
+    last_event REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value REAL
+);
+"""
+
+
+def _parse_date(value):
+    """Epoch seconds from an ISO string, epoch millis or a mongoexport {"$date": ...}"""
+    if isinstance(value, dict):
+        value = value.get('$date', value.get('$numberLong'))
+        if isinstance(value, dict):
+            value = value.get('$numberLong')
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) or (isinstance(value, str) and value.isdigit()):
+        return float(value) / 1000
+    return pd.Timestamp(value).timestamp()
+
+
+def _location_point(location):
+    """(lat, lon) of a GeoJSON Point, or the mean vertex of a Polygon's outer ring"""
+    coordinates = location['coordinates']
+    if location.get('type') == 'Polygon':
+        ring = np.asarray(coordinates[0], dtype=np.float64)
+        lon, lat = ring[:, 0].mean(), ring[:, 1].mean()
+    else:
+        lon, lat = coordinates[:2]
+    return float(lat), float(lon)
+
+
+class DisasterAggregates:
+    """Per-cell disaster history aggregates backed by SQLite"""
+
+    def __init__(self, db_path, cell_degrees=0.5):
+        self.db_path = db_path
+        self.cell_degrees = cell_degrees
+        self.n_rows = int(round(180 / cell_degrees))
+        self.n_cols = int(round(360 / cell_degrees))
+
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+        self.aggregates = {}
+        self.as_of_day = None
+        self.coverage_start = None
+        self._arrays = None
+        self._load()
+
+    def cell_of(self, lat, lon):
+        row = min(max(int(np.floor((lat + 90) / self.cell_degrees)), 0), self.n_rows - 1)
+        col = int(np.floor((lon + 180) / self.cell_degrees)) % self.n_cols
+        return row * self.n_cols + col
+
+    def _meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def _load(self):
+        """Read the materialized table, recomputing it if it is from an earlier day"""
+        with self._lock:
+            as_of = self._meta('as_of_day')
+            self.coverage_start = self._meta('coverage_start')
+            if as_of is None or int(as_of) != int(time.time() // DAY_SECONDS):
+                self._refresh_locked(int(time.time() // DAY_SECONDS))
+                return
+            self.as_of_day = int(as_of)
+            self.aggregates = {
+                cell: [count_1y, count_5y, severity_sum, last_event]
+                for cell, count_1y, count_5y, severity_sum, last_event in
+                self.conn.execute('SELECT cell, count_1y, count_5y, severity_sum_5y, last_event '
+                                  'FROM cell_aggregates')
+            }
+            self._arrays = None
+
+    def refresh(self, now=None):
+        """Rematerialize the aggregates as of now's day (no-op within the same day)"""
+        day = int((now or datetime.now()).timestamp() // DAY_SECONDS)
+        with self._lock:
+            if day != self.as_of_day:
+                self._refresh_locked(day)
+
+    def _refresh_locked(self, day):
+        self.conn.execute('DELETE FROM cell_aggregates')
+        self.conn.execute(
+            """
+            INSERT INTO cell_aggregates (cell, count_1y, count_5y, severity_sum_5y, last_event)
+            SELECT cell,
+                   SUM(CASE WHEN day > :day - 365 THEN count ELSE 0 END),
+                   SUM(CASE WHEN day > :day - 1826 THEN count ELSE 0 END),
+                   SUM(CASE WHEN day > :day - 1826 THEN severity_sum ELSE 0 END),
+                   MAX(last_event)
+            FROM cell_days
+            WHERE day <= :day
+            GROUP BY cell
+            """,
+            {'day': day}
+        )
+        self._set_meta('as_of_day', day)
+        self.conn.commit()
+
+        self.as_of_day = day
+        self.aggregates = {
+            cell: [count_1y, count_5y, severity_sum, last_event]
+            for cell, count_1y, count_5y, severity_sum, last_event in
+            self.conn.execute('SELECT cell, count_1y, count_5y, severity_sum_5y, last_event '
+                              'FROM cell_aggregates')
+        }
+        self._arrays = None
+
+    def _record(self, disaster_id, disaster_type, severity, status, lat, lon, occurred_at):
+        """Store one event and fold it into the rollup; returns True if it was counted"""
+        previous = self.conn.execute('SELECT status FROM disasters WHERE id = ?',
+                                     (disaster_id,)).fetchone()
+        cell = self.cell_of(lat, lon)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO disasters VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (disaster_id, disaster_type, severity, status, lat, lon, occurred_at, cell)
+        )
+        already_counted = previous is not None and previous[0] in OBSERVED_STATUSES
+        if status not in OBSERVED_STATUSES or already_counted:
+            return False
+
+        score = SEVERITY_SCORES.get(severity, 0.5)
+        day = int(occurred_at // DAY_SECONDS)
+        self.conn.execute(
+            """
+            INSERT INTO cell_days (cell, day, count, severity_sum, last_event)
+            VALUES (?, ?, 1, ?, ?)
+            ON CONFLICT (cell, day) DO UPDATE SET
+                count = count + 1,
+                severity_sum = severity_sum + excluded.severity_sum,
+                last_event = MAX(last_event, excluded.last_event)
+            """,
+            (cell, day, score, occurred_at)
+        )
+        if self.coverage_start is None or occurred_at < self.coverage_start:
+            self.coverage_start = occurred_at
+            self._set_meta('coverage_start', occurred_at)
+
+        # Keep the materialized row and the in-memory copy current
+        if self.as_of_day is not None and day <= self.as_of_day:
+            entry = self.aggregates.setdefault(cell, [0, 0, 0.0, occurred_at])
+            if day > self.as_of_day - 365:
+                entry[0] += 1
+            if day > self.as_of_day - 1826:
+                entry[1] += 1
+                entry[2] += score
+            entry[3] = max(entry[3], occurred_at)
+            self.conn.execute('INSERT OR REPLACE INTO cell_aggregates VALUES (?, ?, ?, ?, ?)',
+                              (cell, *entry))
+            self._arrays = None
+        return True
+
+    def add_disaster(self, document):
+        """Add or update one disaster document (Disaster.js shape); returns True if counted"""
+        with self._lock:
+            counted = self._record(*self._parse(document))
+            self.conn.commit()
+        return counted
+
+    def add_disasters(self, documents):
+        """Add many disaster documents in one transaction; returns how many were counted"""
+        counted = 0
+        with self._lock:
+            for document in documents:
+                counted += self._record(*self._parse(document))
+            self.conn.commit()
+        return counted
+
+    def _parse(self, document):
+        disaster_id = document.get('_id') or document.get('id')
+        if isinstance(disaster_id, dict):
+            disaster_id = disaster_id.get('$oid')
+        lat, lon = _location_point(document['location'])
+        occurred_at = (_parse_date(document.get('createdAt')) or
+                       _parse_date((document.get('prediction') or {}).get('expectedTime')) or
+                       time.time())
+        if disaster_id is None:
+            disaster_id = f"{document['type']}:{lat:.5f}:{lon:.5f}:{occurred_at:.0f}"
+        return (str(disaster_id), document['type'], document.get('severity', 'medium'),
+                document.get('status', 'predicted'), lat, lon, occurred_at)
+
+    def import_dump(self, path):
+        """Import a JSON array or mongoexport (one document per line) dump"""
+        with open(path) as f:
+            text = f.read()
+        if text.lstrip().startswith('['):
+            documents = json.loads(text)
+        else:
+            documents = [json.loads(line) for line in text.splitlines() if line.strip()]
+        counted = self.add_disasters(documents)
+        with self._lock:
+            self._refresh_locked(self.as_of_day or int(time.time() // DAY_SECONDS))
+        return len(documents), counted
+
+    def _batch_arrays(self):
+        """Sorted cell ids and aligned aggregate columns for vectorized lookups"""
+        if self._arrays is None:
+            cells = np.fromiter(self.aggregates.keys(), dtype=np.int64, count=len(self.aggregates))
+            values = np.array(list(self.aggregates.values()), dtype=np.float64).reshape(-1, 4)
+            order = np.argsort(cells)
+            self._arrays = cells[order], values[order]
+        return self._arrays
+
+    def features(self, lat, lon, now=None):
+        """Historical disaster features for one location"""
+        if self.coverage_start is None:
+            return {}
+        now = now or datetime.now()
+        if int(now.timestamp() // DAY_SECONDS) != self.as_of_day:
+            self.refresh(now)
+        entry = self.aggregates.get(self.cell_of(lat, lon))
+        timestamp = now.timestamp()
+        if entry is None:
+            return {
+                'historical_disaster_count_1y': 0,
+                'historical_disaster_count_5y': 0,
+                'days_since_last_disaster': (timestamp - self.coverage_start) / DAY_SECONDS
+            }
+        count_1y, count_5y, severity_sum, last_event = entry
+        features = {
+            'historical_disaster_count_1y': count_1y,
+            'historical_disaster_count_5y': count_5y,
+            'days_since_last_disaster': max(timestamp - last_event, 0) / DAY_SECONDS
+        }
+        if count_5y:
+            features['avg_disaster_severity'] = severity_sum / count_5y
+        return features
+
+    def features_batch(self, lats, lons, now=None):
+        """Historical disaster features for many locations; NaN where unknown"""
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        n = len(lats)
+        names = ['historical_disaster_count_1y', 'historical_disaster_count_5y',
+                 'days_since_last_disaster', 'avg_disaster_severity']
+        if self.coverage_start is None:
+            return {name: np.full(n, np.nan) for name in names}
+
+        now = now or datetime.now()
+        if int(now.timestamp() // DAY_SECONDS) != self.as_of_day:
+            self.refresh(now)
+        timestamp = now.timestamp()
+
+        rows = np.clip(np.floor((lats + 90) / self.cell_degrees).astype(np.int64), 0, self.n_rows - 1)
+        cols = np.floor((lons + 180) / self.cell_degrees).astype(np.int64) % self.n_cols
+        query = rows * self.n_cols + cols
+
+        with self._lock:
+            cells, values = self._batch_arrays()
+        position = np.minimum(np.searchsorted(cells, query), max(len(cells) - 1, 0))
+        found = (cells[position] == query) if len(cells) else np.zeros(n, dtype=bool)
+        matched = values[position] if len(cells) else np.zeros((n, 4))
+
+        count_1y = np.where(found, matched[:, 0], 0.0)
+        count_5y = np.where(found, matched[:, 1], 0.0)
+        last_event = np.where(found, matched[:, 3], self.coverage_start)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            severity = np.where(found & (count_5y > 0), matched[:, 2] / count_5y, np.nan)
+        return {
+            'historical_disaster_count_1y': count_1y,
+            'historical_disaster_count_5y': count_5y,
+            'days_since_last_disaster': np.maximum(timestamp - last_event, 0) / DAY_SECONDS,
+            'avg_disaster_severity': severity
+        }
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def synthetic_dump(n_events, seed=42):
+    """Disaster documents in the Disaster.js shape, for benchmarking"""
+    rng = np.random.default_rng(seed)
+    types = ['flood', 'cyclone', 'earthquake', 'landslide', 'fire', 'tsunami']
+    severities = list(SEVERITY_SCORES)
+    now = time.time()
+    documents = []
+    for i in range(n_events):
+        created = datetime.fromtimestamp(now - rng.uniform(0, 8 * 365) * DAY_SECONDS, tz=timezone.utc)
+        documents.append({
+            '_id': {'$oid': f'{i:024x}'},
+            'type': types[rng.integers(len(types))],
+            'severity': severities[rng.integers(len(severities))],
+            'status': 'resolved' if rng.random() < 0.9 else 'predicted',
+            'location': {'type': 'Point',
+                         'coordinates': [float(rng.uniform(60, 100)), float(rng.uniform(5, 35))]},
+            'createdAt': {'$date': created.isoformat()}
+        })
+    return documents
+
+
+def benchmark(db_path, n_events, n_queries):
+    db_path = db_path or os.path.join(tempfile.mkdtemp(prefix='guardian-disasters-'), 'disasters.sqlite')
+    aggregates = DisasterAggregates(db_path)
+    documents = synthetic_dump(n_events)
+
+    start = time.perf_counter()
+    aggregates.add_disasters(documents)
+    aggregates.refresh()
+    import_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(7)
+    lats = rng.uniform(5, 35, n_queries)
+    lons = rng.uniform(60, 100, n_queries)
+
+    start = time.perf_counter()
+    for lat, lon in zip(lats[:10000], lons[:10000]):
+        aggregates.features(lat, lon)
+    single_us = (time.perf_counter() - start) / min(n_queries, 10000) * 1e6
+
+    start = time.perf_counter()
+    aggregates.features_batch(lats, lons)
+    batch_seconds = time.perf_counter() - start
+
+    new = synthetic_dump(1000, seed=9)
+    for i, document in enumerate(new):
+        document['_id'] = {'$oid': f'{n_events + i:024x}'}
+        document['status'] = 'active'
+    start = time.perf_counter()
+    for document in new:
+        aggregates.add_disaster(document)
+    add_ms = (time.perf_counter() - start) / len(new) * 1000
+
+    start = time.perf_counter()
+    with aggregates._lock:
+        aggregates._refresh_locked(aggregates.as_of_day)
+    refresh_seconds = time.perf_counter() - start
+
+    print(f"Database:              {db_path}")
+    print(f"Events imported:       {n_events:,} in {import_seconds:.2f}s "
+          f"({len(aggregates.aggregates):,} cells)")
+    print(f"Single lookup:         {single_us:.1f} us")
+    print(f"Batch lookup:          {n_queries:,} points in {batch_seconds * 1000:.1f} ms")
+    print(f"Incremental add:       {add_ms:.2f} ms per disaster")
+    print(f"Full rematerialize:    {refresh_seconds * 1000:.0f} ms (once per day)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Historical disaster aggregates per grid cell')
+    parser.add_argument('--db', default='data/disasters.sqlite')
+    parser.add_argument('--import', dest='dump', help='JSON or mongoexport dump of Disaster documents')
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(None, args.events, args.queries)
+    elif args.dump:
+        os.makedirs(os.path.dirname(args.db) or '.', exist_ok=True)
+        aggregates = DisasterAggregates(args.db)
+        total, counted = aggregates.import_dump(args.dump)
+        print(f"✅ Imported {total:,} disasters ({counted:,} observed) into {args.db}: "
+              f"{len(aggregates.aggregates):,} cells")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,9 @@ from sklearn.preprocessing import StandardScaler
 import joblib
 import requests
 import json
+import os
 from datetime import datetime, timedelta
+from upstream_scheduler import request_json, submit_json, result_json, UpstreamRateLimited, UpstreamTimeout
 
 class DisasterPredictor:
     def __init__(self):
@@ -23,22 +25,32 @@ class DisasterPredictor:
             'soil_moisture', 'river_level', 'season'
         ]
     
-    def load_weather_data(self, lat, lon, api_key):
-        """Fetch real-time weather data from OpenWeatherMap API"""
+    def load_weather_data(self, lat, lon, api_key, priority='interactive'):
+        """Fetch real-time weather data from OpenWeatherMap API
+        
+        Calls go through the upstream scheduler, if one is configured.
+        """
+        base_url = os.getenv('WEATHER_API_BASE_URL', 'http://api.openweathermap.org').rstrip('/')
         try:
             # Current weather
-            current_url = f"http://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={api_key}&units=metric"
-            current_response = requests.get(current_url)
-            current_data = current_response.json()
+            current_data = request_json(f"{base_url}/data/2.5/weather",
+                                        {'lat': lat, 'lon': lon, 'appid': api_key, 'units': 'metric'},
+                                        priority=priority)
             
-            # Historical weather (last 7 days)
-            historical_data = []
+            # Historical weather (last 7 days), queued together
+            handles = []
             for i in range(7):
                 timestamp = int((datetime.now() - timedelta(days=i)).timestamp())
-                hist_url = f"http://api.openweathermap.org/data/2.5/onecall/timemachine?lat={lat}&lon={lon}&dt={timestamp}&appid={api_key}&units=metric"
-                hist_response = requests.get(hist_url)
-                if hist_response.status_code == 200:
-                    historical_data.append(hist_response.json())
+                handles.append(submit_json(f"{base_url}/data/2.5/onecall/timemachine",
+                                           {'lat': lat, 'lon': lon, 'dt': timestamp, 'appid': api_key,
+                                            'units': 'metric'},
+                                           priority=priority))
+            historical_data = []
+            for handle in handles:
+                try:
+                    historical_data.append(result_json(handle))
+                except (requests.RequestException, UpstreamRateLimited, UpstreamTimeout):
+                    continue
             
             return self.process_weather_data(current_data, historical_data)
         except Exception as e:
@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+"""
+Batched feature attributions for the ensemble predictions
+
+Each member model is explained in batch and its attributions are combined with
+the ensemble weights, so the contributions of a row add up to its ensemble
+probability minus the base value:
+
+- XGBoost and LightGBM: path-dependent TreeSHAP computed natively by the
+  libraries (pred_contribs), in log-odds and rescaled to probability units
+- Random Forest: TreeSHAP via the shap package when it is installed, otherwise
+  Saabas path attributions (the same per-node walk without the Shapley
+  weighting) computed for all trees as one sparse product
+
+Exact TreeSHAP costs O(trees x leaves x depth^2) per row, which for the deep
+XGBoost models is tens of milliseconds. method='saabas' uses path attributions
+for all three tree models instead (XGBoost's approx_contribs, and per-leaf
+contribution tables for LightGBM looked up from pred_leaf), which is one to two
+orders of magnitude cheaper and suits large batches.
+- Neural network: integrated gradients from the training mean (zero after
+  scaling), corrected so they sum exactly to the change in probability
+
+With max_ms set, tree models start from Saabas and are upgraded to exact
+TreeSHAP, cheapest first, while the measured per-row costs fit the budget; a
+member whose exact cost is not known yet is timed on one row in the background,
+inside a slot of the server's ThreadBudget when one is given.
+The methods used are reported with each explanation.
+
+Results are cached per row and model version; retraining or an incremental
+update installs a new ensemble and drops that model's cached rows. Per-model
+tables are held weakly and rebuilt when a model is grown in place, so they
+never keep an evicted model alive.
+
+    python explanations.py --disaster-type flood --sizes 1 100 2000
+"""
+
+import argparse
+import itertools
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import nullcontext
+
+import numpy as np
+
+try:
+    import shap
+except ImportError:
+    shap = None
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _margin_to_probability(contributions):
+    """Rescale log-odds contributions (last column = bias) to probability units
+
+    Every feature keeps its share of the margin; the total becomes
+    sigmoid(margin) - sigmoid(bias).
+    """
+    phi, bias = contributions[:, :-1], contributions[:, -1]
+    margin = bias + phi.sum(axis=1)
+    base = _sigmoid(bias)
+    prob = _sigmoid(margin)
+    delta = margin - bias
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(np.abs(delta) > 1e-9, (prob - base) / delta, prob * (1 - prob))
+    return phi * scale[:, None], base
+
+
+def _model_version(model):
+    """Changes when a model is refitted or grown in place (e.g. warm_start)"""
+    estimators = getattr(model, 'estimators_', None)
+    if estimators is not None:
+        return len(estimators), id(estimators[0]), id(estimators[-1])
+    booster = getattr(model, '_Booster', None)
+    if booster is not None:
+        # LightGBM and XGBoost boosters respectively
+        rounds = getattr(booster, 'current_iteration', None) or booster.num_boosted_rounds
+        return id(booster), rounds()
+    return None
+
+
+class _ModelCache:
+    """Values derived from a model, dropped with the model or when it changes"""
+
+    def __init__(self):
+        self._entries = weakref.WeakKeyDictionary()
+
+    def get(self, model):
+        entry = self._entries.get(model)
+        if entry is not None and entry[0] == _model_version(model):
+            return entry[1]
+        return None
+
+    def put(self, model, value):
+        self._entries[model] = (_model_version(model), value)
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+
+TREE_MODELS = ('rf', 'xgb', 'lgb')
+
+
+class EnsembleExplainer:
+    """Feature contributions for ensemble predictions, cached per model version"""
+
+    METHODS = ('treeshap', 'saabas')
+
+    def __init__(self, method='treeshap', nn_steps=16, cache_size=50000, chunk_size=2048, max_ms=None,
+                 budget=None):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown explanation method: {method}")
+        self.method = method
+        self.nn_steps = nn_steps
+        self.cache_size = cache_size
+        self.chunk_size = chunk_size
+        self.max_ms = max_ms
+        # ThreadBudget shared with request handlers; background probes take a
+        # slot from it like any other model call
+        self.budget = budget
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        # predictor -> (serial, {disaster_type: ensemble}); cache keys use the
+        # serial, so rows of a dropped predictor simply age out of the LRU
+        self._owners = weakref.WeakKeyDictionary()
+        self._serials = itertools.count()
+        self._rf_paths = _ModelCache()
+        self._rf_explainers = _ModelCache()
+        self._leaf_tables = _ModelCache()
+        self._gradients = _ModelCache()
+        self._costs = _ModelCache()
+        self._probing = weakref.WeakSet()
+        self._probe_lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'rows': 0, 'seconds': 0.0,
+                      'exact_members': 0, 'budget_fallbacks': 0, 'probes': 0}
+
+    # Member models
+
+    def _xgb(self, model, X, method):
+        import xgboost as xgb
+
+        contributions = model.get_booster().predict(xgb.DMatrix(X), pred_contribs=True,
+                                                    approx_contribs=method == 'saabas')
+        return _margin_to_probability(np.asarray(contributions, dtype=np.float64))
+
+    def _lgb_leaf_tables(self, model):
+        """Per-tree (leaves x features) Saabas contributions from the dumped trees"""
+        cached = self._leaf_tables.get(model)
+        if cached is not None:
+            return cached
+
+        dump = model.booster_.dump_model()
+        n_features = model.n_features_in_
+        trees = dump['tree_info']
+        n_leaves = max(tree['num_leaves'] for tree in trees)
+        tables = np.zeros((len(trees), n_leaves, n_features))
+        bias = 0.0
+        for t, tree in enumerate(trees):
+            root = tree['tree_structure']
+            bias += root.get('internal_value', root.get('leaf_value', 0.0))
+            stack = [(root, np.zeros(n_features))]
+            while stack:
+                node, path = stack.pop()
+                if 'leaf_index' in node or 'split_feature' not in node:
+                    tables[t, node.get('leaf_index', 0)] = path
+                    continue
+                for side in ('left_child', 'right_child'):
+                    child = node[side]
+                    value = child.get('internal_value', child.get('leaf_value'))
+                    child_path = path.copy()
+                    child_path[node['split_feature']] += value - node['internal_value']
+                    stack.append((child, child_path))
+        return self._leaf_tables.put(model, (tables, bias))
+
+    def _lgb(self, model, X, method):
+        if method == 'treeshap':
+            contributions = model.predict(X, pred_contrib=True)
+            return _margin_to_probability(np.asarray(contributions, dtype=np.float64))
+        tables, bias = self._lgb_leaf_tables(model)
+        leaves = model.predict(X, pred_leaf=True)
+        contributions = np.zeros((len(X), tables.shape[2] + 1))
+        for t in range(tables.shape[0]):
+            contributions[:, :-1] += tables[t][leaves[:, t]]
+        contributions[:, -1] = bias
+        return _margin_to_probability(contributions)
+
+    def _rf_path_matrix(self, model):
+        """Stacked (nodes x features) matrix of each node's change in class-1 probability"""
+        from scipy import sparse
+
+        cached = self._rf_paths.get(model)
+        if cached is not None:
+            return cached
+
+        blocks = []
+        roots = []
+        n_features = model.n_features_in_
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            value = tree.value[:, 0, :]
+            p = value[:, 1] / value.sum(axis=1)
+            parent = np.full(tree.node_count, -1)
+            internal = np.flatnonzero(tree.children_left >= 0)
+            parent[tree.children_left[internal]] = internal
+            parent[tree.children_right[internal]] = internal
+            child = np.flatnonzero(parent >= 0)
+            blocks.append(sparse.csr_matrix(
+                (p[child] - p[parent[child]], (child, tree.feature[parent[child]])),
+                shape=(tree.node_count, n_features)))
+            roots.append(p[0])
+        matrix = sparse.vstack(blocks).tocsr() / len(blocks)
+        bias = float(np.mean(roots))
+        return self._rf_paths.put(model, (matrix, bias))
+
+    def _rf(self, model, X, method):
+        if method == 'treeshap':
+            explainer = self._rf_explainers.get(model)
+            if explainer is None:
+                explainer = self._rf_explainers.put(
+                    model, shap.TreeExplainer(model, feature_perturbation='tree_path_dependent'))
+            values = explainer.shap_values(X, check_additivity=False)
+            values = values[1] if isinstance(values, list) else np.asarray(values)[..., 1]
+            base = np.asarray(explainer.expected_value).reshape(-1)[-1]
+            return np.asarray(values, dtype=np.float64), np.full(len(X), base)
+        matrix, bias = self._rf_path_matrix(model)
+        indicator, _ = model.decision_path(X)
+        return np.asarray((indicator @ matrix).todense(), dtype=np.float64), np.full(len(X), bias)
+
+    def _gradient_fn(self, model):
+        import tensorflow as tf
+
+        cached = self._gradients.get(model)
+        if cached is not None:
+            return cached
+        # The traced function must not hold the model it is cached under
+        model_ref = weakref.ref(model)
+
+        @tf.function(input_signature=[tf.TensorSpec([None, None], tf.float32)])
+        def gradients(x):
+            with tf.GradientTape() as tape:
+                tape.watch(x)
+                prob = model_ref()(x, training=False)[:, 0]
+            return tape.gradient(prob, x)
+
+        return self._gradients.put(model, gradients)
+
+    def _nn(self, model, X, nn_probabilities):
+        """Integrated gradients from the all-zero (training mean) baseline"""
+        gradients = self._gradient_fn(model)
+        X = np.asarray(X, dtype=np.float32)
+        alphas = ((np.arange(self.nn_steps) + 0.5) / self.nn_steps).astype(np.float32)
+        rows = max(1, self.chunk_size // self.nn_steps)
+        attributions = np.empty(X.shape, dtype=np.float64)
+        for start in range(0, len(X), rows):
+            x = X[start:start + rows]
+            path = (alphas[:, None, None] * x[None, :, :]).reshape(-1, x.shape[1])
+            grads = np.asarray(gradients(path)).reshape(self.nn_steps, len(x), x.shape[1])
+            attributions[start:start + rows] = grads.mean(axis=0) * x
+
+        base = float(nn_probabilities(model, np.zeros((1, X.shape[1]), dtype=np.float32))[0])
+        target = nn_probabilities(model, X) - base
+        # Spread the Riemann-sum error in proportion to each attribution's
+        # magnitude so the attributions are complete
+        residual = target - attributions.sum(axis=1)
+        magnitude = np.abs(attributions)
+        share = magnitude / np.maximum(magnitude.sum(axis=1, keepdims=True), 1e-12)
+        attributions += residual[:, None] * share
+        return attributions, np.full(len(X), base)
+
+    # Latency budget
+
+    def _cost(self, model, method):
+        costs = self._costs.get(model)
+        return costs.get(method) if costs else None
+
+    def _record_cost(self, model, method, seconds_per_row):
+        costs = self._costs.get(model)
+        if costs is None:
+            costs = self._costs.put(model, {})
+        previous = costs.get(method)
+        costs[method] = seconds_per_row if previous is None else 0.7 * previous + 0.3 * seconds_per_row
+
+    def _timed(self, key, model, X, method):
+        start = time.perf_counter()
+        result = getattr(self, f'_{key}')(model, X, method)
+        self._record_cost(model, method, (time.perf_counter() - start) / len(X))
+        return result
+
+    def _limit(self):
+        return self.budget.limit() if self.budget is not None else nullcontext()
+
+    def _probe(self, key, model):
+        """Time exact TreeSHAP for a member on one row without holding up the caller"""
+        with self._lock:
+            if model in self._probing:
+                return
+            self._probing.add(model)
+            self.stats['probes'] += 1
+
+        def run():
+            X = np.zeros((1, model.n_features_in_))
+            try:
+                # One probe at a time so they do not inflate each other's timings;
+                # the first call builds per-model state, so time the second
+                with self._probe_lock, self._limit():
+                    self._timed(key, model, X, 'treeshap')
+                    self._timed(key, model, X, 'treeshap')
+            finally:
+                self._probing.discard(model)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _member_methods(self, models, n):
+        """Attribution method for each tree model so n rows fit within max_ms"""
+        exact = 'treeshap' if self.method == 'treeshap' else 'saabas'
+        methods = {key: exact for key in TREE_MODELS}
+        if shap is None:
+            methods['rf'] = 'saabas'
+        if self.max_ms is None or exact == 'saabas':
+            return methods
+
+        spent = n * (self._cost(models['nn'], 'ig') or 0.0)
+        spent += sum(n * (self._cost(models[key], 'saabas') or 0.0) for key in TREE_MODELS)
+        extra = {}
+        for key in TREE_MODELS:
+            if methods[key] == 'saabas':
+                continue
+            cost = self._cost(models[key], 'treeshap')
+            if cost is None:
+                self._probe(key, models[key])
+            else:
+                extra[key] = n * (cost - (self._cost(models[key], 'saabas') or 0.0))
+            methods[key] = 'saabas'
+        for key in sorted(extra, key=extra.get):
+            if spent + extra[key] <= self.max_ms / 1000:
+                methods[key] = 'treeshap'
+                spent += extra[key]
+        return methods
+
+    # Ensemble
+
+    def _compute(self, predictor, X, disaster_type):
+        models = predictor.models[disaster_type]
+        weights = models['ensemble']['weights']
+        methods = self._member_methods(models, len(X))
+        parts = [self._timed(key, models[key], X, methods[key]) for key in TREE_MODELS]
+        start = time.perf_counter()
+        parts.append(self._nn(models['nn'], X, predictor.nn_probabilities))
+        self._record_cost(models['nn'], 'ig', (time.perf_counter() - start) / len(X))
+
+        with self._lock:
+            exact = sum(method == 'treeshap' for method in methods.values())
+            self.stats['exact_members'] += exact
+            if self.method == 'treeshap':
+                self.stats['budget_fallbacks'] += len(TREE_MODELS) - (shap is None) - exact
+        contributions = sum(w * phi for w, (phi, _) in zip(weights, parts))
+        base = sum(w * b for w, (_, b) in zip(weights, parts))
+        return contributions, base, methods
+
+    def _check_version(self, predictor, disaster_type):
+        """Drop cached rows of a model whose ensemble has been replaced (caller holds the lock)"""
+        entry = self._owners.get(predictor)
+        if entry is None:
+            entry = self._owners[predictor] = (next(self._serials), {})
+        serial, ensembles = entry
+        owner = (serial, disaster_type)
+        ensemble = predictor.models[disaster_type]['ensemble']
+        if ensembles.get(disaster_type, ensemble) is not ensemble:
+            for key in [key for key in self._cache if key[:2] == owner]:
+                del self._cache[key]
+            self.stats['invalidations'] += 1
+        ensembles[disaster_type] = ensemble
+        return owner
+
+    def explain_batch(self, predictor, features, disaster_type):
+        """Contributions for many feature rows
+
+        Returns 'contributions' (rows x feature_columns, probability units),
+        'base_value' per row, the raw feature matrix and the tree-model
+        'methods' used for each row.
+        """
+        start = time.perf_counter()
+        raw = predictor.to_feature_matrix(features)
+        n = len(raw)
+        contributions = np.empty(raw.shape, dtype=np.float64)
+        base = np.empty(n, dtype=np.float64)
+        methods = [None] * n
+
+        with self._lock:
+            owner = self._check_version(predictor, disaster_type)
+            keys = [owner + (row.tobytes(),) for row in raw]
+            missing = []
+            for i, key in enumerate(keys):
+                entry = self._cache.get(key)
+                if entry is None:
+                    missing.append(i)
+                    continue
+                self._cache.move_to_end(key)
+                contributions[i], base[i], methods[i] = entry
+            self.stats['hits'] += n - len(missing)
+            self.stats['misses'] += len(missing)
+
+        if missing:
+            scaled = raw[missing]
+            if disaster_type in predictor.scalers:
+                scaled = predictor.scale_features(scaled, disaster_type)
+            computed, computed_base, computed_methods = self._compute(predictor, scaled, disaster_type)
+            contributions[missing] = computed
+            base[missing] = computed_base
+            with self._lock:
+                for j, i in enumerate(missing):
+                    methods[i] = computed_methods
+                    self._cache[keys[i]] = (computed[j], computed_base[j], computed_methods)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        with self._lock:
+            self.stats['rows'] += n
+            self.stats['seconds'] += time.perf_counter() - start
+        return {'contributions': contributions, 'base_value': base, 'features': raw, 'methods': methods}
+
+    def top_features(self, predictor, explanation, row, top_k=5):
+        """JSON-ready summary of one row: base value and the largest contributions"""
+        contributions = explanation['contributions'][row]
+        order = np.argsort(-np.abs(contributions))[:top_k]
+        return {
+            'base_value': float(explanation['base_value'][row]),
+            'top_features': [
+                {
+                    'feature': predictor.feature_columns[i],
+                    'value': float(explanation['features'][row, i]),
+                    'contribution': float(contributions[i])
+                }
+                for i in order
+            ],
+            'methods': dict(explanation['methods'][row], nn='integrated_gradients')
+        }
+
+    def explain(self, predictor, features, disaster_type, top_k=5):
+        """Top contributions for a single feature row"""
+        explanation = self.explain_batch(predictor, features, disaster_type)
+        return self.top_features(predictor, explanation, 0, top_k)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['cached_rows'] = len(self._cache)
+            stats['method'] = self.method
+            stats['max_ms'] = self.max_ms
+            stats['shap_installed'] = shap is not None
+            stats['tracked_models'] = len(self._costs)
+            stats['nn_steps'] = self.nn_steps
+            stats['us_per_row'] = 1e6 * stats['seconds'] / stats['rows'] if stats['rows'] else None
+            return stats
+
+
+def benchmark(predictor, disaster_type, sizes=(1, 100, 2000), methods=EnsembleExplainer.METHODS,
+              nn_steps=16, repeats=3, max_ms=None):
+    """Prediction latency with and without explanations, plus additivity error"""
+    from features import prepare_features_batch
+
+    rng = np.random.default_rng(0)
+    results = []
+    for size in sizes:
+        features = prepare_features_batch(rng.uniform(-60, 60, size), rng.uniform(-180, 180, size), rng=rng)
+        predictor.predict_batch(features, disaster_type)
+        predict_times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            probs = predictor.predict_batch(features, disaster_type)
+            predict_times.append(time.perf_counter() - start)
+        predict_ms = 1000 * np.median(predict_times)
+
+        for method in methods:
+            explainer = EnsembleExplainer(method=method, nn_steps=nn_steps, cache_size=0, max_ms=max_ms)
+            explainer.explain_batch(predictor, features[:1], disaster_type)
+            if max_ms is not None:
+                # Let the background cost probes finish before timing
+                time.sleep(1.0)
+                explainer.explain_batch(predictor, features[:1], disaster_type)
+            explain_times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                explanation = explainer.explain_batch(predictor, features, disaster_type)
+                explain_times.append(time.perf_counter() - start)
+            total = explanation['base_value'] + explanation['contributions'].sum(axis=1)
+            explain_ms = 1000 * np.median(explain_times)
+            results.append({
+                'rows': size,
+                'method': method,
+                'predict_ms': predict_ms,
+                'explain_ms': explain_ms,
+                'overhead': explain_ms / predict_ms,
+                'max_additivity_error': float(np.max(np.abs(total - probs['probability']))),
+                'members': explanation['methods'][0]
+            })
+            print(f"   {size:6d} rows {method:8s}: predict {predict_ms:9.2f}ms  explain {explain_ms:9.2f}ms  "
+                  f"({explain_ms / predict_ms:5.1f}x)  additivity error {results[-1]['max_additivity_error']:.1e}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ensemble feature attributions')
+    parser.add_argument('--disaster-type', default='flood')
+    parser.add_argument('--model-dir', default='models')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 2000])
+    parser.add_argument('--methods', nargs='+', choices=EnsembleExplainer.METHODS, default=EnsembleExplainer.METHODS)
+    parser.add_argument('--nn-steps', type=int, default=16)
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='Latency budget per call; tree models fall back to Saabas to stay within it')
+    args = parser.parse_args()
+
+    from advanced_disaster_predictor import AdvancedDisasterPredictor
+
+    predictor = AdvancedDisasterPredictor()
+    predictor.load_disaster_models(args.disaster_type, f'{args.model_dir}/{args.disaster_type}')
+    print(f"⏱️  Explanation overhead for {args.disaster_type} "
+          f"(shap {'installed' if shap is not None else 'not installed'}, NN: {args.nn_steps} IG steps)")
+    benchmark(predictor, args.disaster_type, args.sizes, args.methods, args.nn_steps, max_ms=args.max_ms)
+
+
+if __name__ == "__main__":
+    main()
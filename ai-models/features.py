@@ -0,0 +1,369 @@
+"""
+Feature preparation for the prediction server and offline scoring tools
+"""
+
+import numpy as np
+import pandas as pd
+from datetime import datetime
+import math
+import os
+
+from upstream_scheduler import submit_json, result_json
+
+WEATHER_KEYS = ['temperature', 'humidity', 'pressure', 'wind_speed', 'wind_direction', 'rainfall_1h']
+
+# Identical weather requests within this many degrees share one upstream call
+WEATHER_COALESCE_DEGREES = 0.01
+
+# Local data sources (weather time-series store, ...) whose measured values
+# replace the synthetic proxies below. Each source provides
+# features(lat, lon, now) -> dict and features_batch(lats, lons, now) -> dict
+# of arrays with NaN where no measurement is available.
+FEATURE_SOURCES = []
+
+# Weather time-series store updated by fetch_weather_data, if configured
+weather_store = None
+
+# Seed for reproducible per-location mock weather and synthetic features
+# (load testing); None draws from the global RNG as before
+deterministic_seed = None
+
+def register_feature_source(source):
+    """Use a local data source for the features it can measure"""
+    if source not in FEATURE_SOURCES:
+        FEATURE_SOURCES.append(source)
+
+def configure_weather_store(store):
+    """Record fetched observations in a WeatherTimeSeriesStore and read rolling features from it"""
+    global weather_store
+    weather_store = store
+    register_feature_source(store)
+
+def configure_deterministic_weather(seed):
+    """Make mock weather and synthetic features a pure function of (seed, location)
+
+    The weather API is never called while this is set, so load tests do not
+    spend the upstream quota. Pass None to restore random draws.
+    """
+    global deterministic_seed
+    deterministic_seed = None if seed is None else int(seed)
+
+# Weather and the synthetic features draw from separate per-location streams
+WEATHER_STREAM = 1
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+def _splitmix64(x):
+    """SplitMix64 finalizer, element-wise over uint64 arrays"""
+    with np.errstate(over='ignore'):
+        x = x + _GOLDEN
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+class LocationRandom:
+    """Generator-like source of random draws keyed by location
+
+    Each location gets its own counter-based stream (SplitMix64 over the seed,
+    the stream id, the coordinates rounded to `resolution` degrees and the
+    draw number), so a
+    location's values do not depend on which other locations share the batch
+    or in what order requests arrive. Implements the subset of
+    numpy.random.Generator used by prepare_features_batch.
+    """
+
+    def __init__(self, seed, lats, lons, stream=0, resolution=1e-4):
+        lat_q = np.round(np.asarray(lats, dtype=np.float64) / resolution).astype(np.int64)
+        lon_q = np.round(np.asarray(lons, dtype=np.float64) / resolution).astype(np.int64)
+        with np.errstate(over='ignore'):
+            cell = (lat_q.astype(np.uint64) << np.uint64(32)) ^ (lon_q.astype(np.uint64) & np.uint64(0xFFFFFFFF))
+            salt = _splitmix64(np.array([seed & 0xFFFFFFFFFFFFFFFF, stream], dtype=np.uint64))
+            self.keys = _splitmix64(_splitmix64(cell) ^ salt[0]) ^ salt[1]
+        self.n = len(self.keys)
+        self.draws = 0
+
+    def _unit(self, size):
+        if size is not None and size != self.n:
+            raise ValueError(f"LocationRandom draws {self.n} values, not {size}")
+        self.draws += 1
+        with np.errstate(over='ignore'):
+            bits = _splitmix64(self.keys + np.uint64(self.draws) * _GOLDEN)
+        # 53 random bits, centred so the result is strictly inside (0, 1)
+        return ((bits >> np.uint64(11)).astype(np.float64) + 0.5) * 2.0 ** -53
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        return low + (high - low) * self._unit(size)
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        u1, u2 = self._unit(size), self._unit(size)
+        return loc + scale * np.sqrt(-2 * np.log(u1)) * np.cos(2 * np.pi * u2)
+
+    def exponential(self, scale=1.0, size=None):
+        return -scale * np.log(self._unit(size))
+
+    def integers(self, low, high, size=None):
+        return low + np.floor(self._unit(size) * (high - low)).astype(np.int64)
+
+    def poisson(self, lam=1.0, size=None):
+        # Inverse CDF by binary search over the cumulative pmf table
+        k = np.arange(int(lam + 12 * np.sqrt(lam) + 20))
+        log_pmf = k * np.log(lam) - lam - np.array([math.lgamma(i + 1) for i in k])
+        cdf = np.cumsum(np.exp(log_pmf))
+        return np.minimum(np.searchsorted(cdf, self._unit(size)), len(k) - 1)
+
+def fetch_weather_batch(lats, lons, priority='bulk'):
+    """Weather for many locations as a dict of arrays keyed by WEATHER_KEYS
+
+    With deterministic weather configured this is a single vectorized draw;
+    otherwise all locations are queued with the upstream scheduler at once
+    and collected as they complete.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if deterministic_seed is not None:
+        rng = LocationRandom(deterministic_seed, lats, lons, stream=WEATHER_STREAM)
+        return generate_mock_weather_batch(len(lats), rng)
+    handles = [submit_weather(lat, lon, priority) for lat, lon in zip(lats, lons)]
+    weather = {key: np.empty(len(lats)) for key in WEATHER_KEYS}
+    for i, handle in enumerate(handles):
+        observed = collect_weather(lats[i], lons[i], handle)
+        for key in WEATHER_KEYS:
+            weather[key][i] = observed[key]
+    return weather
+
+def submit_weather(lat, lon, priority='interactive'):
+    """Queue a current-weather request (None without an API key)"""
+    api_key = os.getenv('WEATHER_API_KEY')
+    if not api_key:
+        return None
+    base_url = os.getenv('WEATHER_API_BASE_URL', 'http://api.openweathermap.org').rstrip('/')
+    key = ('weather', round(lat / WEATHER_COALESCE_DEGREES), round(lon / WEATHER_COALESCE_DEGREES))
+    try:
+        return submit_json(f"{base_url}/data/2.5/weather",
+                           {'lat': lat, 'lon': lon, 'appid': api_key, 'units': 'metric'},
+                           key=key, priority=priority)
+    except Exception as e:
+        print(f"Error fetching weather data: {e}")
+        return None
+
+def collect_weather(lat, lon, handle):
+    """Weather from a submit_weather handle, or mock weather if it failed"""
+    if handle is None:
+        return generate_mock_weather_data()
+    try:
+        data = result_json(handle)
+        
+        weather_data = {
+            'temperature': data['main']['temp'],
+            'humidity': data['main']['humidity'],
+            'pressure': data['main']['pressure'],
+            'wind_speed': data['wind']['speed'],
+            'wind_direction': data['wind'].get('deg', 0),
+            'rainfall_1h': data.get('rain', {}).get('1h', 0)
+        }
+        
+        # Only real observations feed the rolling-window store
+        if weather_store is not None:
+            weather_store.record(lat, lon, weather_data)
+        
+        return weather_data
+    except Exception as e:
+        print(f"Error fetching weather data: {e}")
+        return generate_mock_weather_data()
+
+def fetch_weather_data(lat, lon, priority='interactive'):
+    """Fetch real-time weather data
+    
+    Calls go through the upstream scheduler (if configured) at the given
+    priority: interactive, scheduled or bulk.
+    """
+    if deterministic_seed is not None:
+        weather = fetch_weather_batch([lat], [lon])
+        return {key: float(weather[key][0]) for key in WEATHER_KEYS}
+    
+    return collect_weather(lat, lon, submit_weather(lat, lon, priority))
+
+def generate_mock_weather_data():
+    """Generate mock weather data for testing"""
+    return {
+        'temperature': np.random.normal(25, 5),
+        'humidity': np.random.uniform(40, 90),
+        'pressure': np.random.normal(1013, 10),
+        'wind_speed': np.random.exponential(10),
+        'wind_direction': np.random.uniform(0, 360),
+        'rainfall_1h': np.random.exponential(2)
+    }
+
+def prepare_features(lat, lon, weather_data=None):
+    """Prepare feature vector for prediction"""
+    if weather_data is None:
+        weather_data = fetch_weather_data(lat, lon)
+    if deterministic_seed is not None:
+        weather = {key: [weather_data[key]] for key in WEATHER_KEYS}
+        return prepare_features_batch([lat], [lon], weather_data=weather).iloc[0].to_dict()
+    
+    # Generate or fetch additional features
+    features = {
+        # Weather features
+        'temperature': weather_data['temperature'],
+        'humidity': weather_data['humidity'],
+        'pressure': weather_data['pressure'],
+        'wind_speed': weather_data['wind_speed'],
+        'wind_direction': weather_data['wind_direction'],
+        'rainfall_1h': weather_data['rainfall_1h'],
+        'rainfall_24h': weather_data['rainfall_1h'] * np.random.uniform(15, 25),
+        'rainfall_7d': weather_data['rainfall_1h'] * np.random.uniform(50, 150),
+        'rainfall_30d': weather_data['rainfall_1h'] * np.random.uniform(200, 500),
+        'temperature_change_24h': np.random.normal(0, 3),
+        'pressure_change_24h': np.random.normal(0, 5),
+        
+        # Geographical features (would be fetched from GIS database in production)
+        'elevation': abs(lat) * 10 + np.random.uniform(0, 500),
+        'slope': np.random.exponential(8),
+        'aspect': np.random.uniform(0, 360),
+        'distance_to_water': np.random.exponential(30),
+        'distance_to_coast': abs(lat - 0) * 111 + np.random.uniform(0, 100),
+        'soil_type': np.random.randint(1, 10),
+        'soil_moisture': weather_data['humidity'] * 0.7 + np.random.uniform(-10, 10),
+        'vegetation_index': np.random.uniform(0.2, 0.8),
+        
+        # Seismic features
+        'seismic_activity_7d': np.random.exponential(1.5),
+        'seismic_activity_30d': np.random.exponential(6),
+        'fault_distance': np.random.exponential(80),
+        'tectonic_stress': np.random.uniform(20, 80),
+        'historical_earthquake_count': np.random.poisson(3),
+        
+        # Hydrological features
+        'river_level': np.random.uniform(2, 10),
+        'river_flow_rate': np.random.exponential(300),
+        'groundwater_level': np.random.uniform(10, 40),
+        'dam_capacity': np.random.uniform(60, 95),
+        'upstream_rainfall': weather_data['rainfall_1h'] * np.random.uniform(1, 3),
+        
+        # Atmospheric features
+        'sea_surface_temp': weather_data['temperature'] + np.random.uniform(-2, 2),
+        'atmospheric_pressure_gradient': np.random.normal(0, 3),
+        'wind_shear': np.random.uniform(5, 40),
+        'moisture_content': weather_data['humidity'] + np.random.uniform(-10, 10),
+        'coriolis_effect': abs(lat) / 90,
+        
+        # Temporal features
+        'month': datetime.now().month,
+        'season': (datetime.now().month % 12) // 3,
+        'day_of_year': datetime.now().timetuple().tm_yday,
+        'is_monsoon_season': 1 if 6 <= datetime.now().month <= 9 else 0,
+        
+        # Historical features (would be fetched from database in production)
+        'historical_disaster_count_1y': np.random.poisson(2),
+        'historical_disaster_count_5y': np.random.poisson(10),
+        'days_since_last_disaster': np.random.exponential(150),
+        'avg_disaster_severity': np.random.uniform(0.3, 0.7)
+    }
+    
+    # Measured values from local data sources replace the proxies above
+    now = datetime.now()
+    for source in FEATURE_SOURCES:
+        features.update(source.features(lat, lon, now))
+    
+    return features
+
+def generate_mock_weather_batch(n, rng=None):
+    """Generate mock weather data for many locations at once"""
+    if rng is None:
+        rng = np.random.default_rng()
+    return {
+        'temperature': rng.normal(25, 5, n),
+        'humidity': rng.uniform(40, 90, n),
+        'pressure': rng.normal(1013, 10, n),
+        'wind_speed': rng.exponential(10, n),
+        'wind_direction': rng.uniform(0, 360, n),
+        'rainfall_1h': rng.exponential(2, n)
+    }
+
+def prepare_features_batch(lats, lons, weather_data=None, rng=None, now=None):
+    """Vectorized prepare_features for many locations
+
+    weather_data maps each WEATHER_KEYS entry to an array aligned with lats/lons;
+    mock weather is generated when it is omitted, so this never calls the
+    weather API. Returns a DataFrame with one row per location.
+    """
+    lat = np.asarray(lats, dtype=np.float64)
+    lon = np.asarray(lons, dtype=np.float64)
+    n = len(lat)
+    if rng is None and deterministic_seed is not None:
+        rng = LocationRandom(deterministic_seed, lat, lon)
+    if rng is None:
+        rng = np.random.default_rng()
+    if weather_data is None:
+        weather_data = generate_mock_weather_batch(n, rng)
+    if now is None:
+        now = datetime.now()
+
+    weather = {key: np.asarray(weather_data[key], dtype=np.float64) for key in WEATHER_KEYS}
+
+    features = {
+        # Weather features
+        'temperature': weather['temperature'],
+        'humidity': weather['humidity'],
+        'pressure': weather['pressure'],
+        'wind_speed': weather['wind_speed'],
+        'wind_direction': weather['wind_direction'],
+        'rainfall_1h': weather['rainfall_1h'],
+        'rainfall_24h': weather['rainfall_1h'] * rng.uniform(15, 25, n),
+        'rainfall_7d': weather['rainfall_1h'] * rng.uniform(50, 150, n),
+        'rainfall_30d': weather['rainfall_1h'] * rng.uniform(200, 500, n),
+        'temperature_change_24h': rng.normal(0, 3, n),
+        'pressure_change_24h': rng.normal(0, 5, n),
+
+        # Geographical features
+        'elevation': np.abs(lat) * 10 + rng.uniform(0, 500, n),
+        'slope': rng.exponential(8, n),
+        'aspect': rng.uniform(0, 360, n),
+        'distance_to_water': rng.exponential(30, n),
+        'distance_to_coast': np.abs(lat - 0) * 111 + rng.uniform(0, 100, n),
+        'soil_type': rng.integers(1, 10, n),
+        'soil_moisture': weather['humidity'] * 0.7 + rng.uniform(-10, 10, n),
+        'vegetation_index': rng.uniform(0.2, 0.8, n),
+
+        # Seismic features
+        'seismic_activity_7d': rng.exponential(1.5, n),
+        'seismic_activity_30d': rng.exponential(6, n),
+        'fault_distance': rng.exponential(80, n),
+        'tectonic_stress': rng.uniform(20, 80, n),
+        'historical_earthquake_count': rng.poisson(3, n),
+
+        # Hydrological features
+        'river_level': rng.uniform(2, 10, n),
+        'river_flow_rate': rng.exponential(300, n),
+        'groundwater_level': rng.uniform(10, 40, n),
+        'dam_capacity': rng.uniform(60, 95, n),
+        'upstream_rainfall': weather['rainfall_1h'] * rng.uniform(1, 3, n),
+
+        # Atmospheric features
+        'sea_surface_temp': weather['temperature'] + rng.uniform(-2, 2, n),
+        'atmospheric_pressure_gradient': rng.normal(0, 3, n),
+        'wind_shear': rng.uniform(5, 40, n),
+        'moisture_content': weather['humidity'] + rng.uniform(-10, 10, n),
+        'coriolis_effect': np.abs(lat) / 90,
+
+        # Temporal features
+        'month': np.full(n, now.month),
+        'season': np.full(n, (now.month % 12) // 3),
+        'day_of_year': np.full(n, now.timetuple().tm_yday),
+        'is_monsoon_season': np.full(n, 1 if 6 <= now.month <= 9 else 0),
+
+        # Historical features
+        'historical_disaster_count_1y': rng.poisson(2, n),
+        'historical_disaster_count_5y': rng.poisson(10, n),
+        'days_since_last_disaster': rng.exponential(150, n),
+        'avg_disaster_severity': rng.uniform(0.3, 0.7, n)
+    }
+
+    # Measured values from local data sources replace the proxies above
+    for source in FEATURE_SOURCES:
+        for name, values in source.features_batch(lat, lon, now).items():
+            measured = ~np.isnan(values)
+            features[name] = np.where(measured, values, features[name])
+
+    return pd.DataFrame(features)
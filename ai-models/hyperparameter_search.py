@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Parallel hyperparameter search with successive halving / Hyperband
+
+Candidates for each disaster type and model family are evaluated across a
+process pool on growing subsets of the training split and ranked on a
+validation split carved out of it; the 20% test split that train_models.py
+reports accuracy and derives ensemble weights on is never seen. The split is written
+once to memory-mapped .npy files (see shared_data.py) so workers never receive
+a pickled copy of the matrix. Chosen configurations are written to
+models/hyperparameters.json, which train_models.py and the prediction server
+load on top of DEFAULT_HYPERPARAMETERS.
+
+    python hyperparameter_search.py --disaster-types flood cyclone --workers 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+from shared_data import SharedDataset, open_shared
+
+DISASTER_TYPES = ['flood', 'cyclone', 'earthquake', 'landslide', 'wildfire']
+FAMILIES = ['rf', 'xgb', 'lgb', 'nn']
+
+SEARCH_SPACES = {
+    'rf': {
+        'n_estimators': [50, 100, 200, 400],
+        'max_depth': [8, 12, 16, 20, None],
+        'min_samples_split': [2, 5, 10],
+        'min_samples_leaf': [1, 2, 4],
+        'max_features': ['sqrt', 0.5]
+    },
+    'xgb': {
+        'n_estimators': [50, 100, 200, 400],
+        'max_depth': [3, 4, 6, 8, 10],
+        'learning_rate': [0.03, 0.05, 0.1, 0.2, 0.3],
+        'subsample': [0.7, 0.8, 1.0],
+        'colsample_bytree': [0.6, 0.8, 1.0]
+    },
+    'lgb': {
+        'n_estimators': [50, 100, 200, 400],
+        'max_depth': [-1, 6, 10],
+        'num_leaves': [15, 31, 63],
+        'learning_rate': [0.03, 0.05, 0.1, 0.2],
+        'min_child_samples': [10, 20, 40]
+    },
+    'nn': {
+        'epochs': [20, 50],
+        'batch_size': [128, 256, 512],
+        'learning_rate': [0.0003, 0.001, 0.003]
+    }
+}
+
+
+def sample_configs(family, n, rng):
+    """Draw up to n distinct configurations from a family's search space"""
+    space = SEARCH_SPACES[family]
+    configs = []
+    seen = set()
+    for _ in range(n * 20):
+        if len(configs) >= n:
+            break
+        config = {key: values[rng.integers(len(values))] for key, values in space.items()}
+        config = {key: (value.item() if isinstance(value, np.generic) else value)
+                  for key, value in config.items()}
+        key = json.dumps(config, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            configs.append(config)
+    return configs
+
+
+def _init_worker(threads):
+    from advanced_disaster_predictor import configure_worker_threads
+
+    configure_worker_threads(threads)
+
+
+def evaluate_candidate(handle, family, params, n_rows):
+    """Fit one candidate on the first n_rows of the shared training split
+
+    Runs in a worker process. Returns validation accuracy together with fit
+    time, per-row inference latency and serialized model size so that cheaper
+    models with equal accuracy can be surfaced.
+    """
+    from advanced_disaster_predictor import AdvancedDisasterPredictor, build_model
+
+    data = open_shared(handle)
+    X_train = data['X_train'][:n_rows]
+    y_train = data['y_train'][:n_rows]
+    X_val = data['X_val']
+    y_val = data['y_val']
+
+    start = time.perf_counter()
+    if family == 'nn':
+        from tensorflow import keras
+
+        keras.utils.set_random_seed(42)
+        predictor = AdvancedDisasterPredictor()
+        model, _ = predictor.fit_neural_network(np.asarray(X_train), np.asarray(y_train), params)
+        predict = lambda X: predictor.nn_probabilities(model, X)
+        size_bytes = model.count_params() * 4
+    else:
+        # One thread per fit; parallelism comes from the process pool
+        model = build_model(family, params, n_jobs=1)
+        model.fit(X_train, y_train)
+        predict = lambda X: model.predict_proba(X)[:, 1]
+        size_bytes = len(pickle.dumps(model))
+    fit_seconds = time.perf_counter() - start
+
+    accuracy = float(np.mean((predict(X_val) > 0.5) == y_val))
+
+    sample = np.asarray(X_val[:256])
+    best = float('inf')
+    for _ in range(3):
+        start = time.perf_counter()
+        predict(sample)
+        best = min(best, time.perf_counter() - start)
+
+    return {
+        'family': family,
+        'params': params,
+        'n_rows': int(n_rows),
+        'accuracy': accuracy,
+        'fit_seconds': fit_seconds,
+        'predict_us_per_row': best / len(sample) * 1e6,
+        'size_bytes': int(size_bytes)
+    }
+
+
+def search_family(pool, handle, family, max_rows, min_rows, eta, rng,
+                  strategy='hyperband', n_candidates=27):
+    """Run successive halving (one bracket) or Hyperband (all brackets) for a family"""
+    s_max = max(0, int(np.floor(np.log(max_rows / min_rows) / np.log(eta))))
+    brackets = range(s_max, -1, -1) if strategy == 'hyperband' else [s_max]
+
+    from advanced_disaster_predictor import DEFAULT_HYPERPARAMETERS
+
+    results = [pool.submit(evaluate_candidate, handle, family,
+                           dict(DEFAULT_HYPERPARAMETERS[family]), max_rows).result()]
+    results[0]['baseline'] = True
+
+    for s in brackets:
+        if strategy == 'hyperband':
+            n_configs = int(np.ceil((s_max + 1) / (s + 1) * eta ** s))
+        else:
+            n_configs = n_candidates
+        configs = sample_configs(family, n_configs, rng)
+
+        for rung in range(s + 1):
+            n_rows = max_rows if rung == s else max(min_rows, int(max_rows * eta ** (rung - s)))
+            futures = [pool.submit(evaluate_candidate, handle, family, config, n_rows)
+                       for config in configs]
+            rung_results = [future.result() for future in futures]
+            results.extend(rung_results)
+            print(f"   {family}: bracket {s}, rung {rung}: {len(configs)} candidates on "
+                  f"{n_rows:,} rows, best accuracy {max(r['accuracy'] for r in rung_results):.4f}")
+
+            if rung < s:
+                rung_results.sort(key=lambda r: r['accuracy'], reverse=True)
+                keep = max(1, len(configs) // eta)
+                configs = [r['params'] for r in rung_results[:keep]]
+
+    return results
+
+
+def select_configs(results, max_rows, tolerance):
+    """Best full-budget candidate and the cheapest one within tolerance of it"""
+    final = [r for r in results if r['n_rows'] == max_rows]
+    best = max(final, key=lambda r: r['accuracy'])
+    equivalent = [r for r in final if r['accuracy'] >= best['accuracy'] - tolerance]
+    cheapest = min(equivalent, key=lambda r: (r['predict_us_per_row'], r['size_bytes']))
+    return best, cheapest, equivalent
+
+
+def run(disaster_types, families, output_path, workers=None, strategy='hyperband', eta=3,
+        min_rows=1000, n_samples=20000, n_candidates=27, tolerance=0.002,
+        prefer_cheap=False, seed=42):
+    from advanced_disaster_predictor import AdvancedDisasterPredictor
+
+    predictor = AdvancedDisasterPredictor()
+    rng = np.random.default_rng(seed)
+    workers = workers or os.cpu_count() or 1
+
+    chosen = {}
+    if os.path.exists(output_path):
+        with open(output_path) as f:
+            chosen = json.load(f)
+    report = {}
+
+    # Tree fits are single-threaded; the NN gets the worker's share of the cores
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(threads,)) as pool:
+        for disaster_type in disaster_types:
+            print(f"\n{'='*60}")
+            print(f"Tuning models for {disaster_type.upper()}")
+            print(f"{'='*60}")
+
+            # Validation comes out of the training portion; the test split is
+            # left for train_models.py's final evaluation
+            X_fit, _, y_fit, _, _ = predictor.prepare_training_split(disaster_type, n_samples=n_samples)
+            X_train, X_val, y_train, y_val = train_test_split(
+                X_fit, y_fit, test_size=0.2, random_state=seed, stratify=y_fit)
+            max_rows = len(X_train)
+
+            with SharedDataset({'X_train': X_train, 'y_train': y_train,
+                                'X_val': X_val, 'y_val': y_val}) as dataset:
+                print(f"   Shared dataset: {dataset.nbytes() / 1e6:.1f} MB memory-mapped from {dataset.directory}")
+
+                report[disaster_type] = {}
+                for family in families:
+                    start = time.perf_counter()
+                    results = search_family(pool, dataset.handle, family, max_rows, min_rows, eta,
+                                            rng, strategy=strategy, n_candidates=n_candidates)
+                    best, cheapest, equivalent = select_configs(results, max_rows, tolerance)
+                    selected = cheapest if prefer_cheap else best
+
+                    chosen.setdefault(disaster_type, {})[family] = selected['params']
+                    report[disaster_type][family] = {
+                        'best': best,
+                        'cheapest_equivalent': cheapest,
+                        'equivalent_candidates': len(equivalent),
+                        'evaluations': len(results),
+                        'search_seconds': time.perf_counter() - start,
+                        'selected': 'cheapest_equivalent' if prefer_cheap else 'best'
+                    }
+
+                    print(f"   {family}: best {best['accuracy']:.4f} "
+                          f"({best['predict_us_per_row']:.1f} us/row) {best['params']}")
+                    if cheapest is not best:
+                        print(f"   {family}: cheapest within {tolerance:.3f}: {cheapest['accuracy']:.4f} "
+                              f"({cheapest['predict_us_per_row']:.1f} us/row, "
+                              f"{cheapest['size_bytes'] / 1e6:.1f} MB) {cheapest['params']}")
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(chosen, f, indent=2)
+    report_path = os.path.join(os.path.dirname(output_path) or '.', 'tuning_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n✅ Tuned hyperparameters saved to {output_path}")
+    print(f"✅ Full tuning report saved to {report_path}")
+    return chosen, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel hyperparameter search for the disaster models')
+    parser.add_argument('--disaster-types', nargs='+', default=DISASTER_TYPES)
+    parser.add_argument('--families', nargs='+', default=FAMILIES, choices=FAMILIES)
+    parser.add_argument('--strategy', choices=['hyperband', 'successive_halving'], default='hyperband')
+    parser.add_argument('--eta', type=int, default=3, help='Halving rate between rungs')
+    parser.add_argument('--min-rows', type=int, default=1000, help='Training rows at the smallest rung')
+    parser.add_argument('--n-samples', type=int, default=20000, help='Synthetic samples per disaster type')
+    parser.add_argument('--n-candidates', type=int, default=27,
+                        help='Initial candidates for successive halving')
+    parser.add_argument('--tolerance', type=float, default=0.002,
+                        help='Accuracy gap within which candidates count as equal')
+    parser.add_argument('--prefer-cheap', action='store_true',
+                        help='Write the cheapest equal-accuracy config instead of the most accurate')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default=os.path.join('models', 'hyperparameters.json'))
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    run(args.disaster_types, args.families, args.output, workers=args.workers,
+        strategy=args.strategy, eta=args.eta, min_rows=args.min_rows,
+        n_samples=args.n_samples, n_candidates=args.n_candidates,
+        tolerance=args.tolerance, prefer_cheap=args.prefer_cheap, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
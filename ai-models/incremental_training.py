@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Incremental model updates from newly labeled observations
+
+Instead of regenerating data and refitting every model, an update:
+  • appends the observations to models/<type>/observations/
+  • warm-starts XGBoost and LightGBM with additional boosting rounds
+  • fine-tunes the neural network for a few epochs at a reduced learning rate
+  • extends the random forest with new trees, dropping the oldest past a cap
+  • re-derives ensemble weights on the stored held-out split
+
+A full retrain (including all stored observations) is triggered instead when
+the new data shows accuracy or feature drift, or when the incremental update
+would degrade held-out accuracy. Both train on copies while the server keeps
+predicting with the current models, which are swapped out only when the new
+ones are accepted.
+
+    python incremental_training.py --benchmark --disaster-type flood
+"""
+
+import argparse
+import copy
+import glob
+import os
+import threading
+import time
+
+import numpy as np
+from tensorflow import keras
+
+from advanced_disaster_predictor import AdvancedDisasterPredictor, build_model
+
+# A batch of observations legitimately shares its month/season, so temporal
+# features are left out of the feature-drift check
+DRIFT_EXEMPT_FEATURES = {'month', 'season', 'day_of_year', 'is_monsoon_season'}
+
+class IncrementalUpdater:
+    """Apply labeled observations to a trained AdvancedDisasterPredictor"""
+
+    def __init__(self, predictor, model_dir='models', drift_threshold=0.03,
+                 feature_drift_threshold=1.0, min_drift_samples=200, extra_trees=50,
+                 rf_extra_trees=50, max_forest_size=400, nn_epochs=3, nn_lr_factor=0.1,
+                 replay_size=5000):
+        self.predictor = predictor
+        self.model_dir = model_dir
+        self.drift_threshold = drift_threshold
+        self.feature_drift_threshold = feature_drift_threshold
+        self.min_drift_samples = min_drift_samples
+        self.extra_trees = extra_trees
+        self.rf_extra_trees = rf_extra_trees
+        self.max_forest_size = max_forest_size
+        self.nn_epochs = nn_epochs
+        self.nn_lr_factor = nn_lr_factor
+        self.replay_size = replay_size
+        # One update at a time per predictor; predictions never wait on it
+        self._lock = threading.Lock()
+
+    def _observation_dir(self, disaster_type):
+        return os.path.join(self.model_dir, disaster_type, 'observations')
+
+    def append_observations(self, disaster_type, X, y):
+        """Persist raw (unscaled) labeled observations as an append-only chunk"""
+        directory = self._observation_dir(disaster_type)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{time.time_ns()}.npz')
+        np.savez_compressed(path, X=self.predictor.to_feature_matrix(X), y=np.asarray(y, dtype=np.int8))
+        return path
+
+    def load_observations(self, disaster_type):
+        """All stored observations for a disaster type, oldest first"""
+        paths = sorted(glob.glob(os.path.join(self._observation_dir(disaster_type), '*.npz')))
+        if not paths:
+            return np.empty((0, len(self.predictor.feature_columns))), np.empty(0, dtype=np.int8)
+        X_parts, y_parts = [], []
+        for path in paths:
+            with np.load(path) as chunk:
+                X_parts.append(chunk['X'])
+                y_parts.append(chunk['y'])
+        return np.vstack(X_parts), np.concatenate(y_parts)
+
+    def get_validation_set(self, disaster_type):
+        """Scaled held-out split, regenerated for model dirs saved without one"""
+        if disaster_type not in self.predictor.validation_sets:
+            # The split and scaler are deterministic, so this reproduces the
+            # held-out rows of a default training run
+            _, X_val, _, y_val, _ = self.predictor.prepare_training_split(disaster_type)
+            self.predictor.validation_sets[disaster_type] = (X_val, y_val)
+        return self.predictor.validation_sets[disaster_type]
+
+    def evaluate(self, disaster_type, X_scaled, y):
+        """Per-model accuracies and the weighted ensemble accuracy on scaled rows"""
+        ensemble_prob, probs = self.predictor._model_probabilities(X_scaled, disaster_type)
+        accuracies = {key: float(np.mean((prob > 0.5) == y)) for key, prob in probs.items()}
+        accuracies['ensemble'] = float(np.mean((ensemble_prob > 0.5) == y))
+        return accuracies, probs, ensemble_prob
+
+    def detect_drift(self, disaster_type, X_scaled, y):
+        """Return a reason string when the new data calls for a full retrain"""
+        if len(y) < self.min_drift_samples:
+            return None
+
+        # Scaled features have mean 0 / std 1 on the original training split
+        shift = np.abs(np.mean(X_scaled, axis=0))
+        for index, col in enumerate(self.predictor.feature_columns):
+            if col in DRIFT_EXEMPT_FEATURES:
+                shift[index] = 0.0
+        worst = int(np.argmax(shift))
+        if shift[worst] > self.feature_drift_threshold:
+            return (f"feature drift in {self.predictor.feature_columns[worst]} "
+                    f"({shift[worst]:.2f} std from training mean)")
+
+        baseline = self.predictor.model_accuracies.get(disaster_type, {}).get('ensemble')
+        if baseline is not None:
+            accuracies, _, _ = self.evaluate(disaster_type, X_scaled, y)
+            if accuracies['ensemble'] < baseline - self.drift_threshold:
+                return (f"accuracy drift on new data ({accuracies['ensemble']:.4f} "
+                        f"vs {baseline:.4f} at training)")
+        return None
+
+    def _replay_sample(self, disaster_type, exclude_latest):
+        """Earlier stored observations mixed into the update to limit forgetting"""
+        X_old, y_old = self.load_observations(disaster_type)
+        if exclude_latest:
+            X_old, y_old = X_old[:-exclude_latest], y_old[:-exclude_latest]
+        if len(y_old) > self.replay_size:
+            keep = np.random.default_rng(0).choice(len(y_old), self.replay_size, replace=False)
+            X_old, y_old = X_old[keep], y_old[keep]
+        return X_old, y_old
+
+    def _incremental_fit(self, disaster_type, X_fit, y_fit):
+        """Warm-start copies of every model on scaled rows; the live models are untouched"""
+        models = self.predictor.models[disaster_type]
+
+        # Boosting models continue from their current trees
+        xgb_params = self.predictor.get_hyperparameters(disaster_type, 'xgb')
+        xgb_params['n_estimators'] = self.extra_trees
+        xgb_model = build_model('xgb', xgb_params)
+        xgb_model.fit(X_fit, y_fit, xgb_model=models['xgb'].get_booster())
+
+        lgb_params = self.predictor.get_hyperparameters(disaster_type, 'lgb')
+        lgb_params['n_estimators'] = self.extra_trees
+        lgb_model = build_model('lgb', lgb_params)
+        lgb_model.fit(X_fit, y_fit, init_model=models['lgb'].booster_)
+
+        # Random forest grows new trees on the new data; the oldest are
+        # dropped once the forest exceeds its cap
+        rf_model = copy.deepcopy(models['rf'])
+        rf_model.set_params(warm_start=True, n_estimators=len(rf_model.estimators_) + self.rf_extra_trees)
+        rf_model.fit(X_fit, y_fit)
+        if len(rf_model.estimators_) > self.max_forest_size:
+            rf_model.estimators_ = rf_model.estimators_[-self.max_forest_size:]
+            rf_model.n_estimators = self.max_forest_size
+        rf_model.set_params(warm_start=False)
+
+        # Neural network is fine-tuned for a few epochs at a reduced rate, on a
+        # clone so the live model keeps its weights and optimizer state
+        nn_model = keras.models.clone_model(models['nn'])
+        nn_model.set_weights(models['nn'].get_weights())
+        nn_params = self.predictor.get_hyperparameters(disaster_type, 'nn')
+        nn_model.compile(
+            optimizer=keras.optimizers.Adam(learning_rate=nn_params['learning_rate'] * self.nn_lr_factor),
+            loss='binary_crossentropy',
+            metrics=['accuracy']
+        )
+        nn_model.fit(X_fit.astype(np.float32), y_fit, epochs=self.nn_epochs,
+                     batch_size=nn_params['batch_size'], verbose=0)
+
+        return {'rf': rf_model, 'xgb': xgb_model, 'lgb': lgb_model, 'nn': nn_model}
+
+    def _candidate_probabilities(self, candidate, X_scaled):
+        """Per-model probabilities of not-yet-installed models on scaled rows"""
+        probs = {key: candidate[key].predict_proba(X_scaled)[:, 1] for key in ('rf', 'xgb', 'lgb')}
+        probs['nn'] = self.predictor.nn_probabilities(candidate['nn'], X_scaled)
+        return probs
+
+    def full_retrain(self, disaster_type, X_new=None, y_new=None):
+        """Retrain from scratch on synthetic data plus every stored observation
+
+        X_new/y_new are added for observations that were not stored. Training
+        runs on a scratch predictor; its models, scaler, held-out split and
+        cascade replace the live ones once it is done.
+        """
+        X_obs, y_obs = self.load_observations(disaster_type)
+        if X_new is not None:
+            X_obs = np.vstack([X_obs, self.predictor.to_feature_matrix(X_new)])
+            y_obs = np.concatenate([y_obs, np.asarray(y_new, dtype=np.int8)])
+        scratch = AdvancedDisasterPredictor()
+        scratch.hyperparameters = self.predictor.hyperparameters
+        scratch.train_models(disaster_type, extra_X=X_obs, extra_y=y_obs)
+
+        predictor = self.predictor
+        predictor.models[disaster_type] = scratch.models[disaster_type]
+        predictor.scalers[disaster_type] = scratch.scalers[disaster_type]
+        predictor.validation_sets[disaster_type] = scratch.validation_sets[disaster_type]
+        predictor.cascade[disaster_type] = scratch.cascade[disaster_type]
+        predictor.model_accuracies[disaster_type] = scratch.model_accuracies[disaster_type]
+
+    def update(self, disaster_type, X, y, force_full=False, save=True, store_observations=True):
+        """Append observations and update the models, incrementally when possible
+
+        With store_observations=False (benchmarks) nothing is written to the
+        observation store; the rows only take part in this update.
+        """
+        with self._lock:
+            return self._update(disaster_type, X, y, force_full, save, store_observations)
+
+    def _update(self, disaster_type, X, y, force_full, save, store_observations):
+        predictor = self.predictor
+        y = np.asarray(y, dtype=int)
+        if store_observations:
+            self.append_observations(disaster_type, X, y)
+
+        start = time.perf_counter()
+        X_scaled = predictor.scale_features(predictor.to_feature_matrix(X), disaster_type)
+        accuracy_before = predictor.model_accuracies.get(disaster_type, {}).get('ensemble')
+
+        reason = 'forced' if force_full else self.detect_drift(disaster_type, X_scaled, y)
+        mode = 'full' if reason else 'incremental'
+
+        if mode == 'incremental':
+            X_replay, y_replay = self._replay_sample(disaster_type,
+                                                     exclude_latest=len(y) if store_observations else 0)
+            X_fit = np.vstack([predictor.scale_features(X_replay, disaster_type), X_scaled]) if len(y_replay) else X_scaled
+            y_fit = np.concatenate([y_replay, y]) if len(y_replay) else y
+
+            if len(np.unique(y_fit)) < 2:
+                return {
+                    'mode': 'deferred',
+                    'reason': 'observations contain a single class; stored for the next update',
+                    'n_new': int(len(y)),
+                    'seconds': time.perf_counter() - start
+                }
+
+            candidate = self._incremental_fit(disaster_type, X_fit, y_fit)
+
+            # Re-derive ensemble weights on the held-out split, as train_models does
+            X_val, y_val = self.get_validation_set(disaster_type)
+            probs = self._candidate_probabilities(candidate, X_val)
+            accuracies = {key: float(np.mean((prob > 0.5) == y_val)) for key, prob in probs.items()}
+            weights = np.array([accuracies['rf'], accuracies['xgb'], accuracies['lgb'], accuracies['nn']])
+            weights = weights / weights.sum()
+            ensemble_prob = (weights[0] * probs['rf'] + weights[1] * probs['xgb'] +
+                             weights[2] * probs['lgb'] + weights[3] * probs['nn'])
+            accuracies['ensemble'] = float(np.mean((ensemble_prob > 0.5) == y_val))
+
+            if accuracy_before is not None and accuracies['ensemble'] < accuracy_before - self.drift_threshold:
+                reason = (f"incremental update degraded held-out accuracy "
+                          f"({accuracies['ensemble']:.4f} vs {accuracy_before:.4f})")
+                mode = 'full'
+            else:
+                # One assignment, so a prediction sees either the old or the new set
+                predictor.models[disaster_type] = dict(candidate, ensemble={
+                    'weights': weights,
+                    'accuracy': accuracies['ensemble']
+                })
+                predictor.model_accuracies[disaster_type] = accuracies
+                cheap_model = predictor.cascade.get(disaster_type, {}).get('model', 'lgb')
+                predictor.calibrate_cascade(disaster_type, probs[cheap_model], ensemble_prob, cheap_model)
+
+        if mode == 'full':
+            print(f"⚠️  Full retrain of {disaster_type}: {reason}")
+            if store_observations:
+                self.full_retrain(disaster_type)
+            else:
+                self.full_retrain(disaster_type, X, y)
+
+        elapsed = time.perf_counter() - start
+        if save:
+            predictor.save_models(self.model_dir)
+
+        return {
+            'mode': mode,
+            'reason': reason,
+            'n_new': int(len(y)),
+            'seconds': elapsed,
+            'accuracy_before': accuracy_before,
+            'accuracy_after': predictor.model_accuracies[disaster_type]['ensemble']
+        }
+
+
+def benchmark(disaster_type, n_new, model_dir):
+    """Compare incremental update time with a full retrain"""
+    predictor = AdvancedDisasterPredictor()
+    predictor.load_models(model_dir)
+    updater = IncrementalUpdater(predictor, model_dir=model_dir)
+
+    X_new, y_new = predictor.generate_synthetic_training_data(disaster_type, n_samples=n_new, seed=7)
+
+    incremental = updater.update(disaster_type, X_new, y_new, save=False, store_observations=False)
+
+    start = time.perf_counter()
+    predictor.train_models(disaster_type, extra_X=X_new, extra_y=y_new)
+    full_seconds = time.perf_counter() - start
+
+    print("\n" + "="*60)
+    print(f"INCREMENTAL vs FULL RETRAIN ({disaster_type}, {n_new:,} new rows)")
+    print("="*60)
+    print(f"Incremental ({incremental['mode']}): {incremental['seconds']:.1f}s, "
+          f"accuracy {incremental['accuracy_before']:.4f} -> {incremental['accuracy_after']:.4f}")
+    print(f"Full retrain:  {full_seconds:.1f}s, "
+          f"accuracy {predictor.model_accuracies[disaster_type]['ensemble']:.4f}")
+    print(f"Speedup:       {full_seconds / incremental['seconds']:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Incrementally update trained disaster models')
+    parser.add_argument('--disaster-type', default='flood')
+    parser.add_argument('--observations', help='CSV/Parquet of feature rows with a "label" column')
+    parser.add_argument('--models', default='models')
+    parser.add_argument('--force-full', action='store_true', help='Always do a full retrain')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Time an incremental update against a full retrain (nothing is saved)')
+    parser.add_argument('--n-new', type=int, default=2000, help='New rows for --benchmark')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.disaster_type, args.n_new, args.models)
+        return
+
+    if not args.observations:
+        parser.error('--observations is required unless --benchmark is given')
+
+    import pandas as pd
+    if args.observations.endswith('.parquet'):
+        data = pd.read_parquet(args.observations)
+    else:
+        data = pd.read_csv(args.observations)
+
+    predictor = AdvancedDisasterPredictor()
+    predictor.load_models(args.models)
+    updater = IncrementalUpdater(predictor, model_dir=args.models)
+    report = updater.update(args.disaster_type, data, data['label'].to_numpy(), force_full=args.force_full)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
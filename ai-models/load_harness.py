@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Record and replay prediction traffic for load testing
+
+The server records /predict and /predict/batch requests when REQUEST_RECORD_PATH
+is set. Each record keeps the arrival time, endpoint, response format, options,
+hazards, the coordinates and the latency and status the server produced. Replay
+sends the same stream to any server at a chosen speed-up and reports
+throughput, latency percentiles and error rates:
+
+    python load_harness.py replay data/requests.rec --url http://localhost:8000 --speedup 4
+    python load_harness.py synthesize data/synthetic.rec --requests 5000 --rate 50
+    python load_harness.py summary data/requests.rec
+
+Start the target server with DETERMINISTIC_WEATHER_SEED set so the weather and
+synthetic features depend only on the seed and the location, never on the
+weather API or on request order. Two runs against the same models then do
+identical work.
+
+File layout: a header (magic, version), then per request a fixed 22-byte
+record followed by its coordinates as float32 (lat, lon) pairs. Location
+weather fields and streamed NDJSON uploads are not recorded; replayed batches
+are sent as JSON bodies.
+"""
+
+import argparse
+import atexit
+import json
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+MAGIC = b'GEREC\x00'
+VERSION = 1
+HEADER = struct.Struct('<6sH')
+# timestamp, server latency (ms), status, endpoint, format, flags, hazard mask, locations
+RECORD = struct.Struct('<dfHBBBBI')
+
+ENDPOINTS = ['/predict', '/predict/batch']
+FORMATS = ['application/json', 'application/x-msgpack', 'application/vnd.apache.arrow.stream',
+           'application/x-ndjson']
+DISASTER_TYPES = ['flood', 'cyclone', 'earthquake', 'landslide', 'wildfire']
+PRIORITIES = ['interactive', 'scheduled', 'bulk']
+ALL_HAZARDS = (1 << len(DISASTER_TYPES)) - 1
+
+FLAG_CASCADE = 1
+FLAG_COMPACT = 2
+FLAG_EXPLAIN = 4
+# Bits 3-4 hold 1 + the index of an explicit upstream priority, 0 for the default
+PRIORITY_SHIFT = 3
+PRIORITY_MASK = 3 << PRIORITY_SHIFT
+
+
+def _truthy(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def _hazard_mask(disaster_types):
+    if not disaster_types:
+        return ALL_HAZARDS
+    if isinstance(disaster_types, str):
+        disaster_types = disaster_types.split(',')
+    mask = 0
+    for name in disaster_types:
+        if name in DISASTER_TYPES:
+            mask |= 1 << DISASTER_TYPES.index(name)
+    return mask
+
+
+class RequestRecorder:
+    """Appends prediction requests to a recording file from Flask request hooks"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'ab')
+        if new_file:
+            self._file.write(HEADER.pack(MAGIC, VERSION))
+        self._lock = threading.Lock()
+        self.recorded = 0
+        atexit.register(self.close)
+
+    def install(self, app):
+        """Register before/after request hooks on a Flask app"""
+        from flask import g, request
+
+        @app.before_request
+        def _start_timer():
+            g.record_start = time.time()
+
+        @app.after_request
+        def _record(response):
+            try:
+                if request.path in ENDPOINTS and request.mimetype != FORMATS[3]:
+                    self.record_request(request, response, g.record_start)
+            except Exception as e:
+                print(f"Error recording request: {e}")
+            return response
+
+        return self
+
+    def record_request(self, request, response, started):
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = {}
+        endpoint = ENDPOINTS.index(request.path)
+        if endpoint == 0:
+            locations = [data] if 'latitude' in data and 'longitude' in data else []
+        else:
+            locations = [loc for loc in data.get('locations', [])
+                         if loc.get('latitude') is not None and loc.get('longitude') is not None]
+        coords = np.array([(loc['latitude'], loc['longitude']) for loc in locations],
+                          dtype=np.float32).reshape(-1, 2)
+
+        options = {**request.args.to_dict(), **data}
+        flags = 0
+        if _truthy(options.get('cascade', False)):
+            flags |= FLAG_CASCADE
+        if _truthy(options.get('compact', False)):
+            flags |= FLAG_COMPACT
+        if _truthy(options.get('explain', False)):
+            flags |= FLAG_EXPLAIN
+        if options.get('priority') in PRIORITIES:
+            flags |= (PRIORITIES.index(options['priority']) + 1) << PRIORITY_SHIFT
+        fmt = FORMATS.index(response.mimetype) if response.mimetype in FORMATS else 0
+
+        # For streamed responses this is the time to the first byte
+        latency_ms = (time.time() - started) * 1000
+        self.write(started, latency_ms, response.status_code, endpoint, fmt, flags,
+                   _hazard_mask(options.get('disaster_types')), coords)
+
+    def write(self, timestamp, latency_ms, status, endpoint, fmt, flags, hazards, coords):
+        record = RECORD.pack(timestamp, latency_ms, status, endpoint, fmt, flags, hazards, len(coords))
+        with self._lock:
+            self._file.write(record)
+            self._file.write(np.ascontiguousarray(coords, dtype='<f4').tobytes())
+            self.recorded += 1
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def read_recording(path):
+    """Yield recorded requests as dicts, in file order"""
+    with open(path, 'rb') as f:
+        magic, version = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} request recording")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            timestamp, latency_ms, status, endpoint, fmt, flags, hazards, n = RECORD.unpack(head)
+            priority = (flags & PRIORITY_MASK) >> PRIORITY_SHIFT
+            coords = np.frombuffer(f.read(8 * n), dtype='<f4').reshape(n, 2)
+            yield {
+                'timestamp': timestamp,
+                'latency_ms': latency_ms,
+                'status': status,
+                'endpoint': ENDPOINTS[endpoint],
+                'format': FORMATS[fmt],
+                'cascade': bool(flags & FLAG_CASCADE),
+                'compact': bool(flags & FLAG_COMPACT),
+                'explain': bool(flags & FLAG_EXPLAIN),
+                'priority': PRIORITIES[priority - 1] if priority else None,
+                'disaster_types': [name for i, name in enumerate(DISASTER_TYPES) if hazards & (1 << i)],
+                'coords': coords
+            }
+
+
+def synthesize(path, n_requests=5000, rate=50.0, batch_fraction=0.1, batch_size=200, seed=42):
+    """Write a synthetic recording with Poisson arrivals around populated regions"""
+    rng = np.random.default_rng(seed)
+    centres = np.array([[23.8, 90.4], [28.6, 77.2], [14.6, 121.0], [35.7, 139.7],
+                        [-6.2, 106.8], [29.8, -95.4], [25.8, -80.2], [19.4, -99.1]])
+    recorder = RequestRecorder(path)
+    timestamp = time.time()
+    for _ in range(n_requests):
+        timestamp += rng.exponential(1.0 / rate)
+        is_batch = rng.random() < batch_fraction
+        n = max(1, int(rng.exponential(batch_size))) if is_batch else 1
+        coords = centres[rng.integers(len(centres), size=n)] + rng.normal(0, 2, (n, 2))
+        recorder.write(timestamp, 0.0, 200, int(is_batch), 0, 0, ALL_HAZARDS, coords)
+    recorder.close()
+    return recorder.recorded
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    values = np.asarray(values)
+    return {
+        'p50_ms': float(np.percentile(values, 50)),
+        'p90_ms': float(np.percentile(values, 90)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'max_ms': float(values.max())
+    }
+
+
+def _request_body(record):
+    options = {'disaster_types': record['disaster_types']}
+    if record['cascade']:
+        options['cascade'] = True
+    if record['explain']:
+        options['explain'] = True
+    if record['priority']:
+        options['priority'] = record['priority']
+    if record['endpoint'] == '/predict':
+        lat, lon = record['coords'][0]
+        return {'latitude': float(lat), 'longitude': float(lon), **options}
+    if record['compact']:
+        options['compact'] = True
+    return {'locations': [{'latitude': float(lat), 'longitude': float(lon)} for lat, lon in record['coords']],
+            **options}
+
+
+def replay(path, base_url, speedup=1.0, concurrency=32, limit=None, timeout=60):
+    """Send a recording to a server on its original schedule divided by speedup
+
+    Latency is measured from the scheduled send time, so queueing behind a
+    saturated server counts against it instead of silently slowing the load.
+    """
+    import requests
+
+    sessions = threading.local()
+
+    def send(record, scheduled):
+        session = getattr(sessions, 'session', None)
+        if session is None:
+            session = sessions.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = session.post(base_url.rstrip('/') + record['endpoint'], json=_request_body(record),
+                                    headers={'Accept': record['format']}, timeout=timeout)
+            # Read the whole body so streamed responses are timed to completion
+            size = len(response.content)
+            status = response.status_code
+        except requests.RequestException:
+            size, status = 0, None
+        finished = time.perf_counter()
+        return {
+            'endpoint': record['endpoint'],
+            'locations': len(record['coords']),
+            'status': status,
+            'bytes': size,
+            'latency_ms': (finished - scheduled) * 1000,
+            'service_ms': (finished - started) * 1000,
+            'recorded_ms': record['latency_ms']
+        }
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        first = None
+        for i, record in enumerate(read_recording(path)):
+            if limit is not None and i >= limit:
+                break
+            if first is None:
+                first = record['timestamp']
+            scheduled = start + (record['timestamp'] - first) / speedup
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(send, record, scheduled))
+        results = [future.result() for future in futures]
+    wall_seconds = time.perf_counter() - start
+
+    report = {
+        'recording': path,
+        'target': base_url,
+        'speedup': speedup,
+        'concurrency': concurrency,
+        'wall_seconds': wall_seconds,
+        'endpoints': {}
+    }
+    for endpoint in ENDPOINTS + ['all']:
+        rows = [r for r in results if endpoint in ('all', r['endpoint'])]
+        if not rows:
+            continue
+        errors = sum(1 for r in rows if r['status'] is None or r['status'] >= 400)
+        report['endpoints'][endpoint] = {
+            'requests': len(rows),
+            'errors': errors,
+            'error_rate': errors / len(rows),
+            'requests_per_second': len(rows) / wall_seconds,
+            'locations_per_second': sum(r['locations'] for r in rows) / wall_seconds,
+            'latency': _percentiles([r['latency_ms'] for r in rows]),
+            'service_latency': _percentiles([r['service_ms'] for r in rows]),
+            'recorded_latency': _percentiles([r['recorded_ms'] for r in rows if r['recorded_ms'] > 0])
+        }
+    return report
+
+
+def summarize_recording(path):
+    records = list(read_recording(path))
+    if not records:
+        return {'requests': 0}
+    duration = records[-1]['timestamp'] - records[0]['timestamp']
+    sizes = [len(r['coords']) for r in records if r['endpoint'] == '/predict/batch']
+    return {
+        'requests': len(records),
+        'duration_seconds': duration,
+        'requests_per_second': len(records) / duration if duration > 0 else float('nan'),
+        'batch_requests': len(sizes),
+        'mean_batch_size': float(np.mean(sizes)) if sizes else 0.0,
+        'locations': sum(len(r['coords']) for r in records),
+        'errors': sum(1 for r in records if r['status'] >= 400),
+        'recorded_latency': _percentiles([r['latency_ms'] for r in records if r['latency_ms'] > 0])
+    }
+
+
+def print_report(report):
+    print(f"\n📈 Replay of {report['recording']} against {report['target']} "
+          f"at {report['speedup']}x ({report['wall_seconds']:.1f}s)")
+    for endpoint, stats in report['endpoints'].items():
+        latency = stats['latency']
+        print(f"   {endpoint:15s} {stats['requests']:7d} req  {stats['requests_per_second']:8.1f} req/s  "
+              f"{stats['locations_per_second']:9.1f} loc/s  errors {stats['error_rate']:.2%}  "
+              f"p50 {latency['p50_ms']:.1f}ms  p90 {latency['p90_ms']:.1f}ms  p99 {latency['p99_ms']:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record/replay load testing for the prediction server')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    replay_parser = commands.add_parser('replay', help='Replay a recording against a server')
+    replay_parser.add_argument('recording')
+    replay_parser.add_argument('--url', default='http://localhost:8000')
+    replay_parser.add_argument('--speedup', type=float, default=1.0)
+    replay_parser.add_argument('--concurrency', type=int, default=32)
+    replay_parser.add_argument('--limit', type=int, default=None, help='Replay only the first N requests')
+    replay_parser.add_argument('--output', help='Write the report as JSON')
+
+    synth_parser = commands.add_parser('synthesize', help='Write a synthetic recording')
+    synth_parser.add_argument('recording')
+    synth_parser.add_argument('--requests', type=int, default=5000)
+    synth_parser.add_argument('--rate', type=float, default=50.0, help='Mean requests per second')
+    synth_parser.add_argument('--batch-fraction', type=float, default=0.1)
+    synth_parser.add_argument('--batch-size', type=int, default=200, help='Mean locations per batch')
+    synth_parser.add_argument('--seed', type=int, default=42)
+
+    summary_parser = commands.add_parser('summary', help='Describe a recording')
+    summary_parser.add_argument('recording')
+    args = parser.parse_args()
+
+    if args.command == 'replay':
+        report = replay(args.recording, args.url, speedup=args.speedup,
+                        concurrency=args.concurrency, limit=args.limit)
+        print_report(report)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"✅ Report saved to {args.output}")
+    elif args.command == 'synthesize':
+        n = synthesize(args.recording, args.requests, args.rate, args.batch_fraction,
+                       args.batch_size, args.seed)
+        print(f"✅ Wrote {n:,} synthetic requests to {args.recording}")
+    else:
+        print(json.dumps(summarize_recording(args.recording), indent=2))
+
+
+if __name__ == "__main__":
+    main()
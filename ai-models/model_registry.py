@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Region-partitioned model registry with memory-budgeted LRU loading
+
+Model bundles (the files written by AdvancedDisasterPredictor.save_disaster_models)
+are stored per region, hazard and version:
+
+    <registry_dir>/regions.json
+    <registry_dir>/<region>/<hazard>/<version>/rf_model.pkl, ...
+
+regions.json names each region's bounding boxes and optionally pins the active
+version per region and hazard:
+
+    {
+      "regions": {
+        "monsoon_asia": {"bounds": [[-10, 60, 35, 150]]},
+        "atlantic_hurricane_belt": {"bounds": [[5, -100, 45, -10]]}
+      },
+      "active": {"monsoon_asia/flood": "v2"}
+    }
+
+Bounds are [min_lat, min_lon, max_lat, max_lon]; a box with min_lon > max_lon
+crosses the antimeridian. A location is routed to the smallest region that
+contains it and has a model for the hazard, otherwise to the global models.
+Regional bundles are loaded on first use and evicted least-recently-used once
+their combined size exceeds the memory budget.
+
+    python model_registry.py --register models/flood --region monsoon_asia --hazard flood --version v1
+    python model_registry.py --list
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+GLOBAL_REGION = 'global'
+GLOBAL_VERSION = 'base'
+
+
+def _version_key(version):
+    """Sort versions naturally (v2 < v10)"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', version)]
+
+
+class RegionRouter:
+    """Maps coordinates to named regions defined by bounding boxes"""
+
+    def __init__(self, regions):
+        # Most specific (smallest) regions are tried first
+        self.regions = sorted(
+            ((name, np.asarray(spec['bounds'], dtype=np.float64).reshape(-1, 4))
+             for name, spec in regions.items()),
+            key=lambda item: self._area(item[1])
+        )
+
+    @staticmethod
+    def _area(boxes):
+        widths = (boxes[:, 3] - boxes[:, 1]) % 360
+        return float(np.sum((boxes[:, 2] - boxes[:, 0]) * widths))
+
+    @staticmethod
+    def _contains(boxes, lats, lons):
+        inside = np.zeros(len(lats), dtype=bool)
+        for min_lat, min_lon, max_lat, max_lon in boxes:
+            in_lat = (lats >= min_lat) & (lats <= max_lat)
+            if min_lon <= max_lon:
+                in_lon = (lons >= min_lon) & (lons <= max_lon)
+            else:
+                in_lon = (lons >= min_lon) | (lons <= max_lon)
+            inside |= in_lat & in_lon
+        return inside
+
+    def route_batch(self, lats, lons, candidates=None):
+        """Region name per location (GLOBAL_REGION where no candidate region matches)"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        routes = np.full(len(lats), GLOBAL_REGION, dtype=object)
+        unassigned = np.ones(len(lats), dtype=bool)
+        for name, boxes in self.regions:
+            if candidates is not None and name not in candidates:
+                continue
+            hit = unassigned & self._contains(boxes, lats, lons)
+            routes[hit] = name
+            unassigned &= ~hit
+            if not unassigned.any():
+                break
+        return routes
+
+    def route(self, lat, lon, candidates=None):
+        return self.route_batch([lat], [lon], candidates)[0]
+
+
+class ModelRegistry:
+    """Regional model bundles keyed by (region, hazard, version) with LRU loading"""
+
+    def __init__(self, registry_dir, fallback=None, memory_budget_mb=1024):
+        self.registry_dir = registry_dir
+        self.fallback = fallback
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.loaded = OrderedDict()
+        self.memory_used = 0
+        self.stats = {}
+        self.discover()
+
+    def discover(self):
+        """Scan the registry directory for regions, bundles and active versions"""
+        config_path = os.path.join(self.registry_dir, 'regions.json')
+        config = {'regions': {}, 'active': {}}
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                config.update(json.load(f))
+
+        versions = {}
+        for region in config['regions']:
+            region_dir = os.path.join(self.registry_dir, region)
+            if not os.path.isdir(region_dir):
+                continue
+            for hazard in sorted(os.listdir(region_dir)):
+                hazard_dir = os.path.join(region_dir, hazard)
+                if not os.path.isdir(hazard_dir):
+                    continue
+                found = sorted((v for v in os.listdir(hazard_dir)
+                                if os.path.isdir(os.path.join(hazard_dir, v))), key=_version_key)
+                if found:
+                    versions[(region, hazard)] = found
+
+        active = {}
+        for (region, hazard), found in versions.items():
+            pinned = config['active'].get(f'{region}/{hazard}')
+            active[(region, hazard)] = pinned if pinned in found else found[-1]
+
+        with self._lock:
+            self.config = config
+            self.versions = versions
+            self.active = active
+            self.router = RegionRouter(config['regions'])
+            self.regions_by_hazard = {}
+            for region, hazard in active:
+                self.regions_by_hazard.setdefault(hazard, set()).add(region)
+
+    def bundle_dir(self, region, hazard, version):
+        return os.path.join(self.registry_dir, region, hazard, version)
+
+    def resolve(self, lat, lon, hazard):
+        """(region, hazard, version) serving a location"""
+        region = self.router.route(lat, lon, self.regions_by_hazard.get(hazard, ()))
+        if region == GLOBAL_REGION:
+            return (GLOBAL_REGION, hazard, GLOBAL_VERSION)
+        return (region, hazard, self.active[(region, hazard)])
+
+    def resolve_batch(self, lats, lons, hazard):
+        """Region per location for a hazard, as an array of names"""
+        return self.router.route_batch(lats, lons, self.regions_by_hazard.get(hazard, ()))
+
+    def _stat(self, key):
+        name = '/'.join(key)
+        if name not in self.stats:
+            self.stats[name] = {'hits': 0, 'misses': 0, 'loads': 0, 'evictions': 0,
+                                'load_seconds': 0.0, 'size_bytes': 0, 'resident': False}
+        return self.stats[name]
+
+    def get(self, key):
+        """Loaded predictor for a (region, hazard, version) key"""
+        region, hazard, version = key
+        if region == GLOBAL_REGION:
+            if self.fallback is None:
+                raise ValueError(f"No global model for {hazard}")
+            with self._lock:
+                stat = self._stat(key)
+                stat['hits'] += 1
+                stat['resident'] = True
+            return self.fallback
+
+        with self._lock:
+            if key in self.loaded:
+                self.loaded.move_to_end(key)
+                self._stat(key)['hits'] += 1
+                return self.loaded[key]
+            self._stat(key)['misses'] += 1
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Concurrent misses for the same bundle wait for a single load
+        with key_lock:
+            with self._lock:
+                if key in self.loaded:
+                    self.loaded.move_to_end(key)
+                    return self.loaded[key]
+            predictor, size_bytes, seconds = self._load(key)
+            with self._lock:
+                self.loaded[key] = predictor
+                self.memory_used += size_bytes
+                stat = self._stat(key)
+                stat['loads'] += 1
+                stat['load_seconds'] = seconds
+                stat['size_bytes'] = size_bytes
+                stat['resident'] = True
+                self._evict(keep=key)
+        return predictor
+
+    def _load(self, key):
+        from advanced_disaster_predictor import AdvancedDisasterPredictor
+
+        region, hazard, version = key
+        bundle_dir = self.bundle_dir(region, hazard, version)
+        start = time.perf_counter()
+        predictor = AdvancedDisasterPredictor()
+        if self.fallback is not None:
+            predictor.hyperparameters = self.fallback.hyperparameters
+        predictor.load_disaster_models(hazard, bundle_dir)
+        seconds = time.perf_counter() - start
+        # On-disk size is a close proxy for the unpickled trees and NN weights
+        size_bytes = sum(os.path.getsize(os.path.join(bundle_dir, name))
+                         for name in os.listdir(bundle_dir))
+        return predictor, size_bytes, seconds
+
+    def _evict(self, keep):
+        """Drop least-recently-used bundles until the budget is met (caller holds the lock)"""
+        while self.memory_used > self.memory_budget and len(self.loaded) > 1:
+            key = next(iter(self.loaded))
+            if key == keep:
+                self.loaded.move_to_end(key)
+                continue
+            del self.loaded[key]
+            stat = self._stat(key)
+            self.memory_used -= stat['size_bytes']
+            stat['evictions'] += 1
+            stat['resident'] = False
+
+    def predictor_for(self, lat, lon, hazard):
+        """(predictor, region, version) serving a location"""
+        key = self.resolve(lat, lon, hazard)
+        return self.get(key), key[0], key[2]
+
+    def route_groups(self, lats, lons, hazard):
+        """(predictor, region, version, row indices) for each model serving a batch"""
+        routes = self.resolve_batch(lats, lons, hazard)
+        groups = []
+        for region in np.unique(routes):
+            version = GLOBAL_VERSION if region == GLOBAL_REGION else self.active[(region, hazard)]
+            groups.append((self.get((region, hazard, version)), region, version,
+                           np.flatnonzero(routes == region)))
+        return groups
+
+    def predict_batch(self, features, lats, lons, hazard):
+        """Route each row to its regional model and score the groups in bulk
+
+        Returns the predict_batch arrays plus 'region' and 'version' per row.
+        """
+        n = len(lats)
+        result = {}
+        regions = np.empty(n, dtype=object)
+        versions = np.empty(n, dtype=object)
+        for predictor, region, version, rows in self.route_groups(lats, lons, hazard):
+            group = features.iloc[rows] if hasattr(features, 'iloc') else np.asarray(features)[rows]
+            for name, values in predictor.predict_batch(group, hazard).items():
+                result.setdefault(name, np.empty(n, dtype=np.float64))[rows] = values
+            regions[rows] = region
+            versions[rows] = version
+        result['region'] = regions
+        result['version'] = versions
+        return result
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'memory_budget_bytes': self.memory_budget,
+                'memory_used_bytes': self.memory_used,
+                'resident': ['/'.join(key) for key in self.loaded],
+                'regions': {name: spec.get('bounds') for name, spec in self.config['regions'].items()},
+                'active_versions': {f'{region}/{hazard}': version
+                                    for (region, hazard), version in self.active.items()},
+                'models': {name: dict(stat) for name, stat in self.stats.items()}
+            }
+
+    def register(self, source_dir, region, hazard, version, bounds=None, activate=False):
+        """Copy a saved model directory into the registry"""
+        target = self.bundle_dir(region, hazard, version)
+        if os.path.exists(target):
+            raise ValueError(f"{region}/{hazard}/{version} is already registered")
+        shutil.copytree(source_dir, target)
+
+        config_path = os.path.join(self.registry_dir, 'regions.json')
+        config = dict(self.config)
+        if bounds is not None:
+            config['regions'][region] = {'bounds': bounds}
+        elif region not in config['regions']:
+            raise ValueError(f"Region {region} has no bounds; pass bounds to define it")
+        if activate:
+            config['active'][f'{region}/{hazard}'] = version
+        with open(config_path, 'w') as f:
+            json.dump(config, f, indent=2)
+        self.discover()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the regional model registry')
+    parser.add_argument('--registry', default=os.path.join('models', 'regions'))
+    parser.add_argument('--list', action='store_true')
+    parser.add_argument('--register', metavar='MODEL_DIR', help='Saved model directory for one hazard')
+    parser.add_argument('--region')
+    parser.add_argument('--hazard')
+    parser.add_argument('--version')
+    parser.add_argument('--bounds', type=float, nargs=4, action='append',
+                        metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'))
+    parser.add_argument('--activate', action='store_true', help='Pin the registered version as active')
+    args = parser.parse_args()
+
+    os.makedirs(args.registry, exist_ok=True)
+    registry = ModelRegistry(args.registry)
+
+    if args.register:
+        if not (args.region and args.hazard and args.version):
+            parser.error('--register needs --region, --hazard and --version')
+        registry.register(args.register, args.region, args.hazard, args.version,
+                          bounds=args.bounds, activate=args.activate)
+        print(f"✅ Registered {args.region}/{args.hazard}/{args.version}")
+
+    if args.list or not args.register:
+        for (region, hazard), versions in sorted(registry.versions.items()):
+            active = registry.active[(region, hazard)]
+            listed = ', '.join(f'{v}*' if v == active else v for v in versions)
+            print(f"{region:28s} {hazard:12s} {listed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,27 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from advanced_disaster_predictor import AdvancedDisasterPredictor
+from advanced_disaster_predictor import AdvancedDisasterPredictor, MODEL_NAMES
+from response_formats import (negotiate_format, make_response, make_stream_response, is_truthy, NDJSON_MIMETYPE,
+                              ARROW_MIMETYPE)
+from features import fetch_weather_data, fetch_weather_batch, prepare_features, prepare_features_batch, WEATHER_KEYS, configure_weather_store, configure_deterministic_weather, register_feature_source
+from weather_store import WeatherTimeSeriesStore
+from seismic_index import EarthquakeCatalogIndex
+from disaster_aggregates import DisasterAggregates
+from model_registry import ModelRegistry
+from incremental_training import IncrementalUpdater
+from load_harness import RequestRecorder
+from explanations import EnsembleExplainer
+from subscriptions import SubscriptionIndex, levels_from_results, levels_from_columns
+from upstream_scheduler import UpstreamScheduler, FixedWindowQuota, configure_upstream_scheduler, PRIORITIES
+from thread_budget import ThreadBudget, autotune_subprocess
 import numpy as np
+import json
+import pandas as pd
 import requests
 from datetime import datetime
 import os
+import shutil
+import tempfile
 from dotenv import load_dotenv
 import schedule
 import time
@@ -15,8 +32,21 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
+# Inference thread budget: concurrent model calls and native threads per call.
+# It must be applied before any model is loaded to size TensorFlow's pools.
+THREAD_BUDGET_PATH = os.getenv('THREAD_BUDGET_PATH', os.path.join('models', 'thread_budget.json'))
+if (is_truthy(os.getenv('THREAD_BUDGET_AUTOTUNE', 'false')) and not os.path.exists(THREAD_BUDGET_PATH)
+        and os.path.isdir(os.path.join('models', 'flood'))):
+    print("⏱️  Tuning the inference thread budget...")
+    autotune_subprocess('models', THREAD_BUDGET_PATH, float(os.getenv('THREAD_BUDGET_AUTOTUNE_SECONDS', '5')))
+thread_budget = ThreadBudget.from_env(THREAD_BUDGET_PATH)
+thread_budget.apply()
+print(f"✅ Thread budget: {thread_budget.concurrency} concurrent calls x "
+      f"{thread_budget.threads_per_call} threads ({thread_budget.source})")
+
 # Initialize predictor
 predictor = AdvancedDisasterPredictor()
+predictor.load_hyperparameters(os.path.join('models', 'hyperparameters.json'))
 
 # Load trained models
 try:
@@ -30,106 +60,123 @@ except Exception as e:
     predictor.save_models('models')
     print("✅ Models trained and saved")
 
-def fetch_weather_data(lat, lon):
-    """Fetch real-time weather data"""
-    api_key = os.getenv('WEATHER_API_KEY')
-    if not api_key:
-        return generate_mock_weather_data()
-    
-    try:
-        # Current weather
-        url = f"http://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={api_key}&units=metric"
-        response = requests.get(url, timeout=5)
-        data = response.json()
-        
-        return {
-            'temperature': data['main']['temp'],
-            'humidity': data['main']['humidity'],
-            'pressure': data['main']['pressure'],
-            'wind_speed': data['wind']['speed'],
-            'wind_direction': data['wind'].get('deg', 0),
-            'rainfall_1h': data.get('rain', {}).get('1h', 0)
-        }
-    except Exception as e:
-        print(f"Error fetching weather data: {e}")
-        return generate_mock_weather_data()
-
-def generate_mock_weather_data():
-    """Generate mock weather data for testing"""
-    return {
-        'temperature': np.random.normal(25, 5),
-        'humidity': np.random.uniform(40, 90),
-        'pressure': np.random.normal(1013, 10),
-        'wind_speed': np.random.exponential(10),
-        'wind_direction': np.random.uniform(0, 360),
-        'rainfall_1h': np.random.exponential(2)
-    }
-
-def prepare_features(lat, lon, weather_data=None):
-    """Prepare feature vector for prediction"""
-    if weather_data is None:
-        weather_data = fetch_weather_data(lat, lon)
-    
-    # Generate or fetch additional features
-    features = {
-        # Weather features
-        'temperature': weather_data['temperature'],
-        'humidity': weather_data['humidity'],
-        'pressure': weather_data['pressure'],
-        'wind_speed': weather_data['wind_speed'],
-        'wind_direction': weather_data['wind_direction'],
-        'rainfall_1h': weather_data['rainfall_1h'],
-        'rainfall_24h': weather_data['rainfall_1h'] * np.random.uniform(15, 25),
-        'rainfall_7d': weather_data['rainfall_1h'] * np.random.uniform(50, 150),
-        'rainfall_30d': weather_data['rainfall_1h'] * np.random.uniform(200, 500),
-        'temperature_change_24h': np.random.normal(0, 3),
-        'pressure_change_24h': np.random.normal(0, 5),
-        
-        # Geographical features (would be fetched from GIS database in production)
-        'elevation': abs(lat) * 10 + np.random.uniform(0, 500),
-        'slope': np.random.exponential(8),
-        'aspect': np.random.uniform(0, 360),
-        'distance_to_water': np.random.exponential(30),
-        'distance_to_coast': abs(lat - 0) * 111 + np.random.uniform(0, 100),
-        'soil_type': np.random.randint(1, 10),
-        'soil_moisture': weather_data['humidity'] * 0.7 + np.random.uniform(-10, 10),
-        'vegetation_index': np.random.uniform(0.2, 0.8),
-        
-        # Seismic features
-        'seismic_activity_7d': np.random.exponential(1.5),
-        'seismic_activity_30d': np.random.exponential(6),
-        'fault_distance': np.random.exponential(80),
-        'tectonic_stress': np.random.uniform(20, 80),
-        'historical_earthquake_count': np.random.poisson(3),
-        
-        # Hydrological features
-        'river_level': np.random.uniform(2, 10),
-        'river_flow_rate': np.random.exponential(300),
-        'groundwater_level': np.random.uniform(10, 40),
-        'dam_capacity': np.random.uniform(60, 95),
-        'upstream_rainfall': weather_data['rainfall_1h'] * np.random.uniform(1, 3),
-        
-        # Atmospheric features
-        'sea_surface_temp': weather_data['temperature'] + np.random.uniform(-2, 2),
-        'atmospheric_pressure_gradient': np.random.normal(0, 3),
-        'wind_shear': np.random.uniform(5, 40),
-        'moisture_content': weather_data['humidity'] + np.random.uniform(-10, 10),
-        'coriolis_effect': abs(lat) / 90,
-        
-        # Temporal features
-        'month': datetime.now().month,
-        'season': (datetime.now().month % 12) // 3,
-        'day_of_year': datetime.now().timetuple().tm_yday,
-        'is_monsoon_season': 1 if 6 <= datetime.now().month <= 9 else 0,
-        
-        # Historical features (would be fetched from database in production)
-        'historical_disaster_count_1y': np.random.poisson(2),
-        'historical_disaster_count_5y': np.random.poisson(10),
-        'days_since_last_disaster': np.random.exponential(150),
-        'avg_disaster_severity': np.random.uniform(0.3, 0.7)
-    }
+updater = IncrementalUpdater(predictor, model_dir='models')
+
+# Rolling-window weather store for rainfall totals and 24h changes
+weather_store = None
+if os.getenv('WEATHER_STORE_PATH'):
+    weather_store = WeatherTimeSeriesStore(
+        os.getenv('WEATHER_STORE_PATH'),
+        capacity=int(os.getenv('WEATHER_STORE_CAPACITY', '131072'))
+    )
+    configure_weather_store(weather_store)
+    print(f"✅ Weather time-series store: {weather_store.n_used:,} cells")
+
+# Local earthquake catalog for the seismic activity features
+seismic_index = None
+if os.getenv('EARTHQUAKE_CATALOG_PATH'):
+    seismic_index = EarthquakeCatalogIndex.load(os.getenv('EARTHQUAKE_CATALOG_PATH'))
+    # Events posted to /seismic/events are journaled and replayed on restart
+    seismic_index.open_journal(os.getenv('EARTHQUAKE_JOURNAL_PATH',
+                                         os.getenv('EARTHQUAKE_CATALOG_PATH') + '.journal'))
+    register_feature_source(seismic_index)
+    print(f"✅ Earthquake catalog: {seismic_index.n_events:,} events")
+
+# Materialized per-cell disaster history for the historical features
+disaster_aggregates = None
+if os.getenv('DISASTER_DB_PATH'):
+    disaster_aggregates = DisasterAggregates(os.getenv('DISASTER_DB_PATH'))
+    register_feature_source(disaster_aggregates)
+    print(f"✅ Disaster history: {len(disaster_aggregates.aggregates):,} cells")
+
+# Region-specific models, loaded on demand; the global models above are the fallback
+model_registry = None
+if os.getenv('MODEL_REGISTRY_DIR'):
+    model_registry = ModelRegistry(
+        os.getenv('MODEL_REGISTRY_DIR'),
+        fallback=predictor,
+        memory_budget_mb=float(os.getenv('MODEL_MEMORY_BUDGET_MB', '1024'))
+    )
+    print(f"✅ Model registry: {len(model_registry.active)} regional models")
+
+# Reproducible per-location weather and features for load tests
+WEATHER_SEED = int(os.getenv('DETERMINISTIC_WEATHER_SEED')) if os.getenv('DETERMINISTIC_WEATHER_SEED') else None
+if WEATHER_SEED is not None:
+    configure_deterministic_weather(WEATHER_SEED)
+    print(f"✅ Deterministic weather (seed {WEATHER_SEED})")
+
+# Prediction traffic recording for load_harness.py replay
+request_recorder = None
+if os.getenv('REQUEST_RECORD_PATH'):
+    request_recorder = RequestRecorder(os.getenv('REQUEST_RECORD_PATH')).install(app)
+    print(f"✅ Recording prediction requests to {os.getenv('REQUEST_RECORD_PATH')}")
+
+# Quota-aware scheduling of weather API calls: interactive /predict calls go
+# ahead of scheduled and bulk work and keep a share of the quota for themselves
+weather_api_scheduler = None
+if os.getenv('WEATHER_API_KEY'):
+    quotas = [(int(os.getenv('WEATHER_API_RATE_PER_MINUTE', '60')), 60.0)]
+    if os.getenv('WEATHER_API_DAILY_QUOTA'):
+        # The provider's daily count resets at a fixed hour, not continuously
+        quotas.append(FixedWindowQuota(
+            int(os.getenv('WEATHER_API_DAILY_QUOTA')),
+            reset_hour=int(os.getenv('WEATHER_API_QUOTA_RESET_HOUR_UTC', '0')),
+            path=os.getenv('WEATHER_API_QUOTA_STATE_PATH', os.path.join('data', 'weather_api_quota.json')) or None))
+    weather_api_scheduler = UpstreamScheduler(quotas, concurrency=int(os.getenv('WEATHER_API_CONCURRENCY', '8')))
+    configure_upstream_scheduler(weather_api_scheduler)
+    print(f"✅ Weather API scheduler: {quotas[0][0]} calls/min"
+          + (f", {quotas[1].tokens:,.0f}/{quotas[1].capacity:,.0f} calls left today" if len(quotas) > 1 else ""))
+
+# Geofenced alert subscriptions; persisted when a database path is set
+subscription_index = SubscriptionIndex(
+    os.getenv('SUBSCRIPTIONS_DB_PATH'),
+    cell_degrees=float(os.getenv('SUBSCRIPTIONS_CELL_DEGREES', '0.5'))
+)
+if os.getenv('SUBSCRIPTIONS_DB_PATH'):
+    print(f"✅ Alert subscriptions: {subscription_index.n_subscriptions:,}")
+
+# Cascade (early-exit) scoring default; requests can override with "cascade"
+CASCADE_MODE = is_truthy(os.getenv('CASCADE_MODE', 'false'))
+CASCADE_SHADOW_RATE = float(os.getenv('CASCADE_SHADOW_RATE', '0.05'))
+
+# Feature attributions for "explain": true. Single predictions use exact
+# TreeSHAP; batches default to the much cheaper path attributions.
+EXPLAIN_TOP_K = int(os.getenv('EXPLAIN_TOP_K', '5'))
+EXPLAIN_NN_STEPS = int(os.getenv('EXPLAIN_NN_STEPS', '16'))
+EXPLAIN_MAX_MS = float(os.getenv('EXPLAIN_MAX_MS', '150'))
+explainer = EnsembleExplainer(method='treeshap', nn_steps=EXPLAIN_NN_STEPS, max_ms=EXPLAIN_MAX_MS or None,
+                              budget=thread_budget)
+batch_explainer = EnsembleExplainer(method=os.getenv('EXPLAIN_BATCH_METHOD', 'saabas'),
+                                    nn_steps=EXPLAIN_NN_STEPS, budget=thread_budget)
+
+def run_prediction(features, disaster_type, cascade=False, lat=None, lon=None, explain=False):
+    """Score one feature row with the full ensemble or the cascade
     
-    return features
+    With a model registry the location picks the regional model. With explain
+    the result carries the ensemble's largest feature contributions; the
+    explanation splits the full ensemble, so such requests are always
+    escalated past the cascade's cheap model.
+    """
+    model = predictor
+    if model_registry is not None and lat is not None:
+        model, region, version = model_registry.predictor_for(lat, lon, disaster_type)
+    with thread_budget.limit(model):
+        if cascade and not explain:
+            prediction = model.predict_disaster_cascade(features, disaster_type, shadow_rate=CASCADE_SHADOW_RATE)
+        else:
+            prediction = model.predict_disaster(features, disaster_type)
+        if explain:
+            prediction['explanation'] = explainer.explain(model, features, disaster_type, EXPLAIN_TOP_K)
+            if cascade:
+                prediction['cascade'] = 'escalated'
+    if model_registry is not None and lat is not None:
+        prediction['model'] = {'region': region, 'version': version}
+    return prediction
+
+def model_fingerprints():
+    """Per-hazard digests of the global models, for sweep workers to compare"""
+    with thread_budget.limit(predictor):
+        return predictor.model_fingerprints()
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -137,7 +184,10 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'models_loaded': len([m for m in predictor.models.values() if m['ensemble'] is not None])
+        'models_loaded': len([m for m in predictor.models.values() if m['ensemble'] is not None]),
+        'weather_seed': WEATHER_SEED,
+        'regional_models': len(model_registry.active) if model_registry is not None else 0,
+        'model_fingerprints': model_fingerprints()
     })
 
 @app.route('/predict', methods=['POST'])
@@ -148,12 +198,17 @@ def predict():
         lat = data.get('latitude')
         lon = data.get('longitude')
         disaster_types = data.get('disaster_types', ['flood', 'cyclone', 'earthquake', 'landslide', 'wildfire'])
+        cascade = is_truthy(data.get('cascade', CASCADE_MODE))
+        explain = is_truthy(data.get('explain', False))
+        priority = data.get('priority', 'interactive')
         
         if lat is None or lon is None:
             return jsonify({'error': 'Latitude and longitude are required'}), 400
+        if priority not in PRIORITIES:
+            return jsonify({'error': f"priority must be one of {', '.join(PRIORITIES)}"}), 400
         
         # Fetch weather data
-        weather_data = fetch_weather_data(lat, lon)
+        weather_data = fetch_weather_data(lat, lon, priority)
         
         # Prepare features
         features = prepare_features(lat, lon, weather_data)
@@ -162,7 +217,7 @@ def predict():
         predictions = {}
         for disaster_type in disaster_types:
             if disaster_type in predictor.models:
-                prediction = predictor.predict_disaster(features, disaster_type)
+                prediction = run_prediction(features, disaster_type, cascade, lat, lon, explain)
                 predictions[disaster_type] = prediction
         
         return jsonify({
@@ -180,42 +235,177 @@ def predict():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Locations scored together per chunk when streaming NDJSON
+BATCH_STREAM_CHUNK = int(os.getenv('BATCH_STREAM_CHUNK', '2000'))
+
+def model_groups(lats, lons, disaster_type):
+    """(predictor, model info, row indices) for each model serving a chunk"""
+    if model_registry is None:
+        return [(predictor, None, np.arange(len(lats)))]
+    return [(model, {'region': region, 'version': version}, rows)
+            for model, region, version, rows in model_registry.route_groups(lats, lons, disaster_type)]
+
+def score_locations(locations, disaster_types, cascade=False, explain=False, priority='bulk'):
+    """Vectorized scoring of a chunk of locations into /predict/batch results
+    
+    Locations that carry all weather fields use them; the others are fetched
+    like /predict does, at the given upstream priority.
+    """
+    n = len(locations)
+    # Explanations split the full ensemble, so explained rows skip the cascade
+    early_exits = cascade and not explain
+    lats = np.array([location['latitude'] for location in locations], dtype=np.float64)
+    lons = np.array([location['longitude'] for location in locations], dtype=np.float64)
+    weather = {key: np.empty(n) for key in WEATHER_KEYS}
+    missing = []
+    for i, location in enumerate(locations):
+        if not all(key in location for key in WEATHER_KEYS):
+            missing.append(i)
+            continue
+        for key in WEATHER_KEYS:
+            weather[key][i] = location[key]
+    if missing:
+        fetched = fetch_weather_batch(lats[missing], lons[missing], priority)
+        for key in WEATHER_KEYS:
+            weather[key][missing] = fetched[key]
+    features = prepare_features_batch(lats, lons, weather_data=weather)
+    
+    predictions = [{} for _ in range(n)]
+    max_probability = np.zeros(n)
+    for disaster_type in disaster_types:
+        if disaster_type not in predictor.models:
+            continue
+        for model, info, rows in model_groups(lats, lons, disaster_type):
+            group = features.iloc[rows]
+            with thread_budget.limit(model):
+                if early_exits:
+                    probs = model.predict_batch_cascade(group, disaster_type, shadow_rate=CASCADE_SHADOW_RATE)
+                else:
+                    probs = model.predict_batch(group, disaster_type)
+                if explain:
+                    explanation = batch_explainer.explain_batch(model, group, disaster_type)
+            
+            levels = model.get_risk_levels(probs['probability'])
+            confidence = np.full(len(rows), model.models[disaster_type]['ensemble']['accuracy'], dtype=np.float64)
+            if early_exits:
+                cheap_model = model.cascade[disaster_type]['model']
+                cheap_accuracy = model.model_accuracies.get(disaster_type, {}).get(cheap_model)
+                if cheap_accuracy is not None:
+                    confidence[probs['early_exit']] = cheap_accuracy
+
+            for j, row in enumerate(rows):
+                prediction = {
+                    'probability': float(probs['probability'][j]),
+                    'risk_level': str(levels[j]),
+                    'confidence': float(confidence[j]),
+                    'model_predictions': {
+                        name: float(probs[name][j])
+                        for name in MODEL_NAMES.values()
+                        if not np.isnan(probs[name][j])
+                    }
+                }
+                if cascade:
+                    prediction['cascade'] = 'early_exit' if early_exits and probs['early_exit'][j] else 'escalated'
+                if info is not None:
+                    prediction['model'] = info
+                if explain:
+                    prediction['explanation'] = batch_explainer.top_features(model, explanation, j, EXPLAIN_TOP_K)
+                predictions[row][disaster_type] = prediction
+            max_probability[rows] = np.maximum(max_probability[rows], probs['probability'])
+    
+    # Risk bands are monotonic in probability, so the overall band is the
+    # band of the highest hazard probability
+    overall = predictor.get_risk_levels(max_probability)
+    return [
+        {'location': location, 'predictions': predictions[i], 'overall_risk': str(overall[i])}
+        for i, location in enumerate(locations)
+    ]
+
+def spool_request_body(stream, chunk_size=1 << 20):
+    """Copy a streamed request body to a temporary file
+    
+    Most HTTP clients send the whole body before reading the response, so
+    results cannot be streamed back while the upload is still arriving
+    without both sides blocking on full socket buffers.
+    """
+    spool = tempfile.TemporaryFile()
+    shutil.copyfileobj(stream, spool, chunk_size)
+    spool.seek(0)
+    return spool
+
+def iter_ndjson_locations(spool):
+    """Parse a spooled NDJSON request body one location per line"""
+    with spool:
+        for line in spool:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def stream_predictions(locations, disaster_types, cascade=False, chunk_size=BATCH_STREAM_CHUNK, explain=False,
+                       priority='bulk'):
+    """Score an iterable of locations chunk by chunk, yielding result lists"""
+    chunk = []
+    for location in locations:
+        if location.get('latitude') is None or location.get('longitude') is None:
+            continue
+        chunk.append(location)
+        if len(chunk) >= chunk_size:
+            yield score_locations(chunk, disaster_types, cascade, explain, priority)
+            chunk = []
+    if chunk:
+        yield score_locations(chunk, disaster_types, cascade, explain, priority)
+
 @app.route('/predict/batch', methods=['POST'])
 def predict_batch():
-    """Batch prediction for multiple locations"""
+    """Batch prediction for multiple locations
+    
+    With Accept: application/x-ndjson (or ?format=ndjson) results are streamed
+    one line per location as each chunk is scored. A request body sent as
+    application/x-ndjson (one location per line, options in the query string)
+    is read incrementally, so memory stays bounded by the chunk size.
+    """
     try:
-        data = request.json
-        locations = data.get('locations', [])
-        disaster_types = data.get('disaster_types', ['flood', 'cyclone', 'earthquake', 'landslide', 'wildfire'])
+        mimetype = negotiate_format(request)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 406
+
+    try:
+        if request.mimetype == NDJSON_MIMETYPE:
+            data = {}
+            locations = iter_ndjson_locations(spool_request_body(request.stream))
+            mimetype = NDJSON_MIMETYPE
+        else:
+            data = request.json
+            locations = data.get('locations', [])
+        
+        disaster_types = data.get('disaster_types', request.args.get('disaster_types'))
+        if isinstance(disaster_types, str):
+            disaster_types = disaster_types.split(',')
+        disaster_types = disaster_types or ['flood', 'cyclone', 'earthquake', 'landslide', 'wildfire']
+        compact = is_truthy(data.get('compact', request.args.get('compact', False)))
+        cascade = is_truthy(data.get('cascade', request.args.get('cascade', CASCADE_MODE)))
+        explain = is_truthy(data.get('explain', request.args.get('explain', False)))
+        # Cron sweeps send "scheduled"; everything else in a batch is bulk
+        priority = data.get('priority', request.args.get('priority', 'bulk'))
+        if priority not in PRIORITIES:
+            return jsonify({'error': f"priority must be one of {', '.join(PRIORITIES)}"}), 400
+        if explain and mimetype == ARROW_MIMETYPE:
+            return jsonify({'error': "Explanations are not available as Arrow; request JSON, "
+                                     "MessagePack or NDJSON"}), 406
+        
+        if mimetype == NDJSON_MIMETYPE:
+            return make_stream_response(stream_predictions(locations, disaster_types, cascade, explain=explain,
+                                                           priority=priority),
+                                        compact=compact)
         
         results = []
-        for location in locations:
-            lat = location.get('latitude')
-            lon = location.get('longitude')
-            
-            if lat is None or lon is None:
-                continue
-            
-            weather_data = fetch_weather_data(lat, lon)
-            features = prepare_features(lat, lon, weather_data)
-            
-            predictions = {}
-            for disaster_type in disaster_types:
-                if disaster_type in predictor.models:
-                    prediction = predictor.predict_disaster(features, disaster_type)
-                    predictions[disaster_type] = prediction
-            
-            results.append({
-                'location': location,
-                'predictions': predictions,
-                'overall_risk': max([p['risk_level'] for p in predictions.values()], 
-                                  key=lambda x: ['low', 'medium', 'high', 'critical'].index(x))
-            })
+        for chunk in stream_predictions(locations, disaster_types, cascade, explain=explain, priority=priority):
+            results.extend(chunk)
         
-        return jsonify({
+        return make_response({
             'timestamp': datetime.now().isoformat(),
             'results': results
-        })
+        }, mimetype, compact=compact)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -228,6 +418,49 @@ def get_model_accuracy():
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/model/cascade', methods=['GET'])
+def get_cascade_stats():
+    """Get cascade early-exit and band-agreement statistics"""
+    return jsonify({
+        'enabled_by_default': CASCADE_MODE,
+        'shadow_rate': CASCADE_SHADOW_RATE,
+        'cascade': predictor.get_cascade_stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/model/explanations', methods=['GET'])
+def get_explanation_stats():
+    """Get explanation cache and latency statistics"""
+    return jsonify({
+        'single': explainer.get_stats(),
+        'batch': batch_explainer.get_stats(),
+        'top_k': EXPLAIN_TOP_K,
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/model/threads', methods=['GET'])
+def get_thread_budget_stats():
+    """Inference thread budget and slot queueing statistics"""
+    return jsonify(dict(thread_budget.get_stats(), timestamp=datetime.now().isoformat()))
+
+@app.route('/upstream/stats', methods=['GET'])
+def get_upstream_stats():
+    """Weather API quota, queue depth and per-class queueing delay"""
+    if weather_api_scheduler is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(weather_api_scheduler.get_stats(), enabled=True))
+
+@app.route('/model/registry', methods=['GET'])
+def get_registry_stats():
+    """Get regional model routing, residency and load/evict/hit statistics"""
+    if model_registry is None:
+        return jsonify({'enabled': False})
+    return jsonify({
+        'enabled': True,
+        **model_registry.get_stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
 @app.route('/retrain', methods=['POST'])
 def retrain_models():
     """Retrain models (admin only)"""
@@ -256,10 +489,167 @@ def retrain_models():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/update', methods=['POST'])
+def update_models():
+    """Incrementally update a model with newly labeled observations (admin only)"""
+    try:
+        data = request.json
+        disaster_type = data.get('disaster_type')
+        observations = data.get('observations', [])
+        
+        if disaster_type not in predictor.models:
+            return jsonify({'error': f'Unknown disaster type: {disaster_type}'}), 400
+        if not observations:
+            return jsonify({'error': 'At least one observation is required'}), 400
+        
+        rows = []
+        labels = []
+        for observation in observations:
+            if 'label' not in observation:
+                return jsonify({'error': 'Every observation needs a label'}), 400
+            
+            if all(col in observation for col in predictor.feature_columns):
+                row = observation
+            else:
+                lat = observation.get('latitude')
+                lon = observation.get('longitude')
+                if lat is None or lon is None:
+                    return jsonify({'error': 'Observations need full features or latitude/longitude'}), 400
+                weather_data = None
+                if all(key in observation for key in WEATHER_KEYS):
+                    weather_data = {key: observation[key] for key in WEATHER_KEYS}
+                if weather_data is None:
+                    weather_data = fetch_weather_data(lat, lon, 'bulk')
+                row = prepare_features(lat, lon, weather_data)
+                row.update({col: observation[col] for col in predictor.feature_columns if col in observation})
+            
+            rows.append({col: row[col] for col in predictor.feature_columns})
+            labels.append(int(observation['label']))
+        
+        report = updater.update(disaster_type, pd.DataFrame(rows), labels,
+                                force_full=bool(data.get('force_full', False)))
+        return jsonify(report)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/seismic/events', methods=['POST'])
+def add_seismic_events():
+    """Append new earthquake events to the catalog index (admin only)"""
+    try:
+        if seismic_index is None:
+            return jsonify({'error': 'No earthquake catalog configured (EARTHQUAKE_CATALOG_PATH)'}), 400
+        
+        events = request.json.get('events', [])
+        required = ('time', 'latitude', 'longitude', 'magnitude')
+        if any(key not in event for event in events for key in required):
+            return jsonify({'error': f'Every event needs {", ".join(required)}'}), 400
+        
+        added = seismic_index.record_events(
+            [pd.Timestamp(event['time']).timestamp() for event in events],
+            [float(event['latitude']) for event in events],
+            [float(event['longitude']) for event in events],
+            [float(event['magnitude']) for event in events]
+        )
+        return jsonify({'added': added, 'total_events': seismic_index.n_events})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/disasters', methods=['POST'])
+def add_disasters():
+    """Fold new or updated disaster documents into the history aggregates (admin only)"""
+    try:
+        if disaster_aggregates is None:
+            return jsonify({'error': 'No disaster history configured (DISASTER_DB_PATH)'}), 400
+        
+        data = request.json
+        documents = data.get('disasters', [data] if 'location' in data else [])
+        if not documents:
+            return jsonify({'error': 'At least one disaster is required'}), 400
+        if any('type' not in doc or 'location' not in doc for doc in documents):
+            return jsonify({'error': 'Every disaster needs a type and a location'}), 400
+        
+        counted = disaster_aggregates.add_disasters(documents)
+        return jsonify({'received': len(documents), 'counted': counted,
+                        'cells': len(disaster_aggregates.aggregates)})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/alerts/subscriptions', methods=['POST'])
+def add_subscriptions():
+    """Add or replace geofenced alert subscriptions (circles or GeoJSON polygons)"""
+    try:
+        data = request.json
+        documents = data.get('subscriptions', [data] if 'id' in data else [])
+        if not documents:
+            return jsonify({'error': 'At least one subscription is required'}), 400
+        
+        added = subscription_index.add_subscriptions(documents)
+        return jsonify({'added': added, 'total_subscriptions': subscription_index.n_subscriptions})
+        
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid subscription: {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/alerts/subscriptions/<subscription_id>', methods=['DELETE'])
+def remove_subscription(subscription_id):
+    """Remove one alert subscription"""
+    removed = subscription_index.remove_subscriptions([subscription_id])
+    if not removed:
+        return jsonify({'error': f'No subscription {subscription_id}'}), 404
+    return jsonify({'removed': subscription_id, 'total_subscriptions': subscription_index.n_subscriptions})
+
+@app.route('/alerts/subscriptions', methods=['GET'])
+def get_subscription_stats():
+    """Subscription index size and grid stats"""
+    return jsonify(subscription_index.get_stats())
+
+@app.route('/alerts/match', methods=['POST'])
+def match_alerts():
+    """Subscribers covered by batched prediction results, per hazard and level
+    
+    Takes the "results" of /predict/batch or the columns of a grid sweep
+    (latitude, longitude, <hazard>_risk_level, <hazard>_probability). With
+    previous_risk_level per prediction (or <hazard>_previous_risk_level
+    columns) only rises in risk are matched.
+    """
+    try:
+        data = request.json
+        if 'results' in data:
+            lats, lons, levels, probabilities, previous = levels_from_results(data['results'])
+        elif 'latitude' in data and 'longitude' in data:
+            lats, lons, levels, probabilities, previous = levels_from_columns(data)
+        else:
+            return jsonify({'error': 'Send /predict/batch "results" or latitude/longitude columns'}), 400
+        
+        start = time.perf_counter()
+        matches = subscription_index.match(lats, lons, levels, probabilities, previous)
+        return jsonify({
+            'timestamp': datetime.now().isoformat(),
+            'locations': len(lats),
+            'matches': matches,
+            'match_ms': round((time.perf_counter() - start) * 1000, 2)
+        })
+        
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid prediction results: {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 def run_scheduled_predictions():
     """Run scheduled predictions for monitoring"""
     # This would integrate with your MongoDB to check registered locations
     print(f"[{datetime.now()}] Running scheduled predictions...")
+    
+    if weather_store is not None:
+        weather_store.flush()
+    if disaster_aggregates is not None:
+        disaster_aggregates.refresh()
+    if request_recorder is not None:
+        request_recorder.flush()
 
 # Schedule periodic tasks
 schedule.every(30).minutes.do(run_scheduled_predictions)
@@ -277,12 +667,23 @@ if __name__ == '__main__':
     print("\n" + "="*60)
     print("🚀 GUARDIAN EARTH AI PREDICTION SERVER")
     print("="*60)
-    print("Server running on http://localhost:8000")
+    port = int(os.getenv('PREDICTION_SERVER_PORT', '8000'))
+    print(f"Server running on http://localhost:{port}")
     print("Endpoints:")
     print("  POST /predict - Single location prediction")
     print("  POST /predict/batch - Batch predictions")
     print("  GET  /model/accuracy - Model accuracy info")
+    print("  GET  /model/cascade - Cascade early-exit stats")
+    print("  GET  /model/explanations - Explanation cache and latency stats")
+    print("  GET  /model/registry - Regional model registry stats")
+    print("  GET  /model/threads - Inference thread budget stats")
+    print("  GET  /upstream/stats - Weather API quota and queueing stats")
+    print("  POST /update - Incremental model update")
+    print("  POST /seismic/events - Append earthquake catalog events")
+    print("  POST /disasters - Update disaster history aggregates")
+    print("  POST /alerts/subscriptions - Add geofenced alert subscriptions")
+    print("  POST /alerts/match - Subscribers matching batch predictions")
     print("  GET  /health - Health check")
     print("="*60 + "\n")
     
-    app.run(host='0.0.0.0', port=8000, debug=False)
+    app.run(host='0.0.0.0', port=port, debug=False)
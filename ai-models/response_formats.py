@@ -0,0 +1,241 @@
+"""
+Content-negotiated response encoders for the batch prediction endpoints
+"""
+
+import json
+from datetime import datetime
+
+import numpy as np
+from flask import Response, stream_with_context
+
+try:
+    import orjson
+except ImportError:  # optional fast JSON encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional MessagePack support
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional Arrow IPC support
+    pa = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+FORMAT_ALIASES = {
+    'json': JSON_MIMETYPE,
+    'msgpack': MSGPACK_MIMETYPE,
+    'arrow': ARROW_MIMETYPE,
+    'ndjson': NDJSON_MIMETYPE
+}
+
+# Column suffixes used for the per-model breakdown in columnar output
+MODEL_COLUMNS = ['random_forest', 'xgboost', 'lightgbm', 'neural_network']
+
+
+def available_formats():
+    """Mimetypes that can be produced with the installed encoders"""
+    formats = [JSON_MIMETYPE, NDJSON_MIMETYPE]
+    if msgpack is not None:
+        formats.append(MSGPACK_MIMETYPE)
+    if pa is not None:
+        formats.append(ARROW_MIMETYPE)
+    return formats
+
+
+def negotiate_format(req):
+    """Pick the response mimetype from ?format= or the Accept header"""
+    requested = req.args.get('format')
+    if requested:
+        mimetype = FORMAT_ALIASES.get(requested.lower(), requested.lower())
+        if mimetype not in available_formats():
+            raise ValueError(f"Unsupported response format: {requested}")
+        return mimetype
+
+    return req.accept_mimetypes.best_match(available_formats(), default=JSON_MIMETYPE)
+
+
+def is_truthy(value):
+    """Interpret query-string and JSON flags such as compact=true"""
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def compact_results(results):
+    """Drop the per-model breakdown from every prediction in place"""
+    for result in results:
+        for prediction in result.get('predictions', {}).values():
+            prediction.pop('model_predictions', None)
+    return results
+
+
+def _default(obj):
+    """Fallback conversion for values the stdlib encoder cannot handle"""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+def encode_json(payload):
+    """Encode a payload as JSON, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(
+            payload,
+            default=_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        )
+    return json.dumps(payload, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def encode_msgpack(payload):
+    """Encode a payload as MessagePack"""
+    if msgpack is None:
+        raise ValueError("MessagePack output requires the msgpack package")
+    return msgpack.packb(payload, default=_default, use_bin_type=True)
+
+
+def batch_to_arrow(payload, compact=False):
+    """Convert a batch payload to an Arrow table with one column per hazard and model
+
+    Cascaded hazards add a {hazard}_early_exit column and registry-routed
+    hazards add {hazard}_model_region and {hazard}_model_version columns.
+    Explanations have no columnar form; the server refuses them with Arrow.
+    """
+    if pa is None:
+        raise ValueError("Arrow output requires the pyarrow package")
+
+    results = payload.get('results', [])
+
+    hazards = []
+    cascaded = set()
+    routed = set()
+    for result in results:
+        for hazard, prediction in result.get('predictions', {}).items():
+            if hazard not in hazards:
+                hazards.append(hazard)
+            if 'cascade' in prediction:
+                cascaded.add(hazard)
+            if 'model' in prediction:
+                routed.add(hazard)
+
+    columns = {
+        'latitude': [],
+        'longitude': [],
+        'overall_risk': []
+    }
+    for hazard in hazards:
+        columns[f'{hazard}_probability'] = []
+        columns[f'{hazard}_risk_level'] = []
+        columns[f'{hazard}_confidence'] = []
+        if hazard in cascaded:
+            columns[f'{hazard}_early_exit'] = []
+        if hazard in routed:
+            columns[f'{hazard}_model_region'] = []
+            columns[f'{hazard}_model_version'] = []
+        if not compact:
+            for model in MODEL_COLUMNS:
+                columns[f'{hazard}_{model}'] = []
+
+    for result in results:
+        location = result.get('location', {})
+        columns['latitude'].append(location.get('latitude'))
+        columns['longitude'].append(location.get('longitude'))
+        columns['overall_risk'].append(result.get('overall_risk'))
+
+        predictions = result.get('predictions', {})
+        for hazard in hazards:
+            prediction = predictions.get(hazard, {})
+            columns[f'{hazard}_probability'].append(prediction.get('probability'))
+            columns[f'{hazard}_risk_level'].append(prediction.get('risk_level'))
+            columns[f'{hazard}_confidence'].append(prediction.get('confidence'))
+            if hazard in cascaded:
+                cascade = prediction.get('cascade')
+                columns[f'{hazard}_early_exit'].append(None if cascade is None else cascade == 'early_exit')
+            if hazard in routed:
+                model_info = prediction.get('model', {})
+                columns[f'{hazard}_model_region'].append(model_info.get('region'))
+                columns[f'{hazard}_model_version'].append(model_info.get('version'))
+            if not compact:
+                model_predictions = prediction.get('model_predictions', {})
+                for model in MODEL_COLUMNS:
+                    columns[f'{hazard}_{model}'].append(model_predictions.get(model))
+
+    arrays = {}
+    for name, values in columns.items():
+        if name == 'overall_risk' or name.endswith(('_risk_level', '_model_region', '_model_version')):
+            arrays[name] = pa.array(values, type=pa.string()).dictionary_encode()
+        elif name.endswith('_early_exit'):
+            arrays[name] = pa.array(values, type=pa.bool_())
+        else:
+            arrays[name] = pa.array(values, type=pa.float64())
+
+    metadata = {'timestamp': str(payload.get('timestamp', ''))}
+    return pa.table(arrays).replace_schema_metadata(metadata)
+
+
+def encode_arrow(payload, compact=False):
+    """Encode a batch payload as an Arrow IPC stream"""
+    table = batch_to_arrow(payload, compact=compact)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_ndjson(results):
+    """Encode results as newline-delimited JSON, one result per line"""
+    return b''.join(encode_json(result) + b'\n' for result in results)
+
+
+def encode_payload(payload, mimetype, compact=False):
+    """Serialize a payload for the negotiated mimetype"""
+    if mimetype == NDJSON_MIMETYPE:
+        return encode_ndjson(payload.get('results', []))
+    if mimetype == ARROW_MIMETYPE:
+        return encode_arrow(payload, compact=compact)
+    if mimetype == MSGPACK_MIMETYPE:
+        return encode_msgpack(payload)
+    return encode_json(payload)
+
+
+def make_response(payload, mimetype=JSON_MIMETYPE, compact=False):
+    """Build a Flask response in the negotiated format"""
+    if compact and 'results' in payload:
+        compact_results(payload['results'])
+    body = encode_payload(payload, mimetype, compact=compact)
+    response = Response(body, mimetype=mimetype)
+    response.headers['Vary'] = 'Accept'
+    return response
+
+
+def make_stream_response(result_chunks, compact=False):
+    """Stream NDJSON lines as each chunk of results is produced
+
+    result_chunks yields lists of result dicts; only one chunk is held in
+    memory at a time.
+    """
+    def generate():
+        try:
+            for results in result_chunks:
+                if compact:
+                    compact_results(results)
+                yield encode_ndjson(results)
+        except Exception as e:
+            # Headers are already sent; report the failure as a final line
+            yield encode_json({'error': str(e)}) + b'\n'
+
+    response = Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+    response.headers['Vary'] = 'Accept'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Offline bulk scoring of location or feature-row files with the trained models
+
+Input is a CSV or Parquet file with either latitude/longitude columns, full
+feature rows (every AdvancedDisasterPredictor.feature_columns entry), or a mix
+of both where stored feature columns override the generated ones. Weather is
+never fetched: stored weather columns are used when present, otherwise the
+mock weather path. Results are written incrementally to a Parquet file.
+
+    python score_locations.py locations.csv scores.parquet --workers 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from features import WEATHER_KEYS, configure_deterministic_weather, fetch_weather_batch, prepare_features_batch
+
+DISASTER_TYPES = ['flood', 'cyclone', 'earthquake', 'landslide', 'wildfire']
+MODEL_KEYS = ['random_forest', 'xgboost', 'lightgbm', 'neural_network']
+
+# Loaded once per worker process by _init_worker
+_predictor = None
+_disaster_types = None
+
+
+def iter_chunks(path, chunk_size):
+    """Stream a CSV or Parquet file as DataFrames of at most chunk_size rows"""
+    if path.endswith('.parquet') or path.endswith('.pq'):
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(path, chunksize=chunk_size):
+            yield chunk
+
+
+def _init_worker(model_dir, disaster_types, weather_seed=None):
+    """Load the models once per worker process
+
+    load_models reports and skips types it cannot load; with none left every
+    row would silently come out as overall_risk 'low', so that is an error.
+    weather_seed switches on the per-location deterministic weather used by
+    prediction servers started with DETERMINISTIC_WEATHER_SEED.
+    """
+    global _predictor, _disaster_types
+    if weather_seed is not None:
+        configure_deterministic_weather(weather_seed)
+    from advanced_disaster_predictor import AdvancedDisasterPredictor
+
+    _predictor = AdvancedDisasterPredictor()
+    _predictor.load_models(model_dir)
+    _disaster_types = [
+        dt for dt in disaster_types
+        if _predictor.models.get(dt, {}).get('ensemble') is not None
+    ]
+    if not _disaster_types:
+        raise RuntimeError(f"No models for {', '.join(disaster_types)} could be loaded from {model_dir}")
+
+
+def model_fingerprints():
+    """model_fingerprints of the worker's predictor for the types it scores"""
+    fingerprints = _predictor.model_fingerprints()
+    return {dt: fingerprints[dt] for dt in _disaster_types}
+
+
+def build_features(chunk, feature_columns, seed):
+    """Combine stored feature columns with generated ones for a chunk
+
+    seed=None draws weather and features from the per-location streams set up
+    by _init_worker(weather_seed=...), so a location gets the same values
+    whichever chunk, worker or server it is scored in.
+    """
+    if all(col in chunk.columns for col in feature_columns):
+        return chunk[feature_columns]
+
+    if 'latitude' not in chunk.columns or 'longitude' not in chunk.columns:
+        missing = [col for col in feature_columns if col not in chunk.columns]
+        raise ValueError(f"Input needs latitude/longitude or full feature rows; missing {missing[:5]}...")
+
+    lats = chunk['latitude'].to_numpy()
+    lons = chunk['longitude'].to_numpy()
+    weather = None
+    if all(key in chunk.columns for key in WEATHER_KEYS):
+        weather = {key: chunk[key].to_numpy() for key in WEATHER_KEYS}
+
+    rng = None
+    if seed is not None:
+        rng = np.random.default_rng(seed)
+    elif weather is None:
+        # Deterministic mode: a vectorized draw, the weather API is not called
+        weather = fetch_weather_batch(lats, lons)
+
+    features = prepare_features_batch(lats, lons, weather_data=weather, rng=rng)
+    for col in feature_columns:
+        if col in chunk.columns:
+            features[col] = chunk[col].to_numpy()
+    return features
+
+
+def score_chunk(chunk, seed, compact=False, cascade=False):
+    """Score one chunk in a worker process and return the output frame"""
+    feature_columns = _predictor.feature_columns
+    features = build_features(chunk, feature_columns, seed)
+
+    output = chunk[[col for col in chunk.columns if col not in feature_columns]].reset_index(drop=True)
+    max_probability = np.zeros(len(chunk))
+    for disaster_type in _disaster_types:
+        if cascade:
+            probs = _predictor.predict_batch_cascade(features, disaster_type)
+            output[f'{disaster_type}_early_exit'] = probs['early_exit']
+        else:
+            probs = _predictor.predict_batch(features, disaster_type)
+        levels = _predictor.get_risk_levels(probs['probability'])
+        output[f'{disaster_type}_probability'] = probs['probability'].astype(np.float32)
+        output[f'{disaster_type}_risk_level'] = levels
+        max_probability = np.maximum(max_probability, probs['probability'])
+        if not compact:
+            for model_key in MODEL_KEYS:
+                output[f'{disaster_type}_{model_key}'] = probs[model_key].astype(np.float32)
+
+    # Risk bands are monotonic in probability, so the overall band is the
+    # band of the highest hazard probability
+    output['overall_risk'] = _predictor.get_risk_levels(max_probability)
+    return output
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process and of its finished/running children"""
+    # ru_maxrss is reported in KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return own, children
+
+
+def run(input_path, output_path, model_dir='models', disaster_types=None, chunk_size=50000,
+        workers=None, seed=42, compact=False, cascade=False):
+    """Score input_path into output_path, returning a summary dict"""
+    disaster_types = disaster_types or DISASTER_TYPES
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+
+    writer = None
+    schema = None
+    total_rows = 0
+    early_exits = {}
+    start = time.perf_counter()
+
+    def write(frame):
+        nonlocal writer, schema, total_rows
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if writer is None:
+            schema = table.schema
+            writer = pq.ParquetWriter(output_path, schema, compression='zstd')
+        # Pass-through CSV columns are typed per chunk (an int column becomes
+        # float once a chunk has a blank), so every chunk takes the first's schema
+        writer.write_table(table.select(schema.names).cast(schema))
+        total_rows += len(frame)
+        for col in frame.columns:
+            if col.endswith('_early_exit'):
+                disaster_type = col[:-len('_early_exit')]
+                early_exits[disaster_type] = early_exits.get(disaster_type, 0) + int(frame[col].sum())
+        elapsed = time.perf_counter() - start
+        print(f"   {total_rows:,} rows scored ({total_rows / elapsed:,.0f} rows/sec)", flush=True)
+
+    try:
+        if workers <= 1:
+            _init_worker(model_dir, disaster_types)
+            for index, chunk in enumerate(iter_chunks(input_path, chunk_size)):
+                write(score_chunk(chunk, seed + index, compact, cascade))
+        else:
+            # spawn keeps TensorFlow state out of the parent; in-flight chunks
+            # are bounded so memory does not grow with the input size
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                     initializer=_init_worker,
+                                     initargs=(model_dir, disaster_types)) as pool:
+                pending = []
+                for index, chunk in enumerate(iter_chunks(input_path, chunk_size)):
+                    pending.append(pool.submit(score_chunk, chunk, seed + index, compact, cascade))
+                    if len(pending) >= workers * 2:
+                        write(pending.pop(0).result())
+                for future in pending:
+                    write(future.result())
+    finally:
+        if writer is not None:
+            writer.close()
+
+    elapsed = time.perf_counter() - start
+    own_mb, children_mb = peak_memory_mb()
+    return {
+        'rows': total_rows,
+        'seconds': elapsed,
+        'rows_per_sec': total_rows / elapsed if elapsed > 0 else 0.0,
+        'peak_memory_mb': own_mb,
+        'peak_worker_memory_mb': children_mb,
+        'early_exit_fraction': {
+            dt: count / total_rows for dt, count in early_exits.items()
+        } if total_rows else {}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Score a CSV/Parquet file of locations or feature rows offline')
+    parser.add_argument('input', help='CSV or Parquet input file')
+    parser.add_argument('output', help='Parquet output file')
+    parser.add_argument('--models', default='models', help='Directory of trained models')
+    parser.add_argument('--disaster-types', nargs='+', default=DISASTER_TYPES,
+                        help='Disaster types to score')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='Rows per chunk')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: CPU count, 1 = in-process)')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='Seed for the mock weather/feature path')
+    parser.add_argument('--compact', action='store_true',
+                        help='Omit per-model probability columns')
+    parser.add_argument('--cascade', action='store_true',
+                        help='Score with the cheap model first and escalate only near band boundaries')
+    args = parser.parse_args()
+
+    print("\n" + "="*70)
+    print(" "*20 + "GUARDIAN EARTH BULK SCORING")
+    print("="*70)
+    print(f"Input:  {args.input}")
+    print(f"Output: {args.output}\n")
+
+    summary = run(args.input, args.output, model_dir=args.models,
+                  disaster_types=args.disaster_types, chunk_size=args.chunk_size,
+                  workers=args.workers, seed=args.seed, compact=args.compact,
+                  cascade=args.cascade)
+
+    print("\n" + "="*70)
+    print(f"Rows scored:        {summary['rows']:,}")
+    print(f"Elapsed:            {summary['seconds']:.1f}s")
+    print(f"Throughput:         {summary['rows_per_sec']:,.0f} rows/sec")
+    print(f"Peak memory:        {summary['peak_memory_mb']:.0f} MB (coordinator)")
+    print(f"Peak worker memory: {summary['peak_worker_memory_mb']:.0f} MB (largest worker)")
+    for disaster_type, fraction in summary['early_exit_fraction'].items():
+        print(f"Early exits ({disaster_type}): {fraction:.1%}")
+    print("="*70 + "\n")
+
+
+if __name__ == "__main__":
+    main()
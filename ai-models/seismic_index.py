@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+Spatiotemporal index over a local earthquake catalog
+
+Events live in flat arrays sorted by a composite (grid cell, time) key, so the
+events of any 1° cell inside a time window are one contiguous slice found by
+binary search. A "within R km and T days" query searches the neighbouring
+cells for all query points at once, expands the slices into
+(query, event) candidate pairs and keeps those within the exact haversine
+radius. New events go to a small pending buffer that queries scan directly.
+A full buffer becomes a new sorted run; runs are searched side by side and
+the newest is merged into the one before it only once it has grown to a
+fraction of that run's size, so run sizes grow geometrically, there are
+O(log n) of them and each event is copied O(log n) times, never a full-catalog
+copy per buffer.
+
+Events posted at runtime can also be appended to a journal file, which is
+replayed when the catalog is loaded again.
+
+The catalog can be imported from USGS-style CSV or QuakeML and is used for
+seismic_activity_7d, seismic_activity_30d and historical_earthquake_count.
+
+    python seismic_index.py --benchmark --events 3000000
+"""
+
+import argparse
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.195
+DAY_SECONDS = 86400.0
+
+# Composite sort key: cell * TIME_SPAN + (timestamp - TIME_ORIGIN). Exact to
+# well under a second in float64 for cells of 0.5° and larger.
+TIME_ORIGIN = -8520336000.0  # 1700-01-01
+TIME_SPAN = float(2 ** 34)   # ~544 years
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km (broadcasts over arrays)"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class _SortedRun:
+    """Events sorted by composite key"""
+
+    __slots__ = ('sort_keys', 'times', 'lats', 'lons', 'mags')
+
+    def __init__(self, sort_keys, times, lats, lons, mags):
+        self.sort_keys = sort_keys
+        self.times = times
+        self.lats = lats
+        self.lons = lons
+        self.mags = mags
+
+    def __len__(self):
+        return len(self.sort_keys)
+
+    @classmethod
+    def merge(cls, older, newer):
+        """One run from two (a stable sort of two sorted runs is a linear merge)"""
+        columns = [np.concatenate([getattr(older, name), getattr(newer, name)]) for name in cls.__slots__]
+        order = np.argsort(columns[0], kind='stable')
+        return cls(*(column[order] for column in columns))
+
+
+class EarthquakeCatalogIndex:
+    """Earthquake events indexed by grid cell and time"""
+
+    def __init__(self, cell_degrees=1.0, feature_radius_km=100.0, historical_years=10,
+                 historical_min_magnitude=4.0, max_pending=1024, merge_factor=4):
+        self.cell_degrees = cell_degrees
+        self.feature_radius_km = feature_radius_km
+        self.historical_years = historical_years
+        self.historical_min_magnitude = historical_min_magnitude
+        self.max_pending = max_pending
+        self.merge_factor = merge_factor
+        self.n_rows = int(round(180 / cell_degrees))
+        self.n_cols = int(round(360 / cell_degrees))
+
+        # Sorted runs, oldest and largest first
+        self.runs = []
+        self.pending = []
+        self.n_pending = 0
+        self.start_time = None
+        self.journal_path = None
+        self._lock = threading.RLock()
+
+    @property
+    def n_events(self):
+        return sum(len(run) for run in self.runs) + self.n_pending
+
+    def _cells(self, lats, lons):
+        rows = np.floor((np.asarray(lats, dtype=np.float64) + 90) / self.cell_degrees).astype(np.int64)
+        rows = np.clip(rows, 0, self.n_rows - 1)
+        cols = np.floor((np.asarray(lons, dtype=np.float64) + 180) / self.cell_degrees).astype(np.int64) % self.n_cols
+        return rows, cols
+
+    def add_events(self, times, lats, lons, mags):
+        """Append events (epoch seconds, degrees, magnitude) without rebuilding"""
+        times = np.asarray(times, dtype=np.float64)
+        if not len(times):
+            return 0
+        events = (times,
+                  np.asarray(lats, dtype=np.float32),
+                  np.asarray(lons, dtype=np.float32),
+                  np.asarray(mags, dtype=np.float32))
+        with self._lock:
+            self.pending.append(events)
+            self.n_pending += len(times)
+
+            first = float(times.min())
+            self.start_time = first if self.start_time is None else min(self.start_time, first)
+            if self.n_pending >= self.max_pending:
+                self.compact()
+        return len(times)
+
+    def add_event(self, timestamp, lat, lon, magnitude):
+        """Append a single event"""
+        return self.add_events([timestamp], [lat], [lon], [magnitude])
+
+    def open_journal(self, path):
+        """Replay events journaled at path and journal those passed to record_events"""
+        with self._lock:
+            if os.path.exists(path):
+                records = np.fromfile(path, dtype=np.float64)
+                # A crash mid-write can leave a partial last record
+                records = records[:len(records) // 4 * 4].reshape(-1, 4)
+                self.add_events(records[:, 0], records[:, 1], records[:, 2], records[:, 3])
+            self.journal_path = path
+        return self
+
+    def record_events(self, times, lats, lons, mags):
+        """add_events, also appending the events to the journal if one is open"""
+        with self._lock:
+            added = self.add_events(times, lats, lons, mags)
+            if added and self.journal_path is not None:
+                records = np.column_stack([np.asarray(column, dtype=np.float64)
+                                           for column in (times, lats, lons, mags)])
+                with open(self.journal_path, 'ab') as f:
+                    f.write(records.tobytes())
+        return added
+
+    def _pending_arrays(self):
+        return tuple(np.concatenate(column) for column in zip(*self.pending))
+
+    def compact(self, full=False):
+        """Turn pending events into a sorted run; full=True also merges all runs into one"""
+        with self._lock:
+            if self.pending:
+                self._add_run(*self._pending_arrays())
+                self.pending = []
+                self.n_pending = 0
+            while full and len(self.runs) > 1:
+                newer = self.runs.pop()
+                self.runs[-1] = _SortedRun.merge(self.runs[-1], newer)
+
+    def _add_run(self, times, lats, lons, mags):
+        """Sort events into a new run, then merge runs that are no longer geometrically smaller"""
+        rows, cols = self._cells(lats, lons)
+        keys = (rows * self.n_cols + cols) * TIME_SPAN + (np.maximum(times, TIME_ORIGIN) - TIME_ORIGIN)
+        order = np.argsort(keys, kind='stable')
+        self.runs.append(_SortedRun(keys[order], times[order], lats[order], lons[order], mags[order]))
+        while len(self.runs) > 1 and len(self.runs[-1]) * self.merge_factor >= len(self.runs[-2]):
+            newer = self.runs.pop()
+            self.runs[-1] = _SortedRun.merge(self.runs[-1], newer)
+
+    def _candidate_pairs(self, run, lats, lons, radius_km, start_time, end_time):
+        """(query index, event index) pairs whose event cell and time can match"""
+        rows, cols = self._cells(lats, lons)
+        lat_cells = int(np.ceil(radius_km / KM_PER_DEGREE / self.cell_degrees))
+        edge_lat = np.minimum(np.abs(lats) + lat_cells * self.cell_degrees, 89.9)
+        lon_cells = np.ceil(radius_km / (KM_PER_DEGREE * np.cos(np.radians(edge_lat))) /
+                            self.cell_degrees).astype(np.int64)
+        lon_cells = np.minimum(lon_cells, self.n_cols // 2)
+
+        max_lon_cells = int(lon_cells.max())
+        if 2 * max_lon_cells + 1 > self.n_cols:
+            # Whole latitude band: visit every column exactly once
+            col_offsets = np.arange(self.n_cols) - self.n_cols // 2
+        else:
+            col_offsets = np.arange(-max_lon_cells, max_lon_cells + 1)
+        row_offsets = np.arange(-lat_cells, lat_cells + 1)
+        row_offsets, col_offsets = (a.ravel() for a in np.meshgrid(row_offsets, col_offsets))
+
+        neighbour_rows = rows[:, None] + row_offsets[None, :]
+        valid = ((neighbour_rows >= 0) & (neighbour_rows < self.n_rows) &
+                 (np.abs(col_offsets)[None, :] <= lon_cells[:, None]))
+        cells = neighbour_rows * self.n_cols + (cols[:, None] + col_offsets[None, :]) % self.n_cols
+
+        query_index = np.nonzero(valid)[0]
+        cells = cells[valid].astype(np.float64) * TIME_SPAN
+        lo = np.searchsorted(run.sort_keys, cells + (max(start_time, TIME_ORIGIN) - TIME_ORIGIN), side='left')
+        hi = np.searchsorted(run.sort_keys, cells + (end_time - TIME_ORIGIN), side='right')
+
+        lengths = hi - lo
+        total = int(lengths.sum())
+        pair_queries = np.repeat(query_index, lengths)
+        offsets = np.repeat(lo - (np.cumsum(lengths) - lengths), lengths)
+        return pair_queries, offsets + np.arange(total)
+
+    def _count(self, lats, lons, radius_km, start_time, end_time, min_magnitude):
+        with self._lock:
+            return self._count_locked(lats, lons, radius_km, start_time, end_time, min_magnitude)
+
+    def _count_locked(self, lats, lons, radius_km, start_time, end_time, min_magnitude):
+        counts = np.zeros(len(lats), dtype=np.int64)
+        for run in self.runs:
+            queries, events = self._candidate_pairs(run, lats, lons, radius_km, start_time, end_time)
+            hit = haversine_km(lats[queries], lons[queries],
+                               run.lats[events].astype(np.float64),
+                               run.lons[events].astype(np.float64)) <= radius_km
+            if min_magnitude is not None:
+                hit &= run.mags[events] >= min_magnitude
+            counts += np.bincount(queries[hit], minlength=len(lats))
+
+        if self.pending:
+            times, event_lats, event_lons, mags = self._pending_arrays()
+            keep = (times >= start_time) & (times <= end_time)
+            if min_magnitude is not None:
+                keep &= mags >= min_magnitude
+            if keep.any():
+                distances = haversine_km(lats[:, None], lons[:, None],
+                                         event_lats[keep][None, :].astype(np.float64),
+                                         event_lons[keep][None, :].astype(np.float64))
+                counts += np.count_nonzero(distances <= radius_km, axis=1)
+        return counts
+
+    def count(self, lat, lon, radius_km, days, now=None, min_magnitude=None):
+        """Number of events within radius_km and the last `days` of `now`"""
+        end_time = (now or datetime.now()).timestamp()
+        return int(self._count(np.array([lat], dtype=np.float64), np.array([lon], dtype=np.float64),
+                               radius_km, end_time - days * DAY_SECONDS, end_time, min_magnitude)[0])
+
+    def count_batch(self, lats, lons, radius_km, days, now=None, min_magnitude=None, chunk=2048):
+        """Vectorized count for many query points sharing one time window"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        counts = np.zeros(len(lats), dtype=np.int64)
+        if not len(lats) or not self.n_events:
+            return counts
+
+        # Large batches amortize sorting the buffer; small ones just scan it
+        if len(lats) > chunk // 8:
+            self.compact()
+        end_time = (now or datetime.now()).timestamp()
+        start_time = end_time - days * DAY_SECONDS
+        for i in range(0, len(lats), chunk):
+            counts[i:i + chunk] = self._count(lats[i:i + chunk], lons[i:i + chunk], radius_km,
+                                              start_time, end_time, min_magnitude)
+        return counts
+
+    def _covers(self, days, now):
+        return self.start_time is not None and self.start_time <= now.timestamp() - days * DAY_SECONDS
+
+    def features_batch(self, lats, lons, now=None):
+        """Seismic features for many locations; NaN where the catalog is too short"""
+        now = now or datetime.now()
+        n = len(np.atleast_1d(lats))
+        windows = {
+            'seismic_activity_7d': (7, None),
+            'seismic_activity_30d': (30, None),
+            'historical_earthquake_count': (self.historical_years * 365, self.historical_min_magnitude)
+        }
+        result = {}
+        for name, (days, min_magnitude) in windows.items():
+            if self._covers(days, now):
+                result[name] = self.count_batch(lats, lons, self.feature_radius_km, days,
+                                                now, min_magnitude).astype(np.float64)
+            else:
+                result[name] = np.full(n, np.nan)
+        return result
+
+    def features(self, lat, lon, now=None):
+        """Seismic features for one location (only those the catalog covers)"""
+        now = now or datetime.now()
+        result = {}
+        if self._covers(7, now):
+            result['seismic_activity_7d'] = self.count(lat, lon, self.feature_radius_km, 7, now)
+        if self._covers(30, now):
+            result['seismic_activity_30d'] = self.count(lat, lon, self.feature_radius_km, 30, now)
+        if self._covers(self.historical_years * 365, now):
+            result['historical_earthquake_count'] = self.count(
+                lat, lon, self.feature_radius_km, self.historical_years * 365, now,
+                self.historical_min_magnitude)
+        return result
+
+    def load_csv(self, path, chunk_size=500000):
+        """Import a USGS-style CSV (time, latitude, longitude, mag columns)"""
+        added = 0
+        for chunk in pd.read_csv(path, usecols=['time', 'latitude', 'longitude', 'mag'],
+                                 chunksize=chunk_size):
+            chunk = chunk.dropna()
+            times = pd.to_datetime(chunk['time'], utc=True).astype('int64') / 1e9
+            added += self.add_events(times.to_numpy(), chunk['latitude'].to_numpy(),
+                                     chunk['longitude'].to_numpy(), chunk['mag'].to_numpy())
+        return added
+
+    def load_quakeml(self, path):
+        """Import a QuakeML document (preferred or first origin and magnitude)"""
+        def local(tag):
+            return tag.rsplit('}', 1)[-1]
+
+        def value(element, *path):
+            for name in path:
+                element = next((child for child in element if local(child.tag) == name), None)
+                if element is None:
+                    return None
+            return element.text
+
+        times, lats, lons, mags = [], [], [], []
+        for _, element in ET.iterparse(path, events=('end',)):
+            if local(element.tag) != 'event':
+                continue
+            origin = next((child for child in element if local(child.tag) == 'origin'), None)
+            magnitude = next((child for child in element if local(child.tag) == 'magnitude'), None)
+            if origin is not None and magnitude is not None:
+                timestamp = value(origin, 'time', 'value')
+                lat = value(origin, 'latitude', 'value')
+                lon = value(origin, 'longitude', 'value')
+                mag = value(magnitude, 'mag', 'value')
+                if None not in (timestamp, lat, lon, mag):
+                    times.append(pd.Timestamp(timestamp).timestamp())
+                    lats.append(float(lat))
+                    lons.append(float(lon))
+                    mags.append(float(mag))
+            element.clear()
+        return self.add_events(times, lats, lons, mags)
+
+    def save(self, path):
+        """Persist all events as a compressed .npz"""
+        with self._lock:
+            self.compact(full=True)
+            run = self.runs[0] if self.runs else _SortedRun(*(np.empty(0),) * 5)
+            np.savez_compressed(path, times=run.times, lats=run.lats, lons=run.lons, mags=run.mags)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Build an index (a single sorted run) from a .npz, CSV or QuakeML catalog"""
+        index = cls(**kwargs)
+        if path.endswith('.npz'):
+            with np.load(path) as data:
+                index.add_events(data['times'], data['lats'], data['lons'], data['mags'])
+        elif path.endswith('.xml') or path.endswith('.quakeml'):
+            index.load_quakeml(path)
+        else:
+            index.load_csv(path)
+        index.compact(full=True)
+        return index
+
+
+def synthetic_catalog(n_events, years=10, seed=42):
+    """Events clustered around random fault zones, for benchmarking"""
+    rng = np.random.default_rng(seed)
+    n_zones = 2000
+    zone_lats = rng.uniform(-60, 70, n_zones)
+    zone_lons = rng.uniform(-180, 180, n_zones)
+    zone = rng.integers(0, n_zones, n_events)
+    lats = np.clip(zone_lats[zone] + rng.normal(0, 1.0, n_events), -89.9, 89.9)
+    lons = (zone_lons[zone] + rng.normal(0, 1.0, n_events) + 180) % 360 - 180
+    end = time.time()
+    times = np.sort(rng.uniform(end - years * 365 * DAY_SECONDS, end, n_events))
+    mags = np.round(rng.exponential(0.8, n_events) + 2.0, 1)
+    return times, lats, lons, mags, zone_lats, zone_lons
+
+
+def benchmark(n_events, n_queries):
+    times, lats, lons, mags, zone_lats, zone_lons = synthetic_catalog(n_events)
+
+    index = EarthquakeCatalogIndex()
+    start = time.perf_counter()
+    index.add_events(times, lats, lons, mags)
+    index.compact()
+    build_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(7)
+    pick = rng.integers(0, len(zone_lats), n_queries)
+    query_lats = zone_lats[pick] + rng.normal(0, 1.0, n_queries)
+    query_lons = zone_lons[pick] + rng.normal(0, 1.0, n_queries)
+
+    # Exact check against a brute-force scan for a few points
+    for lat, lon in zip(query_lats[:5], query_lons[:5]):
+        recent = times >= time.time() - 30 * DAY_SECONDS
+        expected = int(np.count_nonzero(haversine_km(lat, lon, lats[recent], lons[recent]) <= 100))
+        assert abs(index.count(lat, lon, 100, 30) - expected) <= 1, 'index disagrees with brute force'
+
+    latencies = []
+    for lat, lon in zip(query_lats[:2000], query_lons[:2000]):
+        start = time.perf_counter()
+        index.count(lat, lon, 100, 30)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+
+    batch = {}
+    for days in (30, 3650):
+        start = time.perf_counter()
+        index.count_batch(query_lats, query_lons, 100, days)
+        batch[days] = time.perf_counter() - start
+
+    new_times, new_lats, new_lons, new_mags = synthetic_catalog(5000, years=0.01, seed=9)[:4]
+    start = time.perf_counter()
+    for event in zip(new_times, new_lats, new_lons, new_mags):
+        index.add_event(*event)
+    append_seconds = time.perf_counter() - start
+
+    print(f"Events indexed:        {index.n_events:,}")
+    print(f"Build time:            {build_seconds:.2f}s")
+    print(f"Single query (100km/30d): p50 {np.percentile(latencies, 50):.3f} ms, "
+          f"p99 {np.percentile(latencies, 99):.3f} ms")
+    for days, seconds in batch.items():
+        print(f"Batch query ({days}d):    {n_queries:,} points in {seconds * 1000:.0f} ms "
+              f"({seconds / n_queries * 1e6:.1f} us/point)")
+    print(f"Streaming ingest:      {len(new_times) / append_seconds:,.0f} events/sec "
+          f"(pending buffer sorted every {index.max_pending:,}, {len(index.runs)} runs)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Earthquake catalog index tools')
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--events', type=int, default=3000000)
+    parser.add_argument('--queries', type=int, default=10000)
+    parser.add_argument('--convert', nargs=2, metavar=('CATALOG', 'NPZ'),
+                        help='Import a CSV/QuakeML catalog and save it as .npz')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.events, args.queries)
+    elif args.convert:
+        index = EarthquakeCatalogIndex.load(args.convert[0])
+        index.save(args.convert[1])
+        print(f"✅ {index.n_events:,} events saved to {args.convert[1]}")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Memory-mapped training matrices shared across worker processes
+
+The parent writes each array once as a .npy file; workers receive only the
+small handle dict and open the arrays with mmap_mode='r', so every process
+reads the same page-cached copy instead of unpickling its own.
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# Arrays opened in this process, keyed by path
+_open_arrays = {}
+
+
+class SharedDataset:
+    """Named arrays written to a temporary directory for memory-mapped access"""
+
+    def __init__(self, arrays, directory=None, dtype=np.float32):
+        self.directory = directory or tempfile.mkdtemp(prefix='guardian-shared-')
+        self._owns_directory = directory is None
+        self.paths = {}
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            if np.issubdtype(array.dtype, np.floating):
+                array = array.astype(dtype, copy=False)
+            path = os.path.join(self.directory, f'{name}.npy')
+            np.save(path, np.ascontiguousarray(array))
+            self.paths[name] = path
+
+    @property
+    def handle(self):
+        """Picklable description of the dataset for worker processes"""
+        return dict(self.paths)
+
+    def nbytes(self):
+        return sum(os.path.getsize(path) for path in self.paths.values())
+
+    def cleanup(self):
+        for path in self.paths.values():
+            _open_arrays.pop(path, None)
+        if self._owns_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+
+
+def open_shared(handle):
+    """Open (once per process) the memory-mapped arrays described by a handle"""
+    arrays = {}
+    for name, path in handle.items():
+        if path not in _open_arrays:
+            _open_arrays[path] = np.load(path, mmap_mode='r')
+        arrays[name] = _open_arrays[path]
+    return arrays
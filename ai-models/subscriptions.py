@@ -0,0 +1,683 @@
+#!/usr/bin/env python3
+"""
+Geofenced alert subscriptions matched against batched predictions
+
+A subscription is a circle (centre and radius) or a GeoJSON polygon, the
+hazards it follows and the lowest risk level it wants to hear about. The
+subscriptions live in flat arrays, and a grid index maps every cell a
+subscription's bounding box touches to that subscription: sorted cell keys
+with CSR offsets, so the candidates of any point are one slice found by
+binary search. Matching a batch looks up the cells of all points at once,
+expands the slices into (point, subscription) candidate pairs, drops pairs
+whose hazard or level does not qualify and runs the exact haversine or
+point-in-polygon test only on the rest.
+
+New subscriptions go to a small pending grid that is rebuilt on its own and
+merged into the main index once it fills up; removals are tombstoned until
+then. With a database path the subscriptions are persisted in SQLite.
+
+    python subscriptions.py --benchmark --subscriptions 1000000
+"""
+
+import argparse
+import json
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from seismic_index import haversine_km, KM_PER_DEGREE
+
+# Same bands as advanced_disaster_predictor.RISK_LEVELS (not imported, to keep
+# TensorFlow out of this module)
+RISK_LEVELS = ['low', 'medium', 'high', 'critical']
+LEVEL_INDEX = {level: i for i, level in enumerate(RISK_LEVELS)}
+HAZARDS = ['flood', 'cyclone', 'earthquake', 'landslide', 'wildfire']
+HAZARD_BITS = {hazard: 1 << i for i, hazard in enumerate(HAZARDS)}
+ALL_HAZARDS = (1 << len(HAZARDS)) - 1
+
+CIRCLE, POLYGON = 0, 1
+DEFAULT_RADIUS_KM = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id TEXT PRIMARY KEY,
+    document TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Per-subscription columns; edges are stored separately per polygon
+COLUMNS = {
+    'kind': np.uint8, 'lat': np.float64, 'lon': np.float64, 'radius_km': np.float32,
+    'south': np.float64, 'north': np.float64, 'west': np.float64, 'east': np.float64,
+    'hazards': np.uint8, 'min_level': np.int8, 'active': bool,
+    'edge_start': np.int64, 'edge_end': np.int64
+}
+EDGE_COLUMNS = ('lat1', 'lon1', 'lat2', 'lon2')
+
+
+def _empty_columns():
+    columns = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+    edges = {name: np.empty(0, dtype=np.float64) for name in EDGE_COLUMNS}
+    return columns, edges
+
+
+def _polygon_rings(geometry):
+    """Rings of a GeoJSON Polygon or MultiPolygon as (lat, lon) arrays"""
+    polygons = geometry['coordinates']
+    if geometry['type'] == 'Polygon':
+        polygons = [polygons]
+    rings = []
+    for polygon in polygons:
+        for ring in polygon:
+            ring = np.asarray(ring, dtype=np.float64)
+            if len(ring) < 3:
+                raise ValueError('Polygon rings need at least 3 positions')
+            rings.append((ring[:, 1], ring[:, 0]))
+    return rings
+
+
+def parse_subscription(document):
+    """Subscription document -> (id, column values, rings)
+
+    Circles are given as latitude/longitude/radius_km or a GeoJSON Point
+    geometry with radius_km; areas as a GeoJSON Polygon or MultiPolygon
+    geometry. Holes are honoured (even-odd rule).
+    """
+    if 'id' not in document:
+        raise ValueError('Every subscription needs an id')
+    hazards = document.get('hazards') or HAZARDS
+    unknown = [hazard for hazard in hazards if hazard not in HAZARD_BITS]
+    if unknown:
+        raise ValueError(f'Unknown hazards: {", ".join(unknown)}')
+    min_level = document.get('min_level', 'high')
+    if min_level not in LEVEL_INDEX:
+        raise ValueError(f'min_level must be one of {", ".join(RISK_LEVELS)}')
+
+    values = {
+        'hazards': sum(HAZARD_BITS[hazard] for hazard in set(hazards)),
+        'min_level': LEVEL_INDEX[min_level], 'active': True,
+        'radius_km': 0.0, 'edge_start': -1, 'edge_end': -1
+    }
+    geometry = document.get('geometry')
+    rings = []
+    if geometry is not None and geometry.get('type') in ('Polygon', 'MultiPolygon'):
+        rings = _polygon_rings(geometry)
+        lats = np.concatenate([ring[0] for ring in rings])
+        lons = np.concatenate([ring[1] for ring in rings])
+        # Polygons spanning more than 180° of longitude are taken to cross the
+        # antimeridian and are unwrapped to continuous longitudes
+        if lons.max() - lons.min() > 180:
+            rings = [(ring_lats, np.where(ring_lons < 0, ring_lons + 360, ring_lons))
+                     for ring_lats, ring_lons in rings]
+            lons = np.where(lons < 0, lons + 360, lons)
+        values.update(kind=POLYGON, lat=float(lats.mean()), lon=float(lons.mean()),
+                      south=float(lats.min()), north=float(lats.max()),
+                      west=float(lons.min()), east=float(lons.max()))
+    else:
+        if geometry is not None:
+            if geometry.get('type') != 'Point':
+                raise ValueError('geometry must be a GeoJSON Point, Polygon or MultiPolygon')
+            lon, lat = geometry['coordinates'][:2]
+        else:
+            lat, lon = document['latitude'], document['longitude']
+        radius = float(document.get('radius_km', DEFAULT_RADIUS_KM))
+        if radius <= 0:
+            raise ValueError('radius_km must be positive')
+        values.update(kind=CIRCLE, lat=float(lat), lon=float(lon), radius_km=radius,
+                      **_circle_bounds(float(lat), float(lon), radius))
+    return str(document['id']), values, rings
+
+
+def _circle_bounds(lat, lon, radius_km):
+    dlat = radius_km / KM_PER_DEGREE
+    south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    cos_lat = math.cos(math.radians(max(abs(south), abs(north))))
+    dlon = dlat / cos_lat if cos_lat > 1e-9 else 360.0
+    if dlon >= 180:
+        return {'south': south, 'north': north, 'west': -180.0, 'east': 180.0}
+    return {'south': south, 'north': north, 'west': lon - dlon, 'east': lon + dlon}
+
+
+def _build_columns(parsed, edge_offset=0):
+    """Parsed subscriptions -> column arrays and edge arrays"""
+    records = []
+    edge_parts = {name: [] for name in EDGE_COLUMNS}
+    n_edges = edge_offset
+    for _, values, rings in parsed:
+        if rings:
+            values = dict(values, edge_start=n_edges)
+            for lats, lons in rings:
+                # Close the ring; each vertex pairs with the next
+                if lats[0] != lats[-1] or lons[0] != lons[-1]:
+                    lats, lons = np.append(lats, lats[0]), np.append(lons, lons[0])
+                edge_parts['lat1'].append(lats[:-1])
+                edge_parts['lon1'].append(lons[:-1])
+                edge_parts['lat2'].append(lats[1:])
+                edge_parts['lon2'].append(lons[1:])
+                n_edges += len(lats) - 1
+            values['edge_end'] = n_edges
+        records.append(values)
+    columns = {name: np.array([values[name] for values in records], dtype=dtype)
+               for name, dtype in COLUMNS.items()}
+    edges = {name: np.concatenate(parts) if parts else np.empty(0, dtype=np.float64)
+             for name, parts in edge_parts.items()}
+    return columns, edges
+
+
+def levels_from_results(results):
+    """/predict/batch results -> (lats, lons, levels, probabilities, previous)
+
+    A prediction may carry "previous_risk_level" to match only rises.
+    """
+    lats = np.array([result['location']['latitude'] for result in results], dtype=np.float64)
+    lons = np.array([result['location']['longitude'] for result in results], dtype=np.float64)
+    levels, probabilities, previous = {}, {}, {}
+    for hazard in HAZARDS:
+        predictions = [result.get('predictions', {}).get(hazard) for result in results]
+        if not any(predictions):
+            continue
+        levels[hazard] = np.array([LEVEL_INDEX.get(p['risk_level'], -1) if p else -1
+                                   for p in predictions], dtype=np.int8)
+        probabilities[hazard] = np.array([p.get('probability', np.nan) if p else np.nan
+                                          for p in predictions], dtype=np.float64)
+        if any(p and 'previous_risk_level' in p for p in predictions):
+            previous[hazard] = np.array([LEVEL_INDEX.get(p.get('previous_risk_level'), -1) if p else -1
+                                         for p in predictions], dtype=np.int8)
+    return lats, lons, levels, probabilities, previous
+
+
+def levels_from_columns(columns):
+    """Columnar sweep output (score_locations.py) -> the same arrays
+
+    Uses <hazard>_risk_level, <hazard>_probability and optionally
+    <hazard>_previous_risk_level columns.
+    """
+    def level_codes(values):
+        return pd.Series(values, dtype=object).map(LEVEL_INDEX).fillna(-1).to_numpy(dtype=np.int8)
+
+    lats = np.asarray(columns['latitude'], dtype=np.float64)
+    lons = np.asarray(columns['longitude'], dtype=np.float64)
+    levels, probabilities, previous = {}, {}, {}
+    for hazard in HAZARDS:
+        if f'{hazard}_risk_level' not in columns:
+            continue
+        levels[hazard] = level_codes(columns[f'{hazard}_risk_level'])
+        probabilities[hazard] = np.asarray(columns.get(f'{hazard}_probability', np.full(len(lats), np.nan)),
+                                           dtype=np.float64)
+        if f'{hazard}_previous_risk_level' in columns:
+            previous[hazard] = level_codes(columns[f'{hazard}_previous_risk_level'])
+    return lats, lons, levels, probabilities, previous
+
+
+class SubscriptionIndex:
+    """Circle and polygon subscriptions indexed by grid cell"""
+
+    def __init__(self, db_path=None, cell_degrees=0.5, max_pending=4096):
+        self.db_path = db_path
+        self.cell_degrees = cell_degrees
+        self.max_pending = max_pending
+        self.n_rows = int(round(180 / cell_degrees))
+        self.n_cols = int(round(360 / cell_degrees))
+
+        # Main set (indexed) and pending set (small grid rebuilt on change)
+        self.columns, self.edges = _empty_columns()
+        self.ids = np.empty(0, dtype=object)
+        self.grid = self._build_grid(self.columns)
+        self.pending = []
+        self._pending_set = None
+        self.positions = {}  # id -> ('main' | 'pending', index)
+        self.n_removed = 0
+        self._lock = threading.RLock()
+
+        self.conn = None
+        if db_path:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+            self.conn.executescript(SCHEMA)
+            self._load()
+
+    @property
+    def n_subscriptions(self):
+        return len(self.positions)
+
+    def _load(self):
+        parsed = [parse_subscription(json.loads(document))
+                  for (document,) in self.conn.execute('SELECT document FROM subscriptions')]
+        with self._lock:
+            self._replace_main(parsed)
+
+    def _cells(self, lats, lons):
+        rows = np.floor((np.asarray(lats, dtype=np.float64) + 90) / self.cell_degrees).astype(np.int64)
+        rows = np.clip(rows, 0, self.n_rows - 1)
+        cols = np.floor((np.asarray(lons, dtype=np.float64) + 180) / self.cell_degrees).astype(np.int64) % self.n_cols
+        return rows, cols
+
+    def _build_grid(self, columns):
+        """Cell -> subscriptions CSR over every cell a bounding box touches"""
+        cd = self.cell_degrees
+        active = np.flatnonzero(columns['active'])
+        row0, _ = self._cells(columns['south'][active], 0)
+        row1, _ = self._cells(columns['north'][active], 0)
+        col0 = np.floor((columns['west'][active] + 180) / cd).astype(np.int64)
+        col1 = np.floor((columns['east'][active] + 180) / cd).astype(np.int64)
+        n_cols = np.minimum(col1 - col0 + 1, self.n_cols)
+        counts = (row1 - row0 + 1) * n_cols
+
+        # Expand each subscription into its cells (repeat/arange, no Python loop)
+        subs = np.repeat(active, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        n_cols = np.repeat(n_cols, counts)
+        rows = np.repeat(row0, counts) + offsets // n_cols
+        cols = (np.repeat(col0, counts) + offsets % n_cols) % self.n_cols
+        keys = rows * self.n_cols + cols
+
+        order = np.argsort(keys, kind='stable')
+        keys, subs = keys[order], subs[order].astype(np.int32)
+        cell_keys, starts = np.unique(keys, return_index=True)
+        return {'keys': cell_keys, 'starts': np.append(starts, len(keys)), 'subs': subs}
+
+    def _replace_main(self, parsed):
+        self.columns, self.edges = _build_columns(parsed)
+        self.ids = np.array([subscription_id for subscription_id, _, _ in parsed], dtype=object)
+        self.grid = self._build_grid(self.columns)
+        self.pending = []
+        self._pending_set = None
+        self.positions = {subscription_id: ('main', i) for i, subscription_id in enumerate(self.ids)}
+        self.n_removed = 0
+
+    def _pending(self):
+        """Column arrays and grid of the pending subscriptions"""
+        if self._pending_set is None:
+            columns, edges = _build_columns(self.pending)
+            for i, (subscription_id, _, _) in enumerate(self.pending):
+                columns['active'][i] = self.positions.get(subscription_id) == ('pending', i)
+            ids = np.array([subscription_id for subscription_id, _, _ in self.pending], dtype=object)
+            self._pending_set = (columns, edges, self._build_grid(columns), ids)
+        return self._pending_set
+
+    def add_subscriptions(self, documents):
+        """Add or replace subscriptions; returns how many were stored"""
+        parsed = [parse_subscription(document) for document in documents]
+        if not parsed:
+            return 0
+        with self._lock:
+            for subscription_id, _, _ in parsed:
+                self._remove_locked(subscription_id)
+            for record in parsed:
+                self.positions[record[0]] = ('pending', len(self.pending))
+                self.pending.append(record)
+            self._pending_set = None
+            if self.conn is not None:
+                now = time.time()
+                with self.conn:
+                    self.conn.executemany(
+                        'INSERT OR REPLACE INTO subscriptions (id, document, updated_at) VALUES (?, ?, ?)',
+                        [(str(document['id']), json.dumps(document), now) for document in documents])
+            if len(self.pending) >= self.max_pending:
+                self.compact()
+        return len(parsed)
+
+    def _remove_locked(self, subscription_id):
+        position = self.positions.pop(subscription_id, None)
+        if position is None:
+            return False
+        where, i = position
+        if where == 'main':
+            self.columns['active'][i] = False
+            self.n_removed += 1
+        else:
+            self._pending_set = None
+        return True
+
+    def remove_subscriptions(self, subscription_ids):
+        """Remove subscriptions by id; returns how many existed"""
+        with self._lock:
+            removed = sum(self._remove_locked(str(subscription_id)) for subscription_id in subscription_ids)
+            if self.conn is not None:
+                with self.conn:
+                    self.conn.executemany('DELETE FROM subscriptions WHERE id = ?',
+                                          [(str(subscription_id),) for subscription_id in subscription_ids])
+            # Tombstoned cells still cost candidate pairs; rebuild past a quarter
+            if self.n_removed > max(len(self.ids) // 4, self.max_pending):
+                self.compact()
+        return removed
+
+    def compact(self):
+        """Merge pending subscriptions into the main index and drop removed ones"""
+        with self._lock:
+            keep = np.flatnonzero(self.columns['active'])
+            columns = {name: values[keep] for name, values in self.columns.items()}
+            edges = self.edges
+            if len(keep) < len(self.ids):
+                # Drop the edges of removed polygons and renumber the rest
+                polygons = columns['edge_start'] >= 0
+                counts = np.where(polygons, columns['edge_end'] - columns['edge_start'], 0)
+                starts = np.repeat(columns['edge_start'], counts)
+                within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                edges = {name: values[starts + within] for name, values in self.edges.items()}
+                new_start = np.cumsum(counts) - counts
+                columns['edge_start'] = np.where(polygons, new_start, -1)
+                columns['edge_end'] = np.where(polygons, new_start + counts, -1)
+            ids = self.ids[keep]
+
+            pending = [record for i, record in enumerate(self.pending)
+                       if self.positions.get(record[0]) == ('pending', i)]
+            if pending:
+                added, added_edges = _build_columns(pending, edge_offset=len(edges['lat1']))
+                columns = {name: np.concatenate([columns[name], added[name]]) for name in COLUMNS}
+                edges = {name: np.concatenate([edges[name], added_edges[name]]) for name in EDGE_COLUMNS}
+                ids = np.concatenate([ids, np.array([record[0] for record in pending], dtype=object)])
+
+            self.columns, self.edges, self.ids = columns, edges, ids
+            self.grid = self._build_grid(columns)
+            self.pending = []
+            self._pending_set = None
+            self.positions = {subscription_id: ('main', i) for i, subscription_id in enumerate(ids)}
+            self.n_removed = 0
+
+    def _match_set(self, columns, edges, grid, lats, lons, effective):
+        """(point, subscription, hazard mask) pairs of one subscription set"""
+        none = (np.empty(0, dtype=np.int64),) * 2 + (np.empty((0, len(HAZARDS)), dtype=bool),)
+        if not len(grid['keys']) or not len(lats):
+            return none
+        rows, cols = self._cells(lats, lons)
+        keys = rows * self.n_cols + cols
+        slots = np.minimum(np.searchsorted(grid['keys'], keys), len(grid['keys']) - 1)
+        hit = grid['keys'][slots] == keys
+        counts = np.where(hit, grid['starts'][slots + 1] - grid['starts'][slots], 0)
+        if not counts.sum():
+            return none
+
+        points = np.repeat(np.arange(len(lats)), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        subs = grid['subs'][np.repeat(grid['starts'][slots], counts) + within].astype(np.int64)
+
+        # Cheap filters first: qualifying[point, level] holds the bits of the
+        # hazards at or above that level, so a pair qualifies when that mask
+        # at the subscription's min_level shares a bit with its hazards
+        bits = (1 << np.arange(len(HAZARDS))).astype(np.uint8)
+        qualifying = np.stack([((effective >= level) * bits).sum(axis=1).astype(np.uint8)
+                               for level in range(len(RISK_LEVELS))], axis=1)
+        masks = qualifying[points, columns['min_level'][subs]] & columns['hazards'][subs]
+        keep = (masks != 0) & columns['active'][subs]
+        points, subs, masks = points[keep], subs[keep], masks[keep]
+        inside = np.zeros(len(subs), dtype=bool)
+        circles = columns['kind'][subs] == CIRCLE
+        c = np.flatnonzero(circles)
+        inside[c] = haversine_km(lats[points[c]], lons[points[c]],
+                                 columns['lat'][subs[c]], columns['lon'][subs[c]]) <= columns['radius_km'][subs[c]]
+
+        p = np.flatnonzero(~circles)
+        if len(p):
+            inside[p] = self._in_polygons(columns, edges, lats[points[p]], lons[points[p]], subs[p])
+        return points[inside], subs[inside], (masks[inside, None] & bits) != 0
+
+    @staticmethod
+    def _in_polygons(columns, edges, lats, lons, subs):
+        """Even-odd ray casting of each point against its polygon's edges"""
+        west = columns['west'][subs]
+        lons = np.where(lons < west, lons + 360, lons)
+        starts = columns['edge_start'][subs]
+        counts = columns['edge_end'][subs] - starts
+        pair = np.repeat(np.arange(len(subs)), counts)
+        e = np.repeat(starts, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        y, x = lats[pair], lons[pair]
+        y1, x1, y2, x2 = edges['lat1'][e], edges['lon1'][e], edges['lat2'][e], edges['lon2'][e]
+        straddles = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crosses = straddles & (x < (x2 - x1) * (y - y1) / (y2 - y1) + x1)
+        return np.bincount(pair, weights=crosses, minlength=len(subs)).astype(np.int64) % 2 == 1
+
+    def match_arrays(self, lats, lons, levels, previous=None):
+        """Vectorized match of points against all subscriptions
+
+        levels (and optionally previous) map hazard -> level indexes per point
+        (-1 for none). With previous only rises count: a level matches when it
+        is above the previous level. Returns (hazard index, point index,
+        subscription id) arrays.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        previous = previous or {}
+        effective = np.full((len(lats), len(HAZARDS)), -1, dtype=np.int8)
+        for h, hazard in enumerate(HAZARDS):
+            if hazard not in levels:
+                continue
+            level = np.asarray(levels[hazard], dtype=np.int8)
+            if hazard in previous:
+                level = np.where(level > np.asarray(previous[hazard], dtype=np.int8), level, -1)
+            effective[:, h] = level
+        # Only points with some hazard at a notifiable level are looked up
+        candidates = np.flatnonzero(effective.max(axis=1) >= 0)
+
+        with self._lock:
+            sets = [(self.columns, self.edges, self.grid, self.ids)]
+            if self.pending:
+                sets.append(self._pending())
+            hazard_parts, point_parts, id_parts = [], [], []
+            for columns, edges, grid, ids in sets:
+                points, subs, qualifies = self._match_set(columns, edges, grid, lats[candidates],
+                                                          lons[candidates], effective[candidates])
+                pair, hazard = np.nonzero(qualifies)
+                hazard_parts.append(hazard)
+                point_parts.append(candidates[points[pair]])
+                id_parts.append(ids[subs[pair]])
+        return np.concatenate(hazard_parts), np.concatenate(point_parts), np.concatenate(id_parts)
+
+    def match(self, lats, lons, levels, probabilities=None, previous=None):
+        """Matches grouped per hazard and level, one entry per subscriber
+
+        {hazard: {level: {'subscription_ids', 'max_probability', 'locations'}}}
+        as parallel lists; locations are lists of indexes into the input points.
+        """
+        hazards, points, ids = self.match_arrays(lats, lons, levels, previous)
+        probabilities = probabilities or {}
+        matches = {}
+        for h, hazard in enumerate(HAZARDS):
+            selected = hazards == h
+            if not selected.any():
+                continue
+            h_points, h_ids = points[selected], ids[selected]
+            h_levels = np.asarray(levels[hazard], dtype=np.int8)[h_points]
+            h_probs = np.asarray(probabilities.get(hazard, np.full(len(lats), np.nan)), dtype=np.float64)[h_points]
+            id_codes, id_values = pd.factorize(h_ids)
+            order = np.lexsort((h_points, id_codes, -h_levels))
+            h_points, id_codes, h_levels, h_probs = h_points[order], id_codes[order], h_levels[order], h_probs[order]
+            starts = np.flatnonzero(np.r_[True, (np.diff(h_levels) != 0) | (np.diff(id_codes) != 0)])
+            ends = np.append(starts[1:], len(order))
+            # NaN (no probability given) propagates through the group maximum
+            group_max = np.maximum.reduceat(h_probs, starts)
+            locations = h_points.tolist()
+            group_levels = h_levels[starts]
+            by_level = {}
+            for level in np.unique(group_levels)[::-1]:
+                groups = np.flatnonzero(group_levels == level)
+                group_probabilities = group_max[groups].tolist()
+                by_level[RISK_LEVELS[level]] = {
+                    'subscription_ids': id_values[id_codes[starts[groups]]].tolist(),
+                    'max_probability': [None if math.isnan(p) else p for p in group_probabilities],
+                    'locations': [locations[start:end] for start, end in
+                                  zip(starts[groups].tolist(), ends[groups].tolist())]
+                }
+            matches[hazard] = by_level
+        return matches
+
+    def get_stats(self):
+        with self._lock:
+            main_pairs = len(self.grid['subs'])
+            polygons = int(np.sum((self.columns['kind'] == POLYGON) & self.columns['active']))
+            if self.pending:
+                columns = self._pending()[0]
+                polygons += int(np.sum((columns['kind'] == POLYGON) & columns['active']))
+            return {
+                'subscriptions': self.n_subscriptions,
+                'indexed': len(self.ids) - self.n_removed,
+                'pending': len(self.pending),
+                'tombstoned': self.n_removed,
+                'polygons': polygons,
+                'grid_cells': len(self.grid['keys']),
+                'cells_per_subscription': round(main_pairs / max(len(self.ids), 1), 2),
+                'cell_degrees': self.cell_degrees
+            }
+
+    def close(self):
+        with self._lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+def synthetic_subscriptions(n, polygon_share=0.1, seed=42):
+    """Subscription documents clustered around synthetic population centres"""
+    rng = np.random.default_rng(seed)
+    centres = np.column_stack([rng.uniform(-40, 60, 500), rng.uniform(-120, 150, 500)])
+    picks = centres[rng.integers(len(centres), size=n)]
+    lats = np.clip(picks[:, 0] + rng.normal(0, 1.5, n), -85, 85)
+    lons = (picks[:, 1] + rng.normal(0, 1.5, n) + 180) % 360 - 180
+    radii = rng.uniform(2, 50, n)
+    polygons = rng.random(n) < polygon_share
+    masks = rng.integers(1, ALL_HAZARDS + 1, size=n)
+    min_levels = rng.choice(len(RISK_LEVELS), size=n, p=[0.1, 0.3, 0.4, 0.2])
+
+    documents = []
+    for i in range(n):
+        document = {
+            'id': f'sub-{i}',
+            'hazards': [hazard for hazard, bit in HAZARD_BITS.items() if masks[i] & bit],
+            'min_level': RISK_LEVELS[min_levels[i]]
+        }
+        if polygons[i]:
+            angles = np.sort(rng.uniform(0, 2 * np.pi, 6))
+            size = radii[i] / KM_PER_DEGREE
+            ring = [[float(lons[i] + size * np.cos(a)), float(lats[i] + size * np.sin(a))] for a in angles]
+            document['geometry'] = {'type': 'Polygon', 'coordinates': [ring + [ring[0]]]}
+        else:
+            document.update(latitude=float(lats[i]), longitude=float(lons[i]), radius_km=float(radii[i]))
+        documents.append(document)
+    return documents
+
+
+def brute_force_count(documents, lats, lons, levels):
+    """Matches found by checking every subscription against every point"""
+    total = 0
+    for document in documents:
+        subscription_id, values, rings = parse_subscription(document)
+        if values['kind'] == CIRCLE:
+            inside = haversine_km(lats, lons, values['lat'], values['lon']) <= values['radius_km']
+        else:
+            single = SubscriptionIndex()
+            single.add_subscriptions([document])
+            columns, edges, _, _ = single._pending()
+            inside = SubscriptionIndex._in_polygons(columns, edges, lats, lons, np.zeros(len(lats), dtype=np.int64))
+        for hazard, bit in HAZARD_BITS.items():
+            if values['hazards'] & bit:
+                total += int(np.sum(inside & (levels[hazard] >= values['min_level'])))
+    return total
+
+
+def benchmark(n_subscriptions, n_points, cell_degrees, verify=200):
+    db_path = os.path.join(tempfile.mkdtemp(prefix='guardian-subscriptions-'), 'subscriptions.sqlite')
+    documents = synthetic_subscriptions(n_subscriptions)
+
+    index = SubscriptionIndex(cell_degrees=cell_degrees)
+    start = time.perf_counter()
+    index.add_subscriptions(documents)
+    index.compact()
+    load_seconds = time.perf_counter() - start
+
+    # Grid sweep over the populated band with a random risk surface
+    rng = np.random.default_rng(7)
+    side = int(np.sqrt(n_points))
+    grid_lats, grid_lons = np.meshgrid(np.linspace(-40, 60, side), np.linspace(-120, 150, side))
+    lats, lons = grid_lats.ravel(), grid_lons.ravel()
+    probabilities = {hazard: rng.beta(1, 4, len(lats)) for hazard in HAZARDS}
+    levels = {hazard: np.searchsorted([0.2, 0.5, 0.8], prob, side='right').astype(np.int8)
+              for hazard, prob in probabilities.items()}
+
+    index.match_arrays(lats[:1000], lons[:1000], {h: l[:1000] for h, l in levels.items()})
+    start = time.perf_counter()
+    hazards, points, ids = index.match_arrays(lats, lons, levels)
+    match_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    grouped = index.match(lats, lons, levels, probabilities)
+    grouped_seconds = time.perf_counter() - start
+
+    # Incremental adds go to the pending grid
+    extra = synthetic_subscriptions(1000, seed=9)
+    for document in extra:
+        document['id'] = 'new-' + document['id']
+    start = time.perf_counter()
+    for document in extra[:100]:
+        index.add_subscriptions([document])
+    add_ms = (time.perf_counter() - start) / 100 * 1000
+    start = time.perf_counter()
+    index.match_arrays(lats, lons, levels)
+    pending_seconds = time.perf_counter() - start
+
+    # Spot-check against a scan of a sample of subscriptions
+    sample = documents[:verify]
+    sample_ids = {document['id'] for document in sample}
+    indexed = int(sum(1 for subscription_id in ids if subscription_id in sample_ids))
+    scanned = brute_force_count(sample, lats, lons, levels)
+
+    persisted = SubscriptionIndex(db_path, cell_degrees=cell_degrees)
+    start = time.perf_counter()
+    persisted.add_subscriptions(documents[:100000])
+    persist_seconds = time.perf_counter() - start
+    persisted.close()
+    start = time.perf_counter()
+    reloaded = SubscriptionIndex(db_path, cell_degrees=cell_degrees)
+    reload_seconds = time.perf_counter() - start
+    reloaded.close()
+
+    stats = index.get_stats()
+    n_groups = sum(len(entries['subscription_ids']) for by_level in grouped.values() for entries in by_level.values())
+    print(f"Subscriptions:        {n_subscriptions:,} ({stats['polygons']:,} polygons) "
+          f"loaded and indexed in {load_seconds:.2f}s")
+    print(f"Grid:                 {stats['grid_cells']:,} cells of {cell_degrees}°, "
+          f"{stats['cells_per_subscription']} cells per subscription")
+    print(f"Match:                {len(lats):,} points -> {len(ids):,} (hazard, point, subscriber) "
+          f"matches in {match_seconds * 1000:.0f} ms ({len(lats) / match_seconds:,.0f} points/s)")
+    print(f"Grouped response:     {n_groups:,} subscriber/level groups in {grouped_seconds * 1000:.0f} ms")
+    print(f"Incremental add:      {add_ms:.2f} ms per subscription; "
+          f"match with {len(index.pending)} pending: {pending_seconds * 1000:.0f} ms")
+    print(f"SQLite:               100,000 stored in {persist_seconds:.2f}s, reloaded in {reload_seconds:.2f}s")
+    status = '✅' if indexed == scanned else '⚠️ '
+    print(f"{status} Brute-force check:   {verify} subscriptions, {scanned:,} scanned vs {indexed:,} indexed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Geofenced alert subscription index')
+    parser.add_argument('--db', default='data/subscriptions.sqlite')
+    parser.add_argument('--import', dest='dump', help='JSON file with a list of subscription documents')
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--subscriptions', type=int, default=1000000)
+    parser.add_argument('--points', type=int, default=250000)
+    parser.add_argument('--cell-degrees', type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.subscriptions, args.points, args.cell_degrees)
+    elif args.dump:
+        os.makedirs(os.path.dirname(args.db) or '.', exist_ok=True)
+        with open(args.dump) as f:
+            documents = json.load(f)
+        index = SubscriptionIndex(args.db, cell_degrees=args.cell_degrees)
+        added = index.add_subscriptions(documents)
+        index.compact()
+        stats = index.get_stats()
+        print(f"✅ Imported {added:,} subscriptions into {args.db}: "
+              f"{stats['subscriptions']:,} total, {stats['grid_cells']:,} cells")
+        index.close()
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
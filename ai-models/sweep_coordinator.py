@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+"""
+Sharded grid sweeps over a pool of local and remote scoring workers
+
+A bounding box (or a CSV/Parquet location file) is cut into fixed-size shards
+and dispatched to workers: local processes running score_locations.score_chunk,
+and prediction_server.py instances reached over HTTP (/predict/batch with Arrow
+responses). Every worker starts with a contiguous block of shards and steals
+from the tail of the longest remaining queue when its own runs out. Failed
+shards are retried on any worker and a worker that keeps failing is retired.
+Once nothing is queued, idle workers re-run shards that have been running much
+longer than the median shard, and the first copy to finish wins. Results are
+written to one Parquet file in shard order, followed by per-shard timing and
+per-worker throughput.
+
+Weather and synthetic features are a function of (seed, location) on every
+worker: local processes and servers both use the per-location deterministic
+weather streams. Every worker scores with the plain global ensemble (no
+cascade, no regional models), and the sweep refuses to start unless all of
+them report the same model fingerprints, so a shard scores the same whichever
+worker runs it.
+
+    python sweep_coordinator.py --bbox 5 60 35 100 --step 0.05 --local 4 scores.parquet
+    python sweep_coordinator.py --input locations.csv --server http://10.0.0.5:8000 \\
+        --server http://10.0.0.6:8000 scores.parquet
+    python sweep_coordinator.py --bbox 5 60 35 100 --spawn-servers 2 scores.parquet
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+
+from features import WEATHER_KEYS
+from score_locations import DISASTER_TYPES, MODEL_KEYS, iter_chunks, _init_worker, model_fingerprints, score_chunk
+
+
+class GridShards:
+    """Row-major grid over a bounding box, cut into shards of shard_size points"""
+
+    def __init__(self, south, west, north, east, step, shard_size):
+        self.lats = np.arange(south, north + step / 2, step)
+        self.lons = np.arange(west, east + step / 2, step)
+        self.n_points = len(self.lats) * len(self.lons)
+        self.shard_size = shard_size
+
+    def __len__(self):
+        return -(-self.n_points // self.shard_size)
+
+    def chunk(self, shard):
+        index = np.arange(shard * self.shard_size, min((shard + 1) * self.shard_size, self.n_points))
+        return pd.DataFrame({'latitude': self.lats[index // len(self.lons)],
+                             'longitude': self.lons[index % len(self.lons)]})
+
+
+class FileShards:
+    """A CSV/Parquet location file held in memory and cut into row ranges"""
+
+    def __init__(self, path, shard_size):
+        self.frame = pd.concat(iter_chunks(path, 1 << 20), ignore_index=True)
+        self.n_points = len(self.frame)
+        self.shard_size = shard_size
+
+    def __len__(self):
+        return -(-self.n_points // self.shard_size)
+
+    def chunk(self, shard):
+        return self.frame.iloc[shard * self.shard_size:(shard + 1) * self.shard_size].reset_index(drop=True)
+
+
+class LocalWorker:
+    """One spawned scoring process (models loaded once)"""
+
+    def __init__(self, name, model_dir, disaster_types, seed=42, compact=False, timeout=300.0):
+        self.name = name
+        self.model_dir = model_dir
+        self.disaster_types = disaster_types
+        self.seed = seed
+        self.compact = compact
+        self.timeout = timeout
+        self.pool = None
+        self.fingerprints = None
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        self.pool = ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker,
+                                        initargs=(self.model_dir, self.disaster_types, self.seed))
+        # Load the models now rather than inside the first shard's timing
+        self._warm = self.pool.submit(os.getpid)
+        return self
+
+    def ready(self):
+        self._warm.result()
+        self.fingerprints = self.pool.submit(model_fingerprints).result()
+
+    def score(self, shard, chunk):
+        # seed=None: per-location weather from the seed given to _init_worker
+        future = self.pool.submit(score_chunk, chunk, None, self.compact)
+        try:
+            return future.result(timeout=self.timeout)
+        except (BrokenProcessPool, FutureTimeoutError):
+            # The process died (OOM, crash) or hung; start a fresh one for later shards
+            self._stop()
+            self.start()
+            raise
+
+    def _stop(self):
+        # shutdown() does not interrupt a running task, so end the process too
+        processes = list((self.pool._processes or {}).values())
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def close(self):
+        if self.pool is not None:
+            self._stop()
+
+
+class HttpWorker:
+    """A prediction_server.py instance scored through /predict/batch"""
+
+    def __init__(self, name, base_url, disaster_types, seed=42, compact=False, timeout=300.0):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.disaster_types = disaster_types
+        self.seed = seed
+        self.compact = compact
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.fingerprints = None
+
+    def start(self):
+        response = self.session.get(f'{self.base_url}/health', timeout=self.timeout)
+        response.raise_for_status()
+        health = response.json()
+        if health.get('weather_seed') != self.seed:
+            raise RuntimeError(f"{self.base_url} runs with DETERMINISTIC_WEATHER_SEED={health.get('weather_seed')}, "
+                               f"the sweep needs {self.seed}")
+        if health.get('regional_models'):
+            raise RuntimeError(f"{self.base_url} routes to {health['regional_models']} regional models; "
+                               f"the sweep scores with the global models only")
+        fingerprints = health.get('model_fingerprints', {})
+        self.fingerprints = {dt: fingerprints[dt] for dt in self.disaster_types if dt in fingerprints}
+        return self
+
+    def ready(self):
+        pass
+
+    def score(self, shard, chunk):
+        sent = ['latitude', 'longitude'] + [key for key in WEATHER_KEYS if key in chunk.columns]
+        response = self.session.post(
+            f'{self.base_url}/predict/batch', params={'format': 'arrow'}, timeout=self.timeout,
+            json={'locations': chunk[sent].to_dict('records'), 'disaster_types': self.disaster_types,
+                  'compact': self.compact, 'cascade': False})
+        response.raise_for_status()
+        scored = pa.ipc.open_stream(io.BytesIO(response.content)).read_all().to_pandas()
+
+        # Same layout as score_chunk: input columns, then per hazard the
+        # probability, band and model columns, then the overall band
+        output = chunk[[col for col in chunk.columns if col not in WEATHER_KEYS]].reset_index(drop=True)
+        for disaster_type in self.disaster_types:
+            if f'{disaster_type}_probability' not in scored:
+                continue
+            output[f'{disaster_type}_probability'] = scored[f'{disaster_type}_probability'].astype(np.float32)
+            output[f'{disaster_type}_risk_level'] = scored[f'{disaster_type}_risk_level'].astype(str).to_numpy()
+            if not self.compact:
+                for model_key in MODEL_KEYS:
+                    output[f'{disaster_type}_{model_key}'] = scored[f'{disaster_type}_{model_key}'].astype(np.float32)
+        output['overall_risk'] = scored['overall_risk'].astype(str).to_numpy()
+        return output
+
+    def close(self):
+        self.session.close()
+
+
+def check_same_models(workers):
+    """Raise unless every worker reports the same model fingerprints"""
+    reference = workers[0]
+    for worker in workers[1:]:
+        if worker.fingerprints != reference.fingerprints:
+            raise RuntimeError(f'{worker.name} has different models from {reference.name}: '
+                               f'{worker.fingerprints} vs {reference.fingerprints}')
+
+
+def spawn_servers(count, base_port, env=None):
+    """Start prediction_server.py instances on localhost as stand-in nodes"""
+    processes, urls = [], []
+    here = os.path.dirname(os.path.abspath(__file__))
+    for i in range(count):
+        port = base_port + i
+        process_env = dict(os.environ, **(env or {}), PREDICTION_SERVER_PORT=str(port))
+        processes.append(subprocess.Popen([sys.executable, os.path.join(here, 'prediction_server.py')],
+                                          env=process_env, stdout=subprocess.DEVNULL,
+                                          stderr=subprocess.DEVNULL))
+        urls.append(f'http://127.0.0.1:{port}')
+
+    deadline = time.time() + 300
+    for process, url in zip(processes, urls):
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f'Server for {url} exited with code {process.returncode}')
+            try:
+                requests.get(f'{url}/health', timeout=2).raise_for_status()
+                break
+            except requests.RequestException:
+                if time.time() > deadline:
+                    raise RuntimeError(f'Server for {url} did not come up')
+                time.sleep(1)
+    return processes, urls
+
+
+class SweepCoordinator:
+    """Work-stealing shard scheduler with retries and speculative re-dispatch"""
+
+    def __init__(self, shards, workers, output_path, max_attempts=3, max_worker_failures=3,
+                 straggler_factor=3.0, min_straggler_seconds=5.0, fail_rate=0.0, verbose=True):
+        self.shards = shards
+        self.workers = workers
+        self.output_path = output_path
+        self.max_attempts = max_attempts
+        self.max_worker_failures = max_worker_failures
+        self.straggler_factor = straggler_factor
+        self.min_straggler_seconds = min_straggler_seconds
+        self.fail_rate = fail_rate
+        self.verbose = verbose
+
+        # Contiguous blocks per worker keep neighbouring shards together
+        n_shards = len(shards)
+        bounds = np.linspace(0, n_shards, len(workers) + 1).astype(int)
+        self.queues = {worker.name: deque(range(bounds[i], bounds[i + 1])) for i, worker in enumerate(workers)}
+        self.retries = deque()
+        self.running = {}  # shard -> {'started', 'workers'}
+        self.attempts = {}
+        self.done = {}
+        self.failures = {worker.name: 0 for worker in workers}
+        self.retired = set()
+        self.error = None
+
+        self.worker_stats = {worker.name: {'shards': 0, 'rows': 0, 'busy_seconds': 0.0, 'stolen': 0,
+                                           'failures': 0, 'speculative': 0, 'wasted': 0}
+                             for worker in workers}
+        self.shard_log = []
+        self.durations = []
+        self.n_speculative = 0
+        self.n_retries = 0
+
+        self._cond = threading.Condition()
+        self._buffer = {}
+        self._next_to_write = 0
+        self._writer = None
+        self._schema = None
+        self.rows_written = 0
+        self._rng = np.random.default_rng(0)
+
+    # -- scheduling ---------------------------------------------------------
+
+    def _next_shard(self, name):
+        """(shard, kind) for an idle worker, or None when it should wait"""
+        if self.retries:
+            return self.retries.popleft(), 'retry'
+        if self.queues[name]:
+            return self.queues[name].popleft(), 'own'
+        victim = max(self.queues, key=lambda other: len(self.queues[other]))
+        if self.queues[victim]:
+            return self.queues[victim].pop(), 'stolen'
+
+        # Nothing queued: duplicate the slowest straggler this worker is not on
+        if len(self.durations) >= 3:
+            limit = max(self.straggler_factor * float(np.median(self.durations)), self.min_straggler_seconds)
+            now = time.perf_counter()
+            stragglers = [(now - info['started'], shard) for shard, info in self.running.items()
+                          if name not in info['workers'] and len(info['workers']) < 2
+                          and now - info['started'] > limit]
+            if stragglers:
+                return max(stragglers)[1], 'speculative'
+        return None
+
+    def _finished(self):
+        return len(self.done) == len(self.shards) or self.error is not None
+
+    def _run_worker(self, worker):
+        name = worker.name
+        stats = self.worker_stats[name]
+        while True:
+            with self._cond:
+                while True:
+                    if self._finished() or name in self.retired:
+                        return
+                    picked = self._next_shard(name)
+                    if picked is not None:
+                        break
+                    self._cond.wait(timeout=0.5)
+                shard, kind = picked
+                self.attempts[shard] = self.attempts.get(shard, 0) + 1
+                info = self.running.setdefault(shard, {'started': time.perf_counter(), 'workers': set()})
+                info['workers'].add(name)
+                if kind == 'speculative':
+                    self.n_speculative += 1
+                    stats['speculative'] += 1
+                elif kind == 'stolen':
+                    stats['stolen'] += 1
+                elif kind == 'retry':
+                    self.n_retries += 1
+
+            start = time.perf_counter()
+            try:
+                if self.fail_rate and self._rng.random() < self.fail_rate:
+                    raise RuntimeError('injected failure')
+                result = worker.score(shard, self.shards.chunk(shard))
+                error = None
+            except Exception as e:
+                result, error = None, e
+            seconds = time.perf_counter() - start
+
+            with self._cond:
+                if self._finished():
+                    return  # the sweep is over; run() no longer waits for this thread
+                stats['busy_seconds'] += seconds
+                info = self.running.get(shard)
+                if info is not None:
+                    info['workers'].discard(name)
+                if error is not None:
+                    self._record_failure(worker, shard, error)
+                elif shard in self.done:
+                    stats['wasted'] += 1  # lost the race against a duplicate
+                else:
+                    self._record_success(name, shard, kind, seconds, result)
+                self._cond.notify_all()
+
+    def _record_failure(self, worker, shard, error):
+        name = worker.name
+        self.failures[name] += 1
+        self.worker_stats[name]['failures'] += 1
+        if self.verbose:
+            print(f"   ⚠️  shard {shard} failed on {name} (attempt {self.attempts[shard]}): {error}", flush=True)
+        if self.failures[name] >= self.max_worker_failures:
+            self.retired.add(name)
+            # Hand its queue to the others
+            self.retries.extend(self.queues[name])
+            self.queues[name].clear()
+            if self.verbose:
+                print(f"   ⚠️  retiring {name} after {self.failures[name]} consecutive failures", flush=True)
+            if len(self.retired) == len(self.workers):
+                self.error = RuntimeError('All workers failed')
+
+        if shard in self.done or self.running.get(shard, {}).get('workers'):
+            return  # another copy is still running or already finished
+        self.running.pop(shard, None)
+        if self.attempts[shard] >= self.max_attempts:
+            self.error = RuntimeError(f'Shard {shard} failed {self.attempts[shard]} times: {error}')
+        else:
+            self.retries.append(shard)
+
+    def _record_success(self, name, shard, kind, seconds, result):
+        self.failures[name] = 0
+        self.running.pop(shard, None)
+        self.done[shard] = name
+        self.durations.append(seconds)
+        stats = self.worker_stats[name]
+        stats['shards'] += 1
+        stats['rows'] += len(result)
+        self.shard_log.append({'shard': shard, 'worker': name, 'rows': len(result), 'seconds': seconds,
+                               'attempts': self.attempts[shard], 'kind': kind})
+        self._buffer[shard] = result
+        self._flush_in_order()
+
+    # -- output ---------------------------------------------------------------
+
+    def _flush_in_order(self):
+        """Write buffered shards that are next in shard order"""
+        while self._next_to_write in self._buffer:
+            frame = self._buffer.pop(self._next_to_write)
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._schema = table.schema
+                self._writer = pq.ParquetWriter(self.output_path, table.schema, compression='zstd')
+            self._writer.write_table(table.select(self._schema.names).cast(self._schema))
+            self.rows_written += len(frame)
+            self._next_to_write += 1
+            if self.verbose and (self._next_to_write % max(len(self.shards) // 20, 1) == 0
+                                 or self._next_to_write == len(self.shards)):
+                elapsed = time.perf_counter() - self._start
+                print(f"   {self._next_to_write}/{len(self.shards)} shards, {self.rows_written:,} rows "
+                      f"({self.rows_written / elapsed:,.0f} rows/sec)", flush=True)
+
+    def run(self):
+        """Score every shard and return the sweep report
+
+        Returns as soon as every shard is written (or the sweep has failed)
+        instead of joining the worker threads: a thread still stuck on a
+        duplicate or hung shard is a daemon and its late result is dropped.
+        """
+        self._start = time.perf_counter()
+        threads = [threading.Thread(target=self._run_worker, args=(worker,), daemon=True)
+                   for worker in self.workers]
+        try:
+            for thread in threads:
+                thread.start()
+            with self._cond:
+                while not self._finished() and any(thread.is_alive() for thread in threads):
+                    self._cond.wait(timeout=0.5)
+        finally:
+            with self._cond:
+                if self.error is None and not self._finished():
+                    self.error = RuntimeError('Sweep interrupted')
+                if self._writer is not None:
+                    self._writer.close()
+        if self.error is not None:
+            raise self.error
+        return self.report(time.perf_counter() - self._start)
+
+    def report(self, seconds):
+        durations = np.array(self.durations) if self.durations else np.zeros(1)
+        return {
+            'shards': len(self.shards),
+            'rows': self.rows_written,
+            'seconds': seconds,
+            'rows_per_sec': self.rows_written / seconds if seconds > 0 else 0.0,
+            'shard_seconds': {'p50': float(np.percentile(durations, 50)),
+                              'p90': float(np.percentile(durations, 90)),
+                              'max': float(durations.max())},
+            'retries': self.n_retries,
+            'speculative': self.n_speculative,
+            'retired_workers': sorted(self.retired),
+            'workers': {
+                name: dict(stats, rows_per_sec=stats['rows'] / stats['busy_seconds'] if stats['busy_seconds'] else 0.0)
+                for name, stats in self.worker_stats.items()
+            },
+            'shard_log': sorted(self.shard_log, key=lambda entry: entry['shard'])
+        }
+
+
+def print_report(report):
+    print("\n" + "="*70)
+    print(f"Shards:             {report['shards']:,} ({report['rows']:,} rows)")
+    print(f"Elapsed:            {report['seconds']:.1f}s")
+    print(f"Throughput:         {report['rows_per_sec']:,.0f} rows/sec")
+    shard_seconds = report['shard_seconds']
+    print(f"Shard time:         p50 {shard_seconds['p50']:.2f}s  p90 {shard_seconds['p90']:.2f}s  "
+          f"max {shard_seconds['max']:.2f}s")
+    print(f"Retries:            {report['retries']}   speculative copies: {report['speculative']}")
+    if report['retired_workers']:
+        print(f"Retired workers:    {', '.join(report['retired_workers'])}")
+    print(f"\n   {'worker':28s} {'shards':>7s} {'rows':>10s} {'busy':>8s} {'rows/s':>9s} "
+          f"{'stolen':>7s} {'failed':>7s} {'spec':>5s} {'wasted':>7s}")
+    for name, stats in report['workers'].items():
+        print(f"   {name:28s} {stats['shards']:7d} {stats['rows']:10,d} {stats['busy_seconds']:7.1f}s "
+              f"{stats['rows_per_sec']:9,.0f} {stats['stolen']:7d} {stats['failures']:7d} "
+              f"{stats['speculative']:5d} {stats['wasted']:7d}")
+    print("="*70 + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sharded grid sweep over local and remote scoring workers')
+    parser.add_argument('output', help='Parquet output file')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--bbox', nargs=4, type=float, metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'))
+    source.add_argument('--input', help='CSV or Parquet file of locations')
+    parser.add_argument('--step', type=float, default=0.1, help='Grid spacing in degrees for --bbox')
+    parser.add_argument('--shard-size', type=int, default=20000, help='Locations per shard')
+    parser.add_argument('--local', type=int, default=0, help='Local scoring processes')
+    parser.add_argument('--server', action='append', default=[], help='prediction_server base URL (repeatable)')
+    parser.add_argument('--spawn-servers', type=int, default=0,
+                        help='Start this many prediction_server.py instances on localhost')
+    parser.add_argument('--base-port', type=int, default=8100, help='First port for --spawn-servers')
+    parser.add_argument('--models', default='models', help='Directory of trained models (local workers)')
+    parser.add_argument('--disaster-types', nargs='+', default=DISASTER_TYPES)
+    parser.add_argument('--seed', type=int, default=42,
+                        help='Deterministic weather seed; --server instances must run with the same '
+                             'DETERMINISTIC_WEATHER_SEED')
+    parser.add_argument('--compact', action='store_true', help='Omit per-model probability columns')
+    parser.add_argument('--max-attempts', type=int, default=3, help='Attempts per shard before giving up')
+    parser.add_argument('--straggler-factor', type=float, default=3.0,
+                        help='Re-dispatch shards running longer than this multiple of the median')
+    parser.add_argument('--timeout', type=float, default=300.0,
+                        help='Seconds before a shard on any worker counts as failed')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Inject shard failures (for testing)')
+    parser.add_argument('--report', help='Write the per-shard and per-worker report as JSON')
+    args = parser.parse_args()
+
+    if args.bbox:
+        shards = GridShards(*args.bbox, step=args.step, shard_size=args.shard_size)
+    else:
+        shards = FileShards(args.input, args.shard_size)
+
+    server_processes = []
+    urls = list(args.server)
+    if args.spawn_servers:
+        print(f"Starting {args.spawn_servers} local prediction servers...")
+        server_processes, spawned = spawn_servers(args.spawn_servers, args.base_port,
+                                                  env={'DETERMINISTIC_WEATHER_SEED': str(args.seed)})
+        urls += spawned
+    local = args.local if args.local or urls else (os.cpu_count() or 1)
+
+    workers = [LocalWorker(f'local-{i}', args.models, args.disaster_types, args.seed, args.compact, args.timeout)
+               for i in range(local)]
+    workers += [HttpWorker(url, url, args.disaster_types, args.seed, args.compact, args.timeout) for url in urls]
+
+    print("\n" + "="*70)
+    print(" "*22 + "GUARDIAN EARTH GRID SWEEP")
+    print("="*70)
+    print(f"Locations: {shards.n_points:,} in {len(shards):,} shards of {args.shard_size:,}")
+    print(f"Workers:   {local} local, {len(urls)} HTTP")
+    print(f"Output:    {args.output}\n")
+
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.ready()
+        check_same_models(workers)
+        coordinator = SweepCoordinator(shards, workers, args.output, max_attempts=args.max_attempts,
+                                       straggler_factor=args.straggler_factor, fail_rate=args.fail_rate)
+        report = coordinator.run()
+    finally:
+        for worker in workers:
+            worker.close()
+        for process in server_processes:
+            process.terminate()
+
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Tests for the earthquake catalog index (run with pytest)"""
+
+from datetime import datetime
+
+import numpy as np
+
+from seismic_index import DAY_SECONDS, EarthquakeCatalogIndex, haversine_km, synthetic_catalog
+
+NOW = 1.7e9
+NOW_DATETIME = datetime.fromtimestamp(NOW)
+
+
+def brute_force(times, lats, lons, lat, lon, radius_km, days):
+    recent = (times >= NOW - days * DAY_SECONDS) & (times <= NOW)
+    return int(np.count_nonzero(haversine_km(lat, lon, lats[recent], lons[recent]) <= radius_km))
+
+
+def test_appended_runs_match_brute_force():
+    rng = np.random.default_rng(3)
+    n = 20000
+    times = NOW - rng.uniform(0, 60 * DAY_SECONDS, n)
+    lats = rng.uniform(-80, 80, n)
+    lons = rng.uniform(-180, 180, n)
+    mags = rng.uniform(2, 7, n)
+
+    index = EarthquakeCatalogIndex(max_pending=256)
+    for start in range(0, n, 100):
+        index.add_events(times[start:start + 100], lats[start:start + 100],
+                         lons[start:start + 100], mags[start:start + 100])
+    assert 1 < len(index.runs) <= 8
+    sizes = [len(run) for run in index.runs]
+    assert all(older > index.merge_factor * newer for older, newer in zip(sizes, sizes[1:]))
+    assert index.n_events == n
+
+    query_lats = rng.uniform(-80, 80, 200)
+    query_lons = rng.uniform(-180, 180, 200)
+    counts = index.count_batch(query_lats, query_lons, 500, 30, now=NOW_DATETIME)
+    expected = [brute_force(times, lats.astype(np.float32), lons.astype(np.float32), lat, lon, 500, 30)
+                for lat, lon in zip(query_lats, query_lons)]
+    assert counts.tolist() == expected
+
+    index.compact(full=True)
+    assert len(index.runs) == 1
+    assert index.count_batch(query_lats, query_lons, 500, 30, now=NOW_DATETIME).tolist() == expected
+
+
+def test_recorded_events_survive_a_restart(tmp_path):
+    times, lats, lons, mags = synthetic_catalog(1000, years=0.05, seed=1)[:4]
+    catalog = str(tmp_path / 'catalog.npz')
+    base = EarthquakeCatalogIndex()
+    base.add_events(times[:900], lats[:900], lons[:900], mags[:900])
+    base.save(catalog)
+
+    index = EarthquakeCatalogIndex.load(catalog).open_journal(catalog + '.journal')
+    index.record_events(times[900:], lats[900:], lons[900:], mags[900:])
+    assert index.n_events == 1000
+
+    reopened = EarthquakeCatalogIndex.load(catalog).open_journal(catalog + '.journal')
+    assert reopened.n_events == 1000
+    lat, lon = float(lats[950]), float(lons[950])
+    assert reopened.count(lat, lon, 200, 30) == index.count(lat, lon, 200, 30)
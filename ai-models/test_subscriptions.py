@@ -0,0 +1,127 @@
+"""Tests for the geofenced subscription index (run with pytest)"""
+
+import numpy as np
+
+from seismic_index import haversine_km
+from subscriptions import (HAZARDS, LEVEL_INDEX, RISK_LEVELS, SubscriptionIndex, _polygon_rings,
+                           synthetic_subscriptions)
+
+
+def in_rings(lats, lons, rings):
+    """Even-odd ray casting over every ring, unwrapping rings that cross the antimeridian"""
+    ring_lons = np.concatenate([ring[1] for ring in rings])
+    wraps = ring_lons.max() - ring_lons.min() > 180
+    if wraps:
+        lons = np.where(lons < 0, lons + 360, lons)
+    inside = np.zeros(len(lats), dtype=bool)
+    for ring_lats, ring_lons in rings:
+        if wraps:
+            ring_lons = np.where(ring_lons < 0, ring_lons + 360, ring_lons)
+        for i in range(len(ring_lats)):
+            y1, x1 = ring_lats[i - 1], ring_lons[i - 1]
+            y2, x2 = ring_lats[i], ring_lons[i]
+            if y1 == y2:
+                continue
+            inside ^= ((y1 > lats) != (y2 > lats)) & (lons < (x2 - x1) * (lats - y1) / (y2 - y1) + x1)
+    return inside
+
+
+def brute_force(documents, lats, lons, levels):
+    """(hazard, point, subscription id) matches from checking every pair"""
+    matches = set()
+    for document in documents:
+        hazards = document.get('hazards') or HAZARDS
+        min_level = LEVEL_INDEX[document.get('min_level', 'high')]
+        geometry = document.get('geometry')
+        if geometry is not None:
+            inside = in_rings(lats, lons, _polygon_rings(geometry))
+        else:
+            inside = haversine_km(lats, lons, document['latitude'], document['longitude']) <= document['radius_km']
+        for h, hazard in enumerate(HAZARDS):
+            if hazard in hazards:
+                for point in np.flatnonzero(inside & (levels[hazard] >= min_level)):
+                    matches.add((h, int(point), document['id']))
+    return matches
+
+
+def indexed(index, lats, lons, levels):
+    hazards, points, ids = index.match_arrays(lats, lons, levels)
+    found = list(zip(hazards.tolist(), points.tolist(), ids.tolist()))
+    assert len(found) == len(set(found))
+    return set(found)
+
+
+def antimeridian_subscriptions():
+    """Circles and polygons straddling 180°, including a hole and a MultiPolygon"""
+    every = {'hazards': HAZARDS, 'min_level': 'low'}
+    return [
+        dict(every, id='circle-east', latitude=-17.0, longitude=179.8, radius_km=120.0),
+        dict(every, id='circle-west', latitude=-16.5, longitude=-179.9, radius_km=80.0),
+        dict(every, id='circle-polar', latitude=88.0, longitude=179.0, radius_km=400.0),
+        dict(every, id='fiji', geometry={'type': 'Polygon', 'coordinates': [
+            [[176.0, -20.0], [-178.0, -20.0], [-177.0, -14.0], [177.0, -13.0], [176.0, -20.0]]]}),
+        dict(every, id='ring', geometry={'type': 'Polygon', 'coordinates': [
+            [[175.0, -25.0], [-175.0, -25.0], [-175.0, -15.0], [175.0, -15.0]],
+            [[179.0, -21.0], [-179.0, -21.0], [-179.0, -19.0], [179.0, -19.0]]]}),
+        dict(every, id='islands', geometry={'type': 'MultiPolygon', 'coordinates': [
+            [[[178.5, -18.5], [-179.5, -18.5], [-179.5, -17.5], [178.5, -17.5]]],
+            [[[-176.0, -22.0], [-174.0, -22.0], [-175.0, -20.0]]]]}),
+    ]
+
+
+def random_points(rng, n):
+    """Points spread around the antimeridian and over the synthetic population band"""
+    near = n // 2
+    lats = np.concatenate([rng.uniform(-27, -10, near), rng.uniform(-40, 60, n - near)])
+    lons = np.concatenate([(rng.uniform(170, 190, near) + 180) % 360 - 180, rng.uniform(-120, 150, n - near)])
+    lats[:20] = rng.uniform(85, 90, 20)
+    levels = {hazard: rng.integers(-1, len(RISK_LEVELS), n).astype(np.int8) for hazard in HAZARDS}
+    return lats, lons, levels
+
+
+def test_matches_brute_force_across_the_antimeridian():
+    rng = np.random.default_rng(11)
+    documents = antimeridian_subscriptions() + synthetic_subscriptions(300, polygon_share=0.3, seed=5)
+    lats, lons, levels = random_points(rng, 3000)
+
+    index = SubscriptionIndex(cell_degrees=0.5)
+    index.add_subscriptions(documents)
+    expected = brute_force(documents, lats, lons, levels)
+    assert {subscription_id for _, _, subscription_id in expected} >= {d['id'] for d in documents[:6]}
+
+    # Pending grid and main grid must agree
+    assert indexed(index, lats, lons, levels) == expected
+    index.compact()
+    assert indexed(index, lats, lons, levels) == expected
+
+
+def test_add_remove_and_compact_match_brute_force():
+    rng = np.random.default_rng(12)
+    documents = antimeridian_subscriptions() + synthetic_subscriptions(400, polygon_share=0.3, seed=6)
+    lats, lons, levels = random_points(rng, 2000)
+
+    index = SubscriptionIndex(cell_degrees=1.0, max_pending=64)
+    index.add_subscriptions(documents[:200])
+    index.compact()
+    # Small adds that overflow max_pending compact on their own
+    for start in range(200, len(documents), 25):
+        index.add_subscriptions(documents[start:start + 25])
+    assert 0 < len(index.pending) < index.max_pending
+
+    live = {document['id']: document for document in documents}
+    # Remove from the main index and from the pending set, replace one of each
+    removed = [document['id'] for document in documents[1:400:7]]
+    assert index.remove_subscriptions(removed + ['missing']) == len(removed)
+    for subscription_id in removed:
+        del live[subscription_id]
+    replacements = [dict(antimeridian_subscriptions()[3], id=documents[0]['id']),
+                    dict(antimeridian_subscriptions()[0], id=documents[-1]['id'])]
+    index.add_subscriptions(replacements)
+    live.update({document['id']: document for document in replacements})
+
+    assert index.n_subscriptions == len(live)
+    expected = brute_force(list(live.values()), lats, lons, levels)
+    assert indexed(index, lats, lons, levels) == expected
+    index.compact()
+    assert index.get_stats()['tombstoned'] == 0
+    assert indexed(index, lats, lons, levels) == expected
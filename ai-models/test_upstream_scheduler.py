@@ -0,0 +1,135 @@
+"""Tests for the upstream quota scheduler against the local API stub (run with pytest)"""
+
+import json
+import threading
+import time
+
+import pytest
+
+import upstream_scheduler
+from upstream_scheduler import FixedWindowQuota, UpstreamRateLimited, UpstreamScheduler, UpstreamTimeout
+from upstream_stub import create_app, serve_in_thread
+
+
+def blocked_scheduler(**kwargs):
+    """A concurrency-1 scheduler whose only slot is held until the returned event is set"""
+    scheduler = UpstreamScheduler(quotas=[(100, 1.0)], concurrency=1, **kwargs)
+    release = threading.Event()
+    started = threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+        return 'held'
+
+    handle = scheduler.submit('hold', hold, 'bulk')
+    assert started.wait(5)
+    return scheduler, release, handle
+
+
+def test_higher_priority_classes_go_first():
+    scheduler, release, _ = blocked_scheduler()
+    order = []
+    handles = [scheduler.submit(priority, lambda priority=priority: order.append(priority), priority)
+               for priority in ('bulk', 'scheduled', 'interactive')]
+    release.set()
+    for handle in handles:
+        scheduler.result(handle, timeout=5)
+    assert order == ['interactive', 'scheduled', 'bulk']
+
+
+def test_identical_keys_share_one_call():
+    scheduler, release, _ = blocked_scheduler()
+    calls = []
+    first = scheduler.submit(('weather', 1, 2), lambda: calls.append(1) or 'sunny', 'bulk')
+    second = scheduler.submit(('weather', 1, 2), lambda: calls.append(2) or 'rain', 'interactive')
+    release.set()
+    assert scheduler.result(first, timeout=5) == scheduler.result(second, timeout=5) == 'sunny'
+    assert calls == [1]
+    assert scheduler.get_stats()['classes']['interactive']['coalesced'] == 1
+
+
+def test_rate_limited_calls_are_requeued_after_retry_after():
+    app = create_app(rate=5.0, burst=2, latency_ms=1.0)
+    server, base_url = serve_in_thread(app)
+    upstream_scheduler.configure_upstream_scheduler(
+        UpstreamScheduler(quotas=[(20, 1.0)], concurrency=4, max_wait={'bulk': 30.0}, max_attempts=20))
+    try:
+        results = [None] * 8
+
+        def fetch(i):
+            results[i] = upstream_scheduler.request_json(
+                f'{base_url}/data/2.5/weather', {'lat': float(i), 'lon': 0.0, 'appid': 'test'}, priority='bulk')
+
+        threads = [threading.Thread(target=fetch, args=(i,)) for i in range(len(results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        stats = upstream_scheduler.scheduler.get_stats()
+    finally:
+        upstream_scheduler.configure_upstream_scheduler(None)
+        server.shutdown()
+
+    assert [result['coord']['lat'] for result in results] == [float(i) for i in range(len(results))]
+    assert app.config['quota'].throttled > 0
+    assert stats['rate_limited'] == app.config['quota'].throttled
+
+
+def test_caller_falls_back_when_no_quota_in_time():
+    scheduler = UpstreamScheduler(quotas=[(1, 60.0)], max_wait={'interactive': 0.2})
+    assert scheduler.call('first', lambda: 1) == 1
+    start = time.monotonic()
+    with pytest.raises(UpstreamTimeout):
+        scheduler.call('second', lambda: 2)
+    assert time.monotonic() - start < 1.0
+    assert scheduler.get_stats()['classes']['interactive']['timed_out'] == 1
+
+
+def test_rate_limited_call_after_the_deadline_does_not_hang():
+    scheduler = UpstreamScheduler(max_wait={'interactive': 0.2}, call_timeout=5.0)
+
+    def slow_then_limited():
+        time.sleep(0.5)
+        raise UpstreamRateLimited(0.1)
+
+    outcome = []
+
+    def call():
+        try:
+            scheduler.call('key', slow_then_limited)
+        except UpstreamTimeout as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=call, daemon=True)
+    thread.start()
+    thread.join(3)
+    assert not thread.is_alive()
+    assert len(outcome) == 1
+    assert scheduler.get_stats()['queued'] == 0
+
+
+def test_daily_window_persists_across_restarts(tmp_path, monkeypatch):
+    path = str(tmp_path / 'state' / 'quota.json')
+    scheduler = UpstreamScheduler(quotas=[FixedWindowQuota(3, path=path)], max_wait={'interactive': 0.2})
+    for i in range(3):
+        scheduler.call(i, lambda: 'ok')
+    with pytest.raises(UpstreamTimeout):
+        scheduler.call('over', lambda: 'ok')
+    with open(path) as f:
+        assert json.load(f)['used'] == 3
+
+    restarted = FixedWindowQuota(3, path=path)
+    assert restarted.tokens == 0
+    assert restarted.wait_time(0) > 0
+
+    # The next window starts with the full quota
+    now = time.time()
+    monkeypatch.setattr(upstream_scheduler.time, 'time', lambda: now + 86400)
+    restarted.refill(None)
+    assert restarted.tokens == 3
+    assert restarted.wait_time(0) == 0
+
+
+def test_unknown_usage_starts_the_window_spent():
+    assert FixedWindowQuota(100).tokens == 0
@@ -0,0 +1,60 @@
+"""Regression tests for the rolling-window weather store (run with pytest)"""
+
+import numpy as np
+
+from weather_store import WeatherTimeSeriesStore
+
+HOUR = 3600
+START = 480000  # an arbitrary hour number
+
+
+def observation(rainfall):
+    return {'rainfall_1h': rainfall, 'temperature': 25.0, 'pressure': 1013.0}
+
+
+def test_reopen_without_flush_keeps_slots_distinct(tmp_path):
+    store = WeatherTimeSeriesStore(str(tmp_path), capacity=16)
+    store.record(10, 10, observation(5.0), timestamp=START * HOUR)
+    del store  # no flush(): meta.json still says n_used = 0
+
+    store = WeatherTimeSeriesStore(str(tmp_path), capacity=16)
+    store.record(50, 50, observation(1.0), timestamp=START * HOUR)
+    first = store._slot_for(10, 10, create=False)
+    second = store._slot_for(50, 50, create=False)
+    assert first != second
+    assert store.rain_sums[first, 0] == 5.0
+    assert store.rain_sums[second, 0] == 1.0
+
+
+def test_rainfall_requires_every_hour_observed(tmp_path):
+    store = WeatherTimeSeriesStore(str(tmp_path), capacity=16)
+    now_hour = START + 23
+
+    # Every other hour observed: the 24h total would be understated
+    for hour in range(START, now_hour + 1, 2):
+        store.record(10, 10, observation(1.0), timestamp=hour * HOUR)
+    features = store.features_batch([10], [10], now=_at(now_hour))
+    assert np.isnan(features['rainfall_24h'][0])
+
+    for hour in range(START + 1, now_hour + 1, 2):
+        store.record(10, 10, observation(1.0), timestamp=hour * HOUR)
+    features = store.features_batch([10], [10], now=_at(now_hour))
+    assert features['rainfall_24h'][0] == 24.0
+    assert np.isnan(features['rainfall_7d'][0])
+
+    # A batch sweep for the next hour keeps the window complete; the oldest
+    # hour slides out
+    store.record_batch(np.array([10.0]), np.array([10.0]), {
+        'rainfall_1h': np.array([3.0]), 'temperature': np.array([25.0]), 'pressure': np.array([1013.0])
+    }, timestamp=(now_hour + 1) * HOUR)
+    features = store.features_batch([10], [10], now=_at(now_hour + 1))
+    assert features['rainfall_24h'][0] == 26.0
+
+    # A skipped hour makes it incomplete again
+    features = store.features_batch([10], [10], now=_at(now_hour + 2))
+    assert np.isnan(features['rainfall_24h'][0])
+
+
+def _at(hour):
+    from datetime import datetime
+    return datetime.fromtimestamp(hour * HOUR + 60)
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Thread budget for model inference: how many predictions run at once and how
+many threads each of them may use
+
+Every ensemble call goes through TensorFlow, XGBoost, LightGBM, scikit-learn
+and NumPy/BLAS, and each of them sizes its thread pool to the whole machine by
+default. With several requests scoring at once the pools multiply and the
+cores are oversubscribed. A ThreadBudget admits at most `concurrency` calls at
+a time and caps each one at `threads_per_call` threads: OpenMP (XGBoost,
+LightGBM, scikit-learn) and BLAS through threadpoolctl for the duration of the
+call, `n_jobs` on the random forest and LightGBM models, and TensorFlow's
+intra-/inter-op pools once at startup.
+
+The benchmark runs each (concurrency, threads per call) pair in a fresh
+process against a fixed number of client threads, alongside an unmanaged
+baseline, and the autotune mode saves the best pair as JSON for
+prediction_server.py (THREAD_BUDGET_PATH).
+
+    python thread_budget.py --models models --output models/thread_budget.json
+    python thread_budget.py --workload batch --batch-rows 500 --clients 8 --duration 5
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+from threadpoolctl import ThreadpoolController
+
+# Read by OpenMP, OpenBLAS, MKL and TensorFlow when they initialize, so they
+# only affect libraries loaded after apply_environment()
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+
+class ThreadBudget:
+    """Concurrency limit and per-call thread cap for model inference
+
+    The default gives every core its own single-threaded call, which suits
+    the small per-request matrices /predict scores. Use limit() around each
+    prediction; it queues callers beyond the concurrency limit.
+    """
+
+    def __init__(self, concurrency=None, threads_per_call=None):
+        cpus = os.cpu_count() or 1
+        self.concurrency = max(1, int(concurrency or max(1, cpus // (threads_per_call or 1))))
+        self.threads_per_call = max(1, int(threads_per_call or max(1, cpus // self.concurrency)))
+        self.source = 'default'
+
+        # Slots are granted in arrival order: a plain semaphore lets a caller
+        # that just released take its slot straight back and starve the queue
+        self._lock = threading.Lock()
+        self._turn = threading.Condition(self._lock)
+        self._tickets = 0
+        self._admitted = self.concurrency
+        self._controller = None
+        self.calls = 0
+        self.queued = 0
+        self.wait_seconds = 0.0
+        self.active = 0
+        self.max_active = 0
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            config = json.load(f)
+        budget = cls(config['concurrency'], config['threads_per_call'])
+        budget.source = path
+        return budget
+
+    @classmethod
+    def from_env(cls, path=None):
+        """Budget from a saved autotune result, overridden by SERVE_CONCURRENCY
+        and SERVE_THREADS_PER_CALL"""
+        concurrency = threads_per_call = None
+        source = 'default'
+        if path and os.path.exists(path):
+            saved = cls.load(path)
+            concurrency, threads_per_call, source = saved.concurrency, saved.threads_per_call, path
+        if os.getenv('SERVE_CONCURRENCY'):
+            concurrency, source = int(os.getenv('SERVE_CONCURRENCY')), 'environment'
+        if os.getenv('SERVE_THREADS_PER_CALL'):
+            threads_per_call, source = int(os.getenv('SERVE_THREADS_PER_CALL')), 'environment'
+        budget = cls(concurrency, threads_per_call)
+        budget.source = source
+        return budget
+
+    def save(self, path, **extra):
+        with open(path, 'w') as f:
+            json.dump(dict({'concurrency': self.concurrency, 'threads_per_call': self.threads_per_call,
+                            'cpu_count': os.cpu_count()}, **extra), f, indent=2)
+
+    def apply_environment(self):
+        """Set the thread environment variables; call before importing the model libraries"""
+        for name in THREAD_ENV_VARS:
+            os.environ[name] = str(self.threads_per_call)
+        os.environ['TF_NUM_INTRAOP_THREADS'] = str(self.threads_per_call)
+        os.environ['TF_NUM_INTEROP_THREADS'] = str(self.concurrency)
+
+    def apply(self):
+        """Apply the budget process-wide; call before any model is loaded
+
+        TensorFlow's pools are shared by all calls and cannot be resized once
+        it has run an op, so intra-op gets the per-call threads and inter-op
+        one thread per concurrent call. Returns False if TensorFlow had
+        already initialized its pools.
+        """
+        from advanced_disaster_predictor import configure_tf_threads
+
+        self.apply_environment()
+        configured = configure_tf_threads(self.threads_per_call, self.concurrency)
+        # BLAS pools are process-wide; the OpenMP limit set here only covers
+        # this thread, so limit() sets it again in each request thread
+        self.controller.limit(limits=self.threads_per_call)
+        return configured
+
+    @property
+    def controller(self):
+        if self._controller is None:
+            self._controller = ThreadpoolController()
+        return self._controller
+
+    def configure_models(self, predictor):
+        """Cap n_jobs on a predictor's tree models
+
+        Random forest prediction starts n_jobs joblib threads regardless of
+        the OpenMP limit, and LightGBM passes n_jobs to the booster on every
+        predict. XGBoost boosters fitted with the default n_jobs=-1 follow the
+        calling thread's OpenMP limit, so they are left alone; changing a
+        booster's nthread is not safe while other threads predict with it.
+        Models replaced by retraining or region loads are picked up on their
+        first call.
+        """
+        for models in predictor.models.values():
+            for key in ('rf', 'lgb'):
+                model = models.get(key)
+                if model is not None and getattr(model, 'n_jobs', None) != self.threads_per_call:
+                    model.n_jobs = self.threads_per_call
+
+    @contextmanager
+    def limit(self, predictor=None):
+        """Hold one concurrency slot and cap native threads for one model call"""
+        start = time.perf_counter()
+        with self._turn:
+            ticket = self._tickets
+            self._tickets += 1
+            queued = ticket >= self._admitted
+            while ticket >= self._admitted:
+                self._turn.wait()
+            waited = time.perf_counter() - start
+            self.calls += 1
+            self.queued += queued
+            self.wait_seconds += waited
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            if predictor is not None:
+                self.configure_models(predictor)
+            with self.controller.limit(limits=self.threads_per_call):
+                yield
+        finally:
+            with self._turn:
+                self.active -= 1
+                self._admitted += 1
+                self._turn.notify_all()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'concurrency': self.concurrency,
+                'threads_per_call': self.threads_per_call,
+                'cpu_count': os.cpu_count(),
+                'source': self.source,
+                'calls': self.calls,
+                'queued': self.queued,
+                'mean_wait_ms': self.wait_seconds / self.calls * 1000 if self.calls else 0.0,
+                'active': self.active,
+                'max_active': self.max_active
+            }
+
+
+def candidate_budgets(cpus, max_oversubscription=1):
+    """(concurrency, threads_per_call) pairs of powers of two (and cpus) whose
+    product fits within cpus * max_oversubscription"""
+    sizes = sorted({2 ** i for i in range(int(np.log2(cpus * max_oversubscription)) + 1)} | {cpus})
+    return [(concurrency, threads) for concurrency in sizes for threads in sizes
+            if threads <= cpus and concurrency * threads <= cpus * max_oversubscription]
+
+
+def run_config(model_dir, disaster_type, concurrency, threads_per_call, clients, duration,
+               workload, batch_rows, managed=True):
+    """Drive `clients` threads of back-to-back predictions through one budget
+
+    Runs in a fresh process so the thread environment and TensorFlow pools
+    take effect. Latency includes the time spent queued for a slot, as a
+    request would see it. Without managed the libraries keep their default
+    pools and every client calls at once.
+    """
+    budget = ThreadBudget(concurrency, threads_per_call)
+    if managed:
+        budget.apply_environment()
+
+    from advanced_disaster_predictor import AdvancedDisasterPredictor
+    from features import prepare_features_batch
+    from tensorflow import keras
+
+    warnings.filterwarnings('ignore', category=UserWarning)
+    if managed:
+        budget.apply()
+    predictor = AdvancedDisasterPredictor()
+    predictor.load_disaster_models(disaster_type, os.path.join(model_dir, disaster_type))
+
+    rng = np.random.default_rng(42)
+    n = max(1000, batch_rows)
+    features = prepare_features_batch(rng.uniform(-60, 70, n), rng.uniform(-180, 180, n), rng=rng)
+    rows = features[predictor.feature_columns].to_dict('records')
+
+    def call(i):
+        if workload == 'single':
+            predictor.predict_disaster(rows[i % len(rows)], disaster_type)
+        else:
+            predictor.predict_batch(features.iloc[:batch_rows], disaster_type)
+
+    def limited():
+        return budget.limit(predictor) if managed else nullcontext()
+
+    keras.config.disable_interactive_logging()
+    for i in range(3):
+        with limited():
+            call(i)
+
+    latencies = [[] for _ in range(clients)]
+    barrier = threading.Barrier(clients + 1)
+    deadline = [0.0]
+
+    def client(index):
+        # Keras keeps its logging switch per thread
+        keras.config.disable_interactive_logging()
+        barrier.wait()
+        i = index
+        while time.perf_counter() < deadline[0]:
+            start = time.perf_counter()
+            with limited():
+                call(i)
+            latencies[index].append(time.perf_counter() - start)
+            i += clients
+
+    threads = [threading.Thread(target=client, args=(index,), daemon=True) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    deadline[0] = start + duration
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latency = np.concatenate([np.asarray(values) for values in latencies]) * 1000
+    rows_per_call = 1 if workload == 'single' else batch_rows
+    return {
+        'concurrency': concurrency if managed else clients,
+        'threads_per_call': threads_per_call if managed else None,
+        'managed': managed,
+        'calls': int(len(latency)),
+        'calls_per_sec': len(latency) / elapsed,
+        'rows_per_sec': len(latency) * rows_per_call / elapsed,
+        'p50_ms': float(np.percentile(latency, 50)) if len(latency) else float('nan'),
+        'p99_ms': float(np.percentile(latency, 99)) if len(latency) else float('nan')
+    }
+
+
+def benchmark(model_dir='models', disaster_type='flood', budgets=None, clients=None, duration=5.0,
+              workload='single', batch_rows=500, baseline=True, verbose=True):
+    """Measure each candidate budget (and the unmanaged baseline) in its own process"""
+    cpus = os.cpu_count() or 1
+    budgets = budgets or candidate_budgets(cpus)
+    clients = clients or 2 * cpus
+    configs = [(concurrency, threads, True) for concurrency, threads in budgets]
+    if baseline:
+        configs.insert(0, (clients, None, False))
+
+    if verbose:
+        print(f"⏱️  {workload} predictions, {disaster_type}, {clients} clients, {duration:g}s per budget, "
+              f"{cpus} cores")
+        print(f"   {'budget':14s} {'calls/s':>9s} {'rows/s':>10s} {'p50':>9s} {'p99':>9s}")
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for concurrency, threads, managed in configs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_config, model_dir, disaster_type, concurrency, threads, clients,
+                                 duration, workload, batch_rows, managed).result()
+        results.append(result)
+        if verbose:
+            label = f"{concurrency} x {threads}" if managed else 'unmanaged'
+            print(f"   {label:14s} {result['calls_per_sec']:9.1f} {result['rows_per_sec']:10,.0f} "
+                  f"{result['p50_ms']:7.1f}ms {result['p99_ms']:7.1f}ms")
+    return results
+
+
+def select_budget(results, objective='throughput', p99_slack=1.5):
+    """Best managed result: highest throughput among budgets whose p99 is
+    within p99_slack of the best p99, or simply the lowest p99"""
+    managed = [result for result in results if result['managed'] and result['calls']]
+    best_p99 = min(result['p99_ms'] for result in managed)
+    if objective == 'p99':
+        return min(managed, key=lambda result: result['p99_ms'])
+    eligible = [result for result in managed if result['p99_ms'] <= best_p99 * p99_slack]
+    return max(eligible, key=lambda result: result['calls_per_sec'])
+
+
+def autotune(model_dir='models', output=None, objective='throughput', **kwargs):
+    """Benchmark the candidate budgets and return (and optionally save) the best"""
+    results = benchmark(model_dir, **kwargs)
+    best = select_budget(results, objective)
+    budget = ThreadBudget(best['concurrency'], best['threads_per_call'])
+    if output:
+        budget.save(output, objective=objective, results=results)
+        budget.source = output
+    return budget
+
+
+def autotune_subprocess(model_dir, output, duration=5.0):
+    """Run the autotuner as its own program and load the saved budget
+
+    For callers such as prediction_server.py whose module-level code would run
+    again in every spawned benchmark process if autotune() were called from it.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thread_budget.py')
+    subprocess.run([sys.executable, script, '--models', model_dir, '--duration', str(duration),
+                    '--output', output], check=True)
+    return ThreadBudget.load(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the best inference concurrency and threads per call')
+    parser.add_argument('--models', default='models', help='Directory of trained models')
+    parser.add_argument('--disaster-type', default='flood')
+    parser.add_argument('--workload', choices=['single', 'batch'], default='single',
+                        help='predict_disaster on one row (/predict) or predict_batch (/predict/batch)')
+    parser.add_argument('--batch-rows', type=int, default=500, help='Rows per call for --workload batch')
+    parser.add_argument('--clients', type=int, help='Concurrent client threads (default: 2 x cores)')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per budget')
+    parser.add_argument('--concurrency', type=int, nargs='+', help='Concurrency values to try')
+    parser.add_argument('--threads', type=int, nargs='+', help='Threads-per-call values to try')
+    parser.add_argument('--max-oversubscription', type=int, default=1,
+                        help='Also try budgets using up to this multiple of the cores')
+    parser.add_argument('--objective', choices=['throughput', 'p99'], default='throughput')
+    parser.add_argument('--no-baseline', action='store_true', help='Skip the unmanaged baseline')
+    parser.add_argument('--output', help='Save the best budget as JSON (THREAD_BUDGET_PATH)')
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    budgets = candidate_budgets(cpus, args.max_oversubscription)
+    if args.concurrency or args.threads:
+        budgets = [(concurrency, threads)
+                   for concurrency in args.concurrency or sorted({c for c, _ in budgets})
+                   for threads in args.threads or sorted({t for _, t in budgets})]
+
+    results = benchmark(args.models, args.disaster_type, budgets, args.clients, args.duration,
+                        args.workload, args.batch_rows, baseline=not args.no_baseline)
+    best = select_budget(results, args.objective)
+    print(f"\n🏁 Best budget: {best['concurrency']} concurrent x {best['threads_per_call']} threads "
+          f"({best['calls_per_sec']:.1f} calls/s, p99 {best['p99_ms']:.1f}ms)")
+    if args.output:
+        ThreadBudget(best['concurrency'], best['threads_per_call']).save(
+            args.output, objective=args.objective, workload=args.workload, results=results)
+        print(f"✅ Thread budget written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,25 @@
 Train all disaster prediction models with high accuracy
 """
 
-from advanced_disaster_predictor import AdvancedDisasterPredictor
+from advanced_disaster_predictor import AdvancedDisasterPredictor, configure_tf_threads
+from cross_validation import cross_validate, print_summary, start_pool
+import argparse
+import json
+import os
 import sys
 
 def main():
+    parser = argparse.ArgumentParser(description='Train all disaster prediction models')
+    parser.add_argument('--cv', type=int, default=0, metavar='K',
+                        help='Derive ensemble weights from parallel K-fold cross-validation')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes for --cv')
+    parser.add_argument('--intra-op-threads', type=int, default=None,
+                        help='TensorFlow intra-op threads for the neural networks (default: all cores)')
+    parser.add_argument('--inter-op-threads', type=int, default=None,
+                        help='TensorFlow inter-op threads (default: 2)')
+    args = parser.parse_args()
+    configure_tf_threads(args.intra_op_threads, args.inter_op_threads)
+    
     print("\n" + "="*70)
     print(" "*15 + "GUARDIAN EARTH AI MODEL TRAINING")
     print("="*70)
@@ -16,6 +31,8 @@ def main():
     print("  • LightGBM Classifier")
     print("  • Deep Neural Network")
     print("  • Ensemble Model (Weighted Average)")
+    if args.cv:
+        print(f"    with weights averaged over {args.cv}-fold cross-validation")
     print("\nDisaster Types:")
     print("  1. Floods")
     print("  2. Cyclones/Hurricanes")
@@ -32,16 +49,36 @@ def main():
     # Initialize predictor
     predictor = AdvancedDisasterPredictor()
     
+    # Use tuned hyperparameters when hyperparameter_search.py has been run
+    predictor.load_hyperparameters(os.path.join('models', 'hyperparameters.json'))
+    
     # Train all disaster types
     disaster_types = ['flood', 'cyclone', 'earthquake', 'landslide', 'wildfire']
     
+    cv_report = {}
     total_accuracy = 0
-    for disaster_type in disaster_types:
-        accuracy = predictor.train_models(disaster_type)
-        total_accuracy += accuracy
+    # One worker pool for every disaster type's folds
+    workers = args.workers or os.cpu_count() or 1
+    pool = start_pool(workers, 1) if args.cv else None
+    try:
+        for disaster_type in disaster_types:
+            ensemble_weights = None
+            if args.cv:
+                cv_report[disaster_type] = cross_validate(predictor, disaster_type, folds=args.cv,
+                                                          pool=pool, workers=workers)
+                print_summary(disaster_type, cv_report[disaster_type])
+                ensemble_weights = cv_report[disaster_type]['weights']
+            accuracy = predictor.train_models(disaster_type, ensemble_weights=ensemble_weights)
+            total_accuracy += accuracy
+    finally:
+        if pool is not None:
+            pool.shutdown()
     
     # Save models
     predictor.save_models('models')
+    if cv_report:
+        with open(os.path.join('models', 'cv_report.json'), 'w') as f:
+            json.dump(cv_report, f, indent=2)
     
     # Summary
     print("\n" + "="*70)
@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+Quota-aware scheduling of upstream API calls (OpenWeatherMap)
+
+Every upstream request goes through quotas that mirror the plan's (a token
+bucket for calls per minute, a fixed window that resets on the provider's
+schedule and survives restarts for calls per day) and a priority queue with three
+classes: interactive (/predict), scheduled (monitoring sweeps) and bulk
+(batch scoring). Each class may only take a token while the bucket holds more
+than its reserve, so bulk work can never drain the tokens interactive users
+need. Requests for the same key (weather cell) that are queued or in flight
+are coalesced into one upstream call, taking the highest priority of their
+waiters. A 429 from upstream empties the buckets for its Retry-After and the
+request is queued again. Callers that wait longer than their class allows get
+UpstreamTimeout (and fall back to mock weather), counted per class alongside
+the queueing delay.
+
+    python upstream_scheduler.py --simulate
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import numpy as np
+import requests
+
+PRIORITIES = {'interactive': 0, 'scheduled': 1, 'bulk': 2}
+CLASSES = list(PRIORITIES)
+
+# Seconds a caller waits for a token before falling back
+DEFAULT_MAX_WAIT = {'interactive': 2.0, 'scheduled': 60.0, 'bulk': 600.0}
+# Fraction of each bucket a class may not dip into
+DEFAULT_RESERVE = {'interactive': 0.0, 'scheduled': 0.1, 'bulk': 0.3}
+
+
+class UpstreamTimeout(Exception):
+    """No quota became available within the caller's class deadline"""
+
+
+class UpstreamRateLimited(Exception):
+    """Upstream answered 429; retry_after is in seconds"""
+
+    def __init__(self, retry_after=1.0):
+        super().__init__(f'Upstream rate limited (retry after {retry_after:.1f}s)')
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Continuously refilled token bucket (not thread-safe; the scheduler locks)"""
+
+    def __init__(self, limit, period_seconds):
+        self.capacity = float(limit)
+        self.rate = limit / period_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, floor):
+        """Seconds until one token is available above floor"""
+        missing = 1 + floor - self.tokens
+        return max(missing, 0.0) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        """Empty the bucket so it refills only after seconds"""
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def get_stats(self):
+        return {'tokens': round(self.tokens, 2), 'capacity': self.capacity, 'rate_per_second': self.rate}
+
+
+class FixedWindowQuota:
+    """Calls per calendar window, reset on the provider's schedule (same interface as TokenBucket)
+
+    Windows start at reset_hour UTC and last period_seconds (OpenWeatherMap
+    resets daily counts at midnight UTC). The calls spent in the current
+    window are written to path after each call, so a restart carries on from
+    them; without a path the usage of the current window is unknown and it
+    is treated as spent until the next reset.
+    """
+
+    def __init__(self, limit, period_seconds=86400.0, reset_hour=0, path=None):
+        self.capacity = float(limit)
+        self.period = float(period_seconds)
+        self.offset = reset_hour * 3600.0
+        self.path = path
+        self.blocked_until = 0.0
+        self.window_start = self._window_start(time.time())
+        self.used = self.capacity
+        if path is not None:
+            self.used = 0.0
+            if os.path.exists(path):
+                with open(path) as f:
+                    state = json.load(f)
+                if state['window_start'] == self.window_start:
+                    self.used = float(state['used'])
+            else:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def _window_start(self, wall):
+        return (wall - self.offset) // self.period * self.period + self.offset
+
+    @property
+    def tokens(self):
+        return self.capacity - self.used
+
+    def refill(self, now):
+        # now is the scheduler's monotonic clock; windows follow the wall clock
+        start = self._window_start(time.time())
+        if start != self.window_start:
+            self.window_start, self.used = start, 0.0
+            self._save()
+
+    def wait_time(self, floor):
+        """Seconds until one call is available above floor"""
+        wall = time.time()
+        wait = max(self.blocked_until - wall, 0.0)
+        if 1 + floor > self.tokens:
+            wait = max(wait, self.window_start + self.period - wall)
+        return wait
+
+    def take(self):
+        self.used += 1
+        self._save()
+
+    def block(self, seconds):
+        """Hold calls for seconds without touching the window's count"""
+        self.blocked_until = max(self.blocked_until, time.time() + seconds)
+
+    def _save(self):
+        if self.path is None:
+            return
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'window_start': self.window_start, 'used': self.used}, f)
+        os.replace(tmp, self.path)
+
+    def get_stats(self):
+        return {'tokens': round(self.tokens, 2), 'capacity': self.capacity, 'used': self.used,
+                'resets_in_seconds': round(self.window_start + self.period - time.time(), 1)}
+
+
+class _Request:
+    __slots__ = ('key', 'fn', 'priority', 'seq', 'future', 'waiters', 'dispatched', 'attempts',
+                 'call_timeout', 'sent_at')
+
+    def __init__(self, key, fn, priority, seq, call_timeout):
+        self.key = key
+        self.fn = fn
+        self.priority = priority
+        self.seq = seq
+        self.future = Future()
+        self.waiters = []  # [class, submitted_at, abandoned]
+        self.dispatched = False
+        self.attempts = 0
+        self.call_timeout = call_timeout
+        self.sent_at = None
+
+
+class UpstreamScheduler:
+    """Quotas, priority classes and request coalescing
+
+    quotas holds (limit, period_seconds) pairs, which become token buckets,
+    and/or quota objects such as FixedWindowQuota.
+    """
+
+    def __init__(self, quotas=((60, 60.0),), concurrency=8, max_wait=None, reserve=None,
+                 max_attempts=3, samples=10000, call_timeout=30.0):
+        self.buckets = [quota if isinstance(quota, FixedWindowQuota) else TokenBucket(*quota)
+                        for quota in quotas]
+        self.concurrency = concurrency
+        self.max_wait = dict(DEFAULT_MAX_WAIT, **(max_wait or {}))
+        self.reserve = dict(DEFAULT_RESERVE, **(reserve or {}))
+        self.max_attempts = max_attempts
+        self.call_timeout = call_timeout
+
+        self._heap = []
+        self._pending = {}  # key -> _Request, queued or in flight
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='upstream')
+
+        self.counters = {cls: {'submitted': 0, 'coalesced': 0, 'dispatched': 0, 'timed_out': 0, 'errors': 0}
+                         for cls in CLASSES}
+        self.delays = {cls: deque(maxlen=samples) for cls in CLASSES}
+        self.rate_limited = 0
+        self.upstream_calls = 0
+
+        threading.Thread(target=self._dispatch_loop, daemon=True, name='upstream-dispatch').start()
+
+    # -- submission -----------------------------------------------------------
+
+    def submit(self, key, fn, priority='interactive', timeout=None):
+        """Queue fn() under key (coalescing with an identical pending call)
+
+        timeout is how long fn() itself may take once sent (the HTTP timeout;
+        call_timeout by default). Returns a handle for result().
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(CLASSES)}")
+        level = PRIORITIES[priority]
+        waiter = [priority, time.monotonic(), False]
+        with self._cond:
+            self.counters[priority]['submitted'] += 1
+            request = self._pending.get(key)
+            if request is not None:
+                self.counters[priority]['coalesced'] += 1
+                request.waiters.append(waiter)
+                if level < request.priority and not request.dispatched:
+                    # Re-queue at the higher priority; the old entry is skipped
+                    request.priority = level
+                    heapq.heappush(self._heap, (level, request.seq, request))
+                    self._cond.notify_all()
+                return request, waiter
+
+            request = _Request(key, fn, level, next(self._seq),
+                               self.call_timeout if timeout is None else timeout)
+            request.waiters.append(waiter)
+            self._pending[key] = request
+            heapq.heappush(self._heap, (level, request.seq, request))
+            self._cond.notify_all()
+        return request, waiter
+
+    def result(self, handle, timeout=None):
+        """Wait for a submitted call; UpstreamTimeout past the class deadline"""
+        request, waiter = handle
+        if timeout is None:
+            timeout = max(self.max_wait[waiter[0]] - (time.monotonic() - waiter[1]), 0.0)
+        try:
+            return request.future.result(timeout=timeout)
+        except FutureTimeout:
+            with self._cond:
+                waiter[2] = True
+                dispatched = request.dispatched
+                if not dispatched:
+                    self.counters[waiter[0]]['timed_out'] += 1
+                remaining = request.sent_at + request.call_timeout - time.monotonic() if dispatched else 0.0
+            if dispatched:
+                # Already sent upstream; the answer is on its way, but wait no
+                # longer than the call itself may take. A 429 puts it back in
+                # the queue, where it is dropped (UpstreamTimeout) with no
+                # caller left waiting.
+                try:
+                    return request.future.result(timeout=max(remaining, 0.0))
+                except FutureTimeout:
+                    raise UpstreamTimeout(f'Upstream call for a {waiter[0]} request did not finish '
+                                          f'within {request.call_timeout:.1f}s')
+            raise UpstreamTimeout(f'No upstream quota within {self.max_wait[waiter[0]]:.1f}s '
+                                  f'for a {waiter[0]} request')
+
+    def call(self, key, fn, priority='interactive', timeout=None):
+        """submit() and wait for the result"""
+        return self.result(self.submit(key, fn, priority), timeout)
+
+    # -- dispatch -------------------------------------------------------------
+
+    def _next_request(self):
+        """Highest-priority live request at the top of the heap, or None"""
+        while self._heap:
+            level, _, request = self._heap[0]
+            stale = request.dispatched or level != request.priority
+            if not stale and all(waiter[2] for waiter in request.waiters):
+                # Every caller gave up before it was (re)sent; resolve the
+                # future so a caller still holding it does not block
+                self._pending.pop(request.key, None)
+                if not request.future.done():
+                    request.future.set_exception(UpstreamTimeout('Dropped with no caller waiting'))
+                stale = True
+            if not stale:
+                return request
+            heapq.heappop(self._heap)
+        return None
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                request = self._next_request()
+                if request is None or self._in_flight >= self.concurrency:
+                    self._cond.wait(timeout=1.0)
+                    continue
+                now = time.monotonic()
+                cls = CLASSES[request.priority]
+                wait = 0.0
+                for bucket in self.buckets:
+                    bucket.refill(now)
+                    wait = max(wait, bucket.wait_time(self.reserve[cls] * bucket.capacity))
+                if wait > 0:
+                    # A higher-priority arrival notifies and is considered at once
+                    self._cond.wait(timeout=wait)
+                    continue
+
+                heapq.heappop(self._heap)
+                for bucket in self.buckets:
+                    bucket.take()
+                request.dispatched = True
+                request.sent_at = now
+                request.attempts += 1
+                self._in_flight += 1
+                self.upstream_calls += 1
+                self.counters[cls]['dispatched'] += 1
+                for waiter_cls, submitted, abandoned in request.waiters:
+                    if not abandoned:
+                        self.delays[waiter_cls].append(now - submitted)
+            self._executor.submit(self._run, request)
+
+    def _run(self, request):
+        try:
+            value, error = request.fn(), None
+        except Exception as e:
+            value, error = None, e
+
+        with self._cond:
+            self._in_flight -= 1
+            if isinstance(error, UpstreamRateLimited):
+                self.rate_limited += 1
+                now = time.monotonic()
+                for bucket in self.buckets:
+                    bucket.refill(now)
+                    bucket.block(error.retry_after)
+                if request.attempts < self.max_attempts:
+                    # Back in the queue with its original position
+                    request.dispatched = False
+                    heapq.heappush(self._heap, (request.priority, request.seq, request))
+                    self._cond.notify_all()
+                    return
+            self._pending.pop(request.key, None)
+            if error is not None:
+                self.counters[CLASSES[request.priority]]['errors'] += 1
+            self._cond.notify_all()
+        if error is not None:
+            request.future.set_exception(error)
+        else:
+            request.future.set_result(value)
+
+    # -- metrics --------------------------------------------------------------
+
+    def get_stats(self):
+        with self._cond:
+            now = time.monotonic()
+            for bucket in self.buckets:
+                bucket.refill(now)
+            classes = {}
+            for cls in CLASSES:
+                delays = np.array(self.delays[cls]) * 1000
+                classes[cls] = dict(self.counters[cls], queue_delay_ms={
+                    'p50': float(np.percentile(delays, 50)) if len(delays) else 0.0,
+                    'p90': float(np.percentile(delays, 90)) if len(delays) else 0.0,
+                    'p99': float(np.percentile(delays, 99)) if len(delays) else 0.0,
+                    'max': float(delays.max()) if len(delays) else 0.0
+                })
+            return {
+                'classes': classes,
+                'queued': sum(1 for request in self._pending.values() if not request.dispatched),
+                'in_flight': self._in_flight,
+                'upstream_calls': self.upstream_calls,
+                'rate_limited': self.rate_limited,
+                'buckets': [bucket.get_stats() for bucket in self.buckets]
+            }
+
+
+# Scheduler used by request_json; None calls upstream directly
+scheduler = None
+
+
+def configure_upstream_scheduler(upstream):
+    """Route request_json calls through an UpstreamScheduler (None to disable)"""
+    global scheduler
+    scheduler = upstream
+
+
+def _get_json(url, params, timeout):
+    response = requests.get(url, params=params, timeout=timeout)
+    if response.status_code == 429:
+        raise UpstreamRateLimited(float(response.headers.get('Retry-After', 1.0)))
+    response.raise_for_status()
+    return response.json()
+
+
+def submit_json(url, params, key=None, priority='interactive', timeout=5):
+    """Queue a GET of url (handle for result_json)"""
+    fetch = lambda: _get_json(url, params, timeout)
+    if scheduler is None:
+        future = Future()
+        try:
+            future.set_result(fetch())
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return scheduler.submit(key if key is not None else (url, tuple(sorted(params.items()))), fetch, priority,
+                            timeout)
+
+
+def result_json(handle):
+    if isinstance(handle, Future):
+        return handle.result()
+    return scheduler.result(handle)
+
+
+def request_json(url, params, key=None, priority='interactive', timeout=5):
+    """GET url and decode JSON, through the configured scheduler if any"""
+    return result_json(submit_json(url, params, key, priority, timeout))
+
+
+def simulate(rate, burst, latency_ms, bulk, interactive, concurrency):
+    """Bulk sweep plus interactive traffic against the quota stub, with and without scheduling"""
+    from upstream_stub import create_app, serve_in_thread
+
+    def run(scheduled):
+        global scheduler
+        app = create_app(rate=rate, burst=burst, latency_ms=latency_ms)
+        server, base_url = serve_in_thread(app)
+        scheduler = UpstreamScheduler(quotas=[(burst, burst / rate)], concurrency=concurrency) if scheduled else None
+        url = f'{base_url}/data/2.5/weather'
+        rng = np.random.default_rng(1)
+        cells = rng.integers(0, bulk // 2, size=bulk)  # half the bulk cells repeat
+
+        results = {'interactive_ok': 0, 'interactive_failed': 0, 'interactive_ms': [],
+                   'bulk_ok': 0, 'bulk_failed': 0}
+        lock = threading.Lock()
+
+        def fetch(kind, cell):
+            start = time.perf_counter()
+            params = {'lat': float(cell % 90), 'lon': float(cell // 90), 'appid': 'demo'}
+            try:
+                request_json(url, params, key=('weather', int(cell)),
+                             priority='interactive' if kind == 'interactive' else 'bulk')
+                ok = True
+            except Exception:
+                ok = False
+            with lock:
+                results[f'{kind}_{"ok" if ok else "failed"}'] += 1
+                if kind == 'interactive':
+                    results['interactive_ms'].append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as bulk_pool, ThreadPoolExecutor(max_workers=4) as users:
+            for cell in cells:
+                bulk_pool.submit(fetch, 'bulk', cell)
+            for i in range(interactive):
+                time.sleep(0.25)
+                users.submit(fetch, 'interactive', 10 ** 6 + i)
+        seconds = time.perf_counter() - start
+        stub = app.config['quota']
+        stats = scheduler.get_stats() if scheduler is not None else None
+        scheduler = None
+        server.shutdown()
+        return results, seconds, stub, stats
+
+    print(f"⏱️  Upstream quota {rate:g} req/s (burst {burst}), {bulk} bulk requests "
+          f"({concurrency} threads) + {interactive} interactive requests every 250 ms")
+    for label, scheduled in (('direct', False), ('scheduled', True)):
+        results, seconds, stub, stats = run(scheduled)
+        ms = np.array(results['interactive_ms'])
+        print(f"\n   {label}: {seconds:.1f}s, upstream served {stub.served}, throttled (429) {stub.throttled}")
+        print(f"     interactive: {results['interactive_ok']}/{interactive} real weather, "
+              f"p50 {np.percentile(ms, 50):.0f} ms, max {ms.max():.0f} ms")
+        print(f"     bulk:        {results['bulk_ok']}/{bulk} real weather")
+        if stats is not None:
+            for cls in ('interactive', 'bulk'):
+                counters = stats['classes'][cls]
+                print(f"     {cls:12s} queue delay p50 {counters['queue_delay_ms']['p50']:.0f} ms, "
+                      f"p99 {counters['queue_delay_ms']['p99']:.0f} ms; coalesced {counters['coalesced']}, "
+                      f"timed out {counters['timed_out']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quota-aware upstream request scheduler')
+    parser.add_argument('--simulate', action='store_true',
+                        help='Compare direct and scheduled calls against a local quota stub')
+    parser.add_argument('--rate', type=float, default=20.0, help='Stub quota in requests per second')
+    parser.add_argument('--burst', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=40.0)
+    parser.add_argument('--bulk', type=int, default=400)
+    parser.add_argument('--interactive', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.simulate:
+        simulate(args.rate, args.burst, args.latency_ms, args.bulk, args.interactive, args.concurrency)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
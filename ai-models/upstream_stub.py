@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenWeatherMap API that enforces a request quota
+
+Serves /data/2.5/weather (and /data/2.5/onecall/timemachine) with weather
+that is a deterministic function of the location, adds a configurable
+latency, and answers 429 with Retry-After once a per-key token bucket is
+empty, like the real API does when the plan's calls per minute are exceeded.
+GET /stats reports served, throttled and concurrent requests. Point the
+prediction server at it with WEATHER_API_BASE_URL=http://127.0.0.1:8900.
+
+    python upstream_stub.py --port 8900 --rate 60 --burst 60 --latency-ms 80
+"""
+
+import argparse
+import logging
+import threading
+import time
+
+import numpy as np
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+from features import LocationRandom, WEATHER_STREAM
+
+
+class QuotaState:
+    """Per-API-key token buckets and request counters"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.served = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def admit(self, key):
+        """(allowed, retry_after_seconds) for one request by key"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                self.throttled += 1
+                return False, (1 - tokens) / self.rate
+            self.buckets[key] = (tokens - 1, now)
+            self.served += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return True, 0.0
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+def create_app(rate=60.0, burst=60, latency_ms=50.0, seed=7):
+    """Flask app serving quota-limited synthetic weather"""
+    app = Flask(__name__)
+    quota = QuotaState(rate, burst)
+    app.config['quota'] = quota
+
+    def observation():
+        lat, lon = float(request.args['lat']), float(request.args['lon'])
+        rng = LocationRandom(seed, [lat], [lon], stream=WEATHER_STREAM)
+        return {
+            'coord': {'lat': lat, 'lon': lon},
+            'main': {'temp': float(rng.normal(25, 5)[0]), 'humidity': float(rng.uniform(40, 90)[0]),
+                     'pressure': float(rng.normal(1013, 10)[0])},
+            'wind': {'speed': float(rng.exponential(10)[0]), 'deg': float(rng.uniform(0, 360)[0])},
+            'rain': {'1h': float(rng.exponential(2)[0])},
+            'dt': int(time.time())
+        }
+
+    def serve(build):
+        allowed, retry_after = quota.admit(request.args.get('appid', ''))
+        if not allowed:
+            response = jsonify({'cod': 429, 'message': 'Your account is temporary blocked due to exceeding '
+                                                       'of requests limitation of your subscription type.'})
+            response.status_code = 429
+            response.headers['Retry-After'] = f'{retry_after:.3f}'
+            return response
+        try:
+            time.sleep(latency_ms / 1000 * (0.5 + np.random.random()))
+            return jsonify(build())
+        finally:
+            quota.release()
+
+    @app.route('/data/2.5/weather')
+    def weather():
+        return serve(observation)
+
+    @app.route('/data/2.5/onecall/timemachine')
+    def timemachine():
+        return serve(lambda: {'current': observation()})
+
+    @app.route('/stats')
+    def stats():
+        return jsonify({'served': quota.served, 'throttled': quota.throttled,
+                        'max_in_flight': quota.max_in_flight, 'rate': quota.rate, 'burst': quota.burst})
+
+    return app
+
+
+def serve_in_thread(app, port=0):
+    """Run an app on 127.0.0.1 in a daemon thread; returns (server, base_url)"""
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quota-enforcing OpenWeatherMap stand-in')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--rate', type=float, default=60.0, help='Requests per second refilled per API key')
+    parser.add_argument('--burst', type=int, default=60, help='Bucket capacity per API key')
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='Mean response latency')
+    args = parser.parse_args()
+
+    app = create_app(args.rate, args.burst, args.latency_ms)
+    print(f"✅ Weather API stub on http://127.0.0.1:{args.port} "
+          f"({args.rate:g} req/s, burst {args.burst}, ~{args.latency_ms:g} ms)")
+    app.run(host='127.0.0.1', port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Rolling-window weather time-series store per grid cell
+
+Each grid cell that has received an observation owns a slot holding:
+  • an hourly rainfall ring buffer covering 30 days, with a flag per hour
+    recording whether that hour was observed
+  • 25-hour ring buffers of temperature and pressure
+  • running 24h / 7d / 30d rainfall sums and observed-hour counts
+
+A rainfall total is only reported when every hour of its window was observed;
+a missing hour would otherwise count as dry and understate the total.
+
+All arrays are .npy files opened with np.lib.format.open_memmap, so the store
+survives restarts and only the pages being touched are resident. Hourly
+updates adjust the running sums in O(1); reading the rainfall and 24h change
+features for a cell is a single row lookup.
+
+    python weather_store.py --benchmark --cells 100000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+RAIN_WINDOWS = (24, 168, 720)
+RAIN_FEATURES = ('rainfall_24h', 'rainfall_7d', 'rainfall_30d')
+CHANGE_HOURS = 24
+
+
+class WeatherTimeSeriesStore:
+    """Memory-mapped hourly ring buffers of weather observations per grid cell"""
+
+    def __init__(self, directory, capacity=131072, resolution=0.25):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, 'meta.json')
+
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            self.capacity = meta['capacity']
+            self.resolution = meta['resolution']
+            self.n_used = meta['n_used']
+        else:
+            self.capacity = capacity
+            self.resolution = resolution
+            self.n_used = 0
+
+        self.window = RAIN_WINDOWS[-1]
+        self.n_lat = int(round(180 / self.resolution))
+        self.n_lon = int(round(360 / self.resolution))
+
+        def open_array(name, dtype, shape, fill):
+            # Arrays missing from an existing store (added in a later
+            # version) start out empty
+            path = os.path.join(directory, f'{name}.npy')
+            mode = 'r+' if os.path.exists(path) else 'w+'
+            array = np.lib.format.open_memmap(path, mode=mode, dtype=dtype, shape=shape)
+            if mode == 'w+':
+                array[:] = fill
+            return array
+
+        self.slots = open_array('slots', np.int32, (self.n_lat, self.n_lon), -1)
+        self.rain = open_array('rain', np.float32, (self.capacity, self.window), 0.0)
+        self.observed = open_array('observed', np.uint8, (self.capacity, self.window), 0)
+        self.temperature = open_array('temperature', np.float32, (self.capacity, CHANGE_HOURS + 1), np.nan)
+        self.pressure = open_array('pressure', np.float32, (self.capacity, CHANGE_HOURS + 1), np.nan)
+        self.rain_sums = open_array('rain_sums', np.float64, (self.capacity, len(RAIN_WINDOWS)), 0.0)
+        self.rain_counts = open_array('rain_counts', np.int32, (self.capacity, len(RAIN_WINDOWS)), 0)
+        self.first_hour = open_array('first_hour', np.int64, (self.capacity,), -1)
+        self.last_hour = open_array('last_hour', np.int64, (self.capacity,), -1)
+
+        # Slot assignments reach slots.npy immediately but n_used only at the
+        # next flush, so after an unflushed restart it comes from the slots
+        self.n_used = max(self.n_used, int(self.slots.max()) + 1)
+
+        self.dropped_observations = 0
+        self._lock = threading.Lock()
+        self._save_meta()
+
+    def _save_meta(self):
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as f:
+            json.dump({
+                'capacity': self.capacity,
+                'resolution': self.resolution,
+                'n_used': self.n_used
+            }, f)
+
+    def flush(self):
+        """Write dirty pages and metadata to disk"""
+        with self._lock:
+            for array in (self.slots, self.rain, self.observed, self.temperature, self.pressure,
+                          self.rain_sums, self.rain_counts, self.first_hour, self.last_hour):
+                array.flush()
+            self._save_meta()
+
+    def cell_index(self, lats, lons):
+        """Grid row/column for coordinates (vectorized)"""
+        rows = np.clip(((np.asarray(lats) + 90) / self.resolution).astype(np.int64), 0, self.n_lat - 1)
+        cols = np.clip(((np.asarray(lons) + 180) / self.resolution).astype(np.int64) % self.n_lon, 0, self.n_lon - 1)
+        return rows, cols
+
+    def _slot_for(self, lat, lon, create):
+        row, col = self.cell_index(lat, lon)
+        slot = int(self.slots[row, col])
+        if slot < 0 and create:
+            if self.n_used >= self.capacity:
+                return -1
+            slot = self.n_used
+            self.n_used += 1
+            self.slots[row, col] = slot
+        return slot
+
+    def _advance(self, slot, hour):
+        """Roll a cell forward to `hour`, evicting values that leave each window"""
+        last = int(self.last_hour[slot])
+        if last < 0 or hour <= last:
+            return
+
+        if hour - last >= self.window:
+            # Nothing observed for a whole window: start the history afresh
+            self.first_hour[slot] = hour
+            self.rain[slot] = 0.0
+            self.observed[slot] = 0
+            self.rain_sums[slot] = 0.0
+            self.rain_counts[slot] = 0
+            self.temperature[slot] = np.nan
+            self.pressure[slot] = np.nan
+        else:
+            for step in range(last + 1, hour + 1):
+                for index, window in enumerate(RAIN_WINDOWS):
+                    self.rain_sums[slot, index] -= self.rain[slot, (step - window) % self.window]
+                    self.rain_counts[slot, index] -= self.observed[slot, (step - window) % self.window]
+                self.rain[slot, step % self.window] = 0.0
+                self.observed[slot, step % self.window] = 0
+                self.temperature[slot, step % (CHANGE_HOURS + 1)] = np.nan
+                self.pressure[slot, step % (CHANGE_HOURS + 1)] = np.nan
+            np.maximum(self.rain_sums[slot], 0.0, out=self.rain_sums[slot])
+        self.last_hour[slot] = hour
+
+    def _advance_many(self, slots, hour):
+        """Vectorized _advance; cells exactly one hour behind take the fast path"""
+        behind = self.last_hour[slots] == hour - 1
+        fast = slots[behind]
+        if len(fast):
+            for index, window in enumerate(RAIN_WINDOWS):
+                self.rain_sums[fast, index] -= self.rain[fast, (hour - window) % self.window]
+                self.rain_counts[fast, index] -= self.observed[fast, (hour - window) % self.window]
+            self.rain_sums[fast] = np.maximum(self.rain_sums[fast], 0.0)
+            self.rain[fast, hour % self.window] = 0.0
+            self.observed[fast, hour % self.window] = 0
+            self.temperature[fast, hour % (CHANGE_HOURS + 1)] = np.nan
+            self.pressure[fast, hour % (CHANGE_HOURS + 1)] = np.nan
+            self.last_hour[fast] = hour
+        for slot in slots[~behind]:
+            self._advance(int(slot), hour)
+
+    def _write(self, slot, hour, rainfall_1h, temperature, pressure):
+        last = int(self.last_hour[slot])
+        if last < 0:
+            self.first_hour[slot] = hour
+            self.last_hour[slot] = hour
+            last = hour
+        elif hour > last:
+            self._advance(slot, hour)
+            last = hour
+        elif last - hour >= self.window:
+            return
+
+        # Replacing the value for this hour (or a late arrival still inside
+        # the windows) adjusts every running sum that covers it
+        position = hour % self.window
+        delta = rainfall_1h - float(self.rain[slot, position])
+        first_observation = not self.observed[slot, position]
+        self.rain[slot, position] = rainfall_1h
+        self.observed[slot, position] = 1
+        for index, window in enumerate(RAIN_WINDOWS):
+            if last - hour < window:
+                self.rain_sums[slot, index] += delta
+                self.rain_counts[slot, index] += first_observation
+
+        if last - hour <= CHANGE_HOURS:
+            self.temperature[slot, hour % (CHANGE_HOURS + 1)] = temperature
+            self.pressure[slot, hour % (CHANGE_HOURS + 1)] = pressure
+        self.first_hour[slot] = min(int(self.first_hour[slot]), hour)
+
+    def record(self, lat, lon, weather_data, timestamp=None):
+        """Add one observation (as returned by fetch_weather_data) for a location"""
+        hour = int((timestamp if timestamp is not None else time.time()) // 3600)
+        with self._lock:
+            slot = self._slot_for(lat, lon, create=True)
+            if slot < 0:
+                self.dropped_observations += 1
+                return False
+            self._write(slot, hour, float(weather_data.get('rainfall_1h', 0.0)),
+                        float(weather_data['temperature']), float(weather_data['pressure']))
+            return True
+
+    def record_batch(self, lats, lons, weather_data, timestamp=None):
+        """Add one observation per location for the same hour, e.g. a grid sweep"""
+        hour = int((timestamp if timestamp is not None else time.time()) // 3600)
+        rows, cols = self.cell_index(lats, lons)
+        rainfall = np.asarray(weather_data['rainfall_1h'], dtype=np.float64)
+        temperature = np.asarray(weather_data['temperature'], dtype=np.float32)
+        pressure = np.asarray(weather_data['pressure'], dtype=np.float32)
+
+        with self._lock:
+            slots = self.slots[rows, cols].astype(np.int64)
+            for i in np.flatnonzero(slots < 0):
+                slots[i] = self._slot_for(lats[i], lons[i], create=True)
+            stored = slots >= 0
+            self.dropped_observations += int(np.sum(~stored))
+            slots, rainfall = slots[stored], rainfall[stored]
+            temperature, pressure = temperature[stored], pressure[stored]
+
+            # Duplicate cells in one batch keep the last observation
+            slots, unique_index = np.unique(slots[::-1], return_index=True)
+            unique_index = len(rainfall) - 1 - unique_index
+            rainfall = rainfall[unique_index]
+            temperature, pressure = temperature[unique_index], pressure[unique_index]
+
+            new = self.last_hour[slots] < 0
+            self.first_hour[slots[new]] = hour
+            self.last_hour[slots[new]] = hour
+
+            current = self.last_hour[slots] <= hour
+            for i in np.flatnonzero(~current):
+                self._write(int(slots[i]), hour, float(rainfall[i]), float(temperature[i]), float(pressure[i]))
+
+            slots, rainfall = slots[current], rainfall[current]
+            temperature, pressure = temperature[current], pressure[current]
+            self._advance_many(slots, hour)
+
+            position = hour % self.window
+            delta = rainfall - self.rain[slots, position]
+            first_observation = 1 - self.observed[slots, position].astype(np.int32)
+            self.rain[slots, position] = rainfall
+            self.observed[slots, position] = 1
+            self.rain_sums[slots] += delta[:, None]
+            self.rain_counts[slots] += first_observation[:, None]
+            self.temperature[slots, hour % (CHANGE_HOURS + 1)] = temperature
+            self.pressure[slots, hour % (CHANGE_HOURS + 1)] = pressure
+        return int(np.sum(stored))
+
+    def features_batch(self, lats, lons, now=None):
+        """Rainfall sums and 24h changes for many locations
+
+        Returns arrays aligned with the input, NaN wherever a cell has no data
+        or any hour of the feature's window went unobserved.
+        """
+        now = now or datetime.now()
+        hour = int(now.timestamp() // 3600)
+        rows, cols = self.cell_index(np.atleast_1d(lats), np.atleast_1d(lons))
+        n = len(rows)
+
+        result = {name: np.full(n, np.nan) for name in RAIN_FEATURES}
+        result['temperature_change_24h'] = np.full(n, np.nan)
+        result['pressure_change_24h'] = np.full(n, np.nan)
+
+        with self._lock:
+            slots = self.slots[rows, cols].astype(np.int64)
+            known = np.flatnonzero(slots >= 0)
+            if not len(known):
+                return result
+            active = slots[known]
+            unique_active = np.unique(active)
+            self._advance_many(unique_active[self.last_hour[unique_active] < hour], hour)
+
+            sums = self.rain_sums[active]
+            counts = self.rain_counts[active]
+            for index, (name, window) in enumerate(zip(RAIN_FEATURES, RAIN_WINDOWS)):
+                complete = counts[:, index] >= window
+                result[name][known[complete]] = sums[complete, index]
+
+            now_pos = hour % (CHANGE_HOURS + 1)
+            then_pos = (hour - CHANGE_HOURS) % (CHANGE_HOURS + 1)
+            result['temperature_change_24h'][known] = (
+                self.temperature[active, now_pos] - self.temperature[active, then_pos])
+            result['pressure_change_24h'][known] = (
+                self.pressure[active, now_pos] - self.pressure[active, then_pos])
+        return result
+
+    def features(self, lat, lon, now=None):
+        """Measured rolling features for one location (only those available)"""
+        batch = self.features_batch([lat], [lon], now)
+        return {name: float(values[0]) for name, values in batch.items() if not np.isnan(values[0])}
+
+
+def benchmark(directory, n_cells, hours, query_size):
+    """Ingest hourly sweeps for n_cells and time updates and batch queries"""
+    store = WeatherTimeSeriesStore(directory, capacity=n_cells)
+    rng = np.random.default_rng(42)
+    lats = rng.uniform(-60, 60, n_cells)
+    lons = rng.uniform(-180, 180, n_cells)
+    start_hour = int(time.time() // 3600) - hours
+
+    ingest_seconds = 0.0
+    for h in range(hours):
+        weather = {
+            'rainfall_1h': rng.exponential(2, n_cells),
+            'temperature': rng.normal(25, 5, n_cells),
+            'pressure': rng.normal(1013, 10, n_cells)
+        }
+        start = time.perf_counter()
+        store.record_batch(lats, lons, weather, timestamp=(start_hour + h + 1) * 3600)
+        ingest_seconds += time.perf_counter() - start
+
+    sample = rng.choice(n_cells, query_size, replace=False)
+    start = time.perf_counter()
+    features = store.features_batch(lats[sample], lons[sample])
+    query_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in sample[:1000]:
+        store.features(lats[i], lons[i])
+    single_seconds = (time.perf_counter() - start) / min(1000, query_size)
+
+    store.flush()
+    on_disk = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+    print(f"Cells:               {store.n_used:,} (capacity {store.capacity:,})")
+    print(f"Hourly sweeps:       {hours} ({n_cells * hours / ingest_seconds:,.0f} observations/sec)")
+    print(f"Batch query:         {query_size:,} cells in {query_seconds * 1000:.1f} ms")
+    print(f"Single query:        {single_seconds * 1e6:.1f} us")
+    print(f"Store size on disk:  {on_disk / 1e6:.0f} MB (memory-mapped)")
+    print(f"Covered rainfall_24h: {np.mean(~np.isnan(features['rainfall_24h'])):.0%} of queried cells")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the weather time-series store')
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--directory', default=os.path.join(tempfile.gettempdir(), 'guardian_weather_store_benchmark'))
+    parser.add_argument('--cells', type=int, default=100000)
+    parser.add_argument('--hours', type=int, default=48)
+    parser.add_argument('--query-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.directory, args.cells, args.hours, args.query_size)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()